@@ -0,0 +1,145 @@
+"""Cache of answers to questions about documents."""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+
+class CachedAnswer(NamedTuple):
+    answer: Dict[str, Any]
+    sources: List[Document]
+
+
+class _Entry(NamedTuple):
+    answer: Dict[str, Any]
+    sources: List[Document]
+    embedding: Optional[np.ndarray]
+    created: float
+
+
+class AnswerCache:
+    """Thread-safe LRU cache of answers keyed by (document hash, query).
+
+    A lookup first tries the normalized query text. If that misses and the
+    query's embedding is given, it falls back to the cached query for the
+    same document whose embedding is most similar, and reuses its answer if
+    the cosine similarity is at least `similarity_threshold`. Without an
+    embedding, as when embedding the query timed out, only exact matches hit.
+
+    Args:
+        max_entries: Least recently used entries beyond this are evicted.
+        ttl: Seconds after which an entry expires.
+        similarity_threshold: Minimum cosine similarity for a near-duplicate
+            query to reuse an answer.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 24 * 3600,
+        similarity_threshold: float = 0.97,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.monotonic() - entry.created > self.ttl
+
+    def _live_entry(self, key: Tuple[str, str]) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            del self._entries[key]
+            return None
+        return entry
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(
+        self,
+        doc_hash: str,
+        query: str,
+        query_embedding: Optional[List[float]] = None,
+    ) -> Optional[CachedAnswer]:
+        """Return the cached answer and sources for a query, or None."""
+        key = (doc_hash, normalize_query(query))
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return CachedAnswer(entry.answer, entry.sources)
+            candidates = [
+                k
+                for k, e in self._entries.items()
+                if k[0] == doc_hash and e.embedding is not None
+            ]
+            if query_embedding is None or not candidates:
+                self.misses += 1
+                return None
+
+        vector = self._unit(query_embedding)
+        with self._lock:
+            best_key, best_similarity = None, -1.0
+            for k in candidates:
+                entry = self._live_entry(k)
+                if entry is None:
+                    continue
+                similarity = float(np.dot(vector, entry.embedding))  # type: ignore
+                if similarity > best_similarity:
+                    best_key, best_similarity = k, similarity
+            if best_key is None or best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.similar_hits += 1
+            entry = self._entries[best_key]
+            return CachedAnswer(entry.answer, entry.sources)
+
+    def put(
+        self,
+        doc_hash: str,
+        query: str,
+        answer: Dict[str, Any],
+        sources: List[Document],
+        query_embedding: Optional[List[float]] = None,
+    ) -> None:
+        """Cache an answer. If the query's embedding is given, near-duplicate
+        queries can reuse it."""
+        embedding = None
+        if query_embedding is not None:
+            embedding = self._unit(query_embedding)
+        key = (doc_hash, normalize_query(query))
+        with self._lock:
+            self._entries[key] = _Entry(answer, sources, embedding, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
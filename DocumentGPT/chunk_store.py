@@ -0,0 +1,150 @@
+"""Compact, array-backed storage for the chunks of a document."""
+from array import array
+from typing import Any, Dict, Iterator, List, Mapping, Sequence, Union
+
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+
+class ChunkView:
+    """Lightweight, Document-like view of one chunk in a ChunkStore."""
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: "ChunkStore", index: int) -> None:
+        self.store = store
+        self.index = index
+
+    @property
+    def page_content(self) -> str:
+        return self.store.text(self.index)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.store.metadata(self.index)
+
+    def to_document(self) -> Document:
+        return self.store.document(self.index)
+
+
+class ChunkStore:
+    """Chunks of a document packed into one UTF-8 buffer plus integer columns.
+
+    Chunk i is ``buffer[offsets[i]:offsets[i + 1]]`` and its page and
+    per-page chunk numbers are ``pages[i]`` and ``chunks[i]``. Compared with
+    one langchain Document (and metadata dict) per chunk, this costs a few
+    bytes per chunk beyond the text itself. Full Documents are only built on
+    demand, e.g. for the results of a search.
+    """
+
+    __slots__ = ("buffer", "offsets", "pages", "chunks")
+
+    def __init__(
+        self, buffer: bytes, offsets: array, pages: array, chunks: array
+    ) -> None:
+        self.buffer = buffer
+        self.offsets = offsets
+        self.pages = pages
+        self.chunks = chunks
+
+    @classmethod
+    def from_pages(cls, page_chunks: Sequence[Sequence[str]]) -> "ChunkStore":
+        """Build a store from the chunks of each page (pages numbered from 1)."""
+        parts: List[bytes] = []
+        offsets = array("q", [0])
+        pages = array("i")
+        chunks = array("i")
+        for page, texts in enumerate(page_chunks, start=1):
+            for i, text in enumerate(texts):
+                encoded = text.encode("utf-8")
+                parts.append(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+                pages.append(page)
+                chunks.append(i)
+        return cls(b"".join(parts), offsets, pages, chunks)
+
+    def __getstate__(self) -> tuple:
+        return (self.buffer, self.offsets, self.pages, self.chunks)
+
+    def __setstate__(self, state: tuple) -> None:
+        self.buffer, self.offsets, self.pages, self.chunks = state
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def __getitem__(self, index: int) -> ChunkView:
+        if not -len(self) <= index < len(self):
+            raise IndexError("chunk index out of range")
+        return ChunkView(self, index % len(self))
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        return (ChunkView(self, i) for i in range(len(self)))
+
+    def text(self, index: int) -> str:
+        return self.buffer[self.offsets[index] : self.offsets[index + 1]].decode("utf-8")
+
+    def texts(self) -> List[str]:
+        return [self.text(i) for i in range(len(self))]
+
+    def source(self, index: int) -> str:
+        return f"{self.pages[index]}-{self.chunks[index]}"
+
+    def metadata(self, index: int) -> Dict[str, Any]:
+        return {
+            "page": self.pages[index],
+            "chunk": self.chunks[index],
+            "source": self.source(index),
+        }
+
+    def document(self, index: int) -> Document:
+        return Document(page_content=self.text(index), metadata=self.metadata(index))
+
+
+class ChunkDocstore(Docstore):
+    """Docstore over a ChunkStore; ids are chunk positions as strings."""
+
+    def __init__(self, store: ChunkStore) -> None:
+        self.store = store
+
+    def search(self, search: str) -> Union[str, Document]:
+        index = int(search)
+        if not 0 <= index < len(self.store):
+            return f"ID {search} not found."
+        return self.store.document(index)
+
+
+class ChunkIds(Mapping[int, str]):
+    """FAISS row -> docstore id map for a ChunkStore, without one dict entry
+    per chunk: row i is chunk i."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def __getitem__(self, key: int) -> str:
+        if not 0 <= key < self.size:
+            raise KeyError(key)
+        return str(key)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.size))
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def faiss_from_chunks(store: ChunkStore, embeddings: Embeddings) -> FAISS:
+    """Embed the chunks of a store and index them in a FAISS vectorstore
+    that reads chunks straight from the store."""
+    faiss = dependable_faiss_import()
+    vectors = np.array(embeddings.embed_documents(store.texts()), dtype=np.float32)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return FAISS(
+        embeddings.embed_query,
+        index,
+        ChunkDocstore(store),
+        ChunkIds(len(store)),  # type: ignore
+    )
@@ -0,0 +1,149 @@
+"""Token-based chunking of parsed documents."""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", ".", "!", "?", ",", " "]
+
+
+class TokenChunker:
+    """Splits text into chunks of at most `chunk_size` tiktoken tokens.
+
+    Like langchain's RecursiveCharacterTextSplitter, chunks end at the
+    coarsest separator that keeps them small enough, falling back to finer
+    separators and finally to token boundaries. Unlike it, sizes are measured
+    in tokens, and text is only encoded once: all pages go through one
+    batched tiktoken call, and the token count of any span is then read off
+    prefix sums of the token byte offsets with numpy.
+
+    One chunker (and its encoder) can be reused across pages and documents.
+
+    Args:
+        chunk_size: Maximum number of tokens per chunk.
+        chunk_overlap: Approximate number of tokens to repeat at the start of
+            the next chunk. The overlap starts at a separator, so it may be
+            shorter.
+        separators: Separators to split on, coarsest first. Separators stay
+            attached to the end of the text they follow.
+        encoding_name: tiktoken encoding used to count tokens.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 200,
+        chunk_overlap: int = 0,
+        separators: Sequence[str] = DEFAULT_SEPARATORS,
+        encoding_name: str = "cl100k_base",
+    ) -> None:
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"Chunk overlap ({chunk_overlap}) must be smaller than the "
+                f"chunk size ({chunk_size})."
+            )
+        try:
+            import tiktoken
+        except ImportError:
+            raise ValueError(
+                "Could not import tiktoken python package. "
+                "Please it install it with `pip install tiktoken`."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = [separator.encode("utf-8") for separator in separators]
+        self._encoding: Any = tiktoken.get_encoding(encoding_name)
+        self._token_lengths: Optional[np.ndarray] = None
+
+    @property
+    def token_lengths(self) -> np.ndarray:
+        """Length in bytes of every token id in the vocabulary."""
+        if self._token_lengths is None:
+            lengths = np.zeros(self._encoding.n_vocab, dtype=np.int64)
+            for token in range(self._encoding.n_vocab):
+                try:
+                    lengths[token] = len(self._encoding.decode_single_token_bytes(token))
+                except KeyError:
+                    # Unused ids between the regular and special tokens.
+                    pass
+            self._token_lengths = lengths
+        return self._token_lengths
+
+    def _boundaries(self, data: np.ndarray, separator: bytes) -> np.ndarray:
+        """Sorted byte offsets just past every occurrence of `separator`."""
+        n = len(data) - len(separator) + 1
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        match = data[:n] == separator[0]
+        for i, byte in enumerate(separator[1:], start=1):
+            match &= data[i : i + n] == byte
+        return np.flatnonzero(match) + len(separator)
+
+    def _split_page(self, page: str, tokens: List[int]) -> List[str]:
+        data = page.encode("utf-8")
+        if not tokens:
+            return []
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        lengths = self.token_lengths[np.array(tokens, dtype=np.int64)]
+        starts = np.cumsum(lengths) - lengths
+        num_tokens = len(tokens)
+        end = len(data)
+        boundaries: Dict[int, np.ndarray] = {}
+
+        def level_boundaries(level: int) -> np.ndarray:
+            # Computed on demand: most pages never need the finer separators.
+            if level not in boundaries:
+                boundaries[level] = self._boundaries(buffer, self.separators[level])
+            return boundaries[level]
+
+        chunks = []
+        pos = 0
+        while pos < end:
+            first = int(np.searchsorted(starts, pos))
+            if first + self.chunk_size >= num_tokens:
+                cut = end
+            else:
+                # Byte offset of the first token that does not fit.
+                limit = int(starts[first + self.chunk_size])
+                cut = 0
+                for level in range(len(self.separators)):
+                    candidates = level_boundaries(level)
+                    i = int(np.searchsorted(candidates, limit, side="right")) - 1
+                    if i >= 0 and candidates[i] > pos:
+                        cut = int(candidates[i])
+                        break
+                if not cut:
+                    # No separator in range: cut on the token boundary, backing
+                    # off to the start of a UTF-8 character.
+                    cut = limit
+                    while cut > pos + 1 and data[cut] & 0xC0 == 0x80:
+                        cut -= 1
+
+            chunk = data[pos:cut].decode("utf-8", errors="ignore").strip()
+            if chunk:
+                chunks.append(chunk)
+            if cut >= end:
+                break
+
+            next_pos = cut
+            if self.chunk_overlap:
+                cut_token = int(np.searchsorted(starts, cut))
+                overlap_start = int(starts[max(cut_token - self.chunk_overlap, first)])
+                # The overlap must hold more than the whitespace before the cut.
+                content_end = len(data[:cut].rstrip())
+                for level in range(len(self.separators)):
+                    candidates = level_boundaries(level)
+                    i = int(np.searchsorted(candidates, overlap_start))
+                    if i < len(candidates) and pos < candidates[i] < content_end:
+                        next_pos = int(candidates[i])
+                        break
+            pos = next_pos
+        return chunks
+
+    def split_pages(self, pages: Sequence[str]) -> List[List[str]]:
+        """Split each page into chunks; returns one list of chunks per page."""
+        page_tokens = self._encoding.encode_ordinary_batch(list(pages))
+        return [
+            self._split_page(page, tokens) for page, tokens in zip(pages, page_tokens)
+        ]
+
+    def split_text(self, text: str) -> List[str]:
+        return self.split_pages([text])[0]
@@ -0,0 +1,116 @@
+"""Token-budgeted packing of retrieved chunks into a prompt."""
+import re
+from typing import Any, List, NamedTuple, Sequence, Set, Tuple
+
+from langchain.docstore.document import Document
+
+from lexical import tokenize
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# How the stuff chain formats each chunk, and what joins them.
+DOCUMENT_TEMPLATE = "Content: {page_content}\nSource: {source}"
+DOCUMENT_SEPARATOR = "\n\n"
+# Upper bound on the tokens the template and separator add to a chunk, for
+# source keys of up to four-digit pages and chunk numbers.
+CHUNK_OVERHEAD_TOKENS = 20
+
+
+class PackedContext(NamedTuple):
+    docs: List[Document]
+    num_tokens: int
+    num_dropped: int
+    num_trimmed: int
+
+
+class ContextPacker:
+    """Fills a token budget with retrieved chunks in relevance order.
+
+    Chunks are taken best first. A chunk whose word pairs are mostly
+    (`redundancy_threshold`) already in the packed chunks is dropped, as
+    overlapping chunks add tokens but no information. The chunk that
+    crosses the budget is trimmed to the longest run of whole sentences that
+    fits, and packing stops there.
+
+    Args:
+        max_tokens: Token budget for the formatted chunks.
+        redundancy_threshold: Fraction of a chunk's word pairs already
+            present above which the chunk is dropped.
+        encoding_name: tiktoken encoding used to count tokens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 1000,
+        redundancy_threshold: float = 0.8,
+        encoding_name: str = "cl100k_base",
+    ) -> None:
+        try:
+            import tiktoken
+        except ImportError:
+            raise ValueError(
+                "Could not import tiktoken python package. "
+                "Please it install it with `pip install tiktoken`."
+            )
+        self.max_tokens = max_tokens
+        self.redundancy_threshold = redundancy_threshold
+        self._encoding: Any = tiktoken.get_encoding(encoding_name)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._encoding.encode_ordinary(text))
+
+    @staticmethod
+    def _shingles(text: str) -> Set[Tuple[str, str]]:
+        words = tokenize(text)
+        return set(zip(words, words[1:])) or {(word, "") for word in words}
+
+    def _trim(self, text: str, budget: int) -> str:
+        """The longest prefix of whole sentences of `text` within `budget`
+        tokens, or an empty string."""
+        sentences = SENTENCE_END.split(text)
+        lengths = [
+            len(tokens) for tokens in self._encoding.encode_ordinary_batch(sentences)
+        ]
+        used = 0
+        kept = 0
+        for length in lengths:
+            # +1 for the whitespace between sentences.
+            if used + length + (1 if kept else 0) > budget:
+                break
+            used += length + (1 if kept else 0)
+            kept += 1
+        return " ".join(sentences[:kept])
+
+    def pack(self, docs: Sequence[Document]) -> PackedContext:
+        """Pack chunks, given best first, into the token budget."""
+        packed: List[Document] = []
+        seen: Set[Tuple[str, str]] = set()
+        used = 0
+        dropped = 0
+        trimmed = 0
+        separator_tokens = self.count_tokens(DOCUMENT_SEPARATOR)
+        for i, doc in enumerate(docs):
+            shingles = self._shingles(doc.page_content)
+            overlap = len(shingles & seen)
+            if shingles and overlap >= self.redundancy_threshold * len(shingles):
+                dropped += 1
+                continue
+
+            overhead = self.count_tokens(
+                DOCUMENT_TEMPLATE.format(page_content="", source=doc.metadata["source"])
+            ) + (separator_tokens if packed else 0)
+            content_tokens = self.count_tokens(doc.page_content)
+            if used + overhead + content_tokens <= self.max_tokens:
+                packed.append(doc)
+                seen |= shingles
+                used += overhead + content_tokens
+                continue
+
+            content = self._trim(doc.page_content, self.max_tokens - used - overhead)
+            if content:
+                packed.append(Document(page_content=content, metadata=doc.metadata))
+                used += overhead + self.count_tokens(content)
+                trimmed += 1
+            dropped += len(docs) - i - (1 if content else 0)
+            break
+        return PackedContext(packed, used, dropped, trimmed)
@@ -0,0 +1,176 @@
+"""Vector index over a corpus of many documents."""
+import math
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import dependable_faiss_import
+
+FLAT = "flat"
+IVF = "ivf"
+HNSW = "hnsw"
+
+
+class CorpusIndex:
+    """FAISS index over many documents that can grow and shrink in place.
+
+    Documents are added and removed by id without rebuilding the index, and
+    every chunk carries its document's id in ``metadata["doc_id"]``. Small
+    corpora use an exact flat index. Once the corpus grows past
+    `flat_max_size` chunks, the index is rebuilt once as `large_index_type`
+    (IVF or HNSW), whose search cost grows sublinearly. An IVF index is
+    retrained whenever the corpus has grown 4x since it was trained.
+
+    HNSW cannot delete vectors, so removed chunks are filtered out of its
+    results and purged by a rebuild once they make up a fifth of the index.
+
+    Args:
+        embeddings: Used to embed chunks and queries.
+        dim: Dimension of the embeddings.
+        flat_max_size: Largest corpus, in chunks, kept in a flat index.
+        large_index_type: "ivf" or "hnsw", used above `flat_max_size`.
+        nprobe: Number of IVF lists searched per query.
+        hnsw_m: Number of neighbours per HNSW node.
+        ef_search: HNSW search depth.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        dim: int = 1536,
+        flat_max_size: int = 20_000,
+        large_index_type: str = IVF,
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+        ef_search: int = 128,
+    ) -> None:
+        if large_index_type not in (IVF, HNSW):
+            raise ValueError(f"Unknown index type {large_index_type!r}")
+        self.embeddings = embeddings
+        self.dim = dim
+        self.flat_max_size = flat_max_size
+        self.large_index_type = large_index_type
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+
+        self._faiss = dependable_faiss_import()
+        self._lock = threading.RLock()
+        self._next_id = 0
+        self._chunks: Dict[int, Document] = {}
+        # doc_id -> (chunk ids, vectors), kept to rebuild the index.
+        self._documents: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._deleted: Set[int] = set()
+        self._trained_size = 0
+        self.index_type = FLAT
+        self._index = self._new_index(FLAT, np.empty((0, dim), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    @property
+    def document_ids(self) -> List[str]:
+        return list(self._documents)
+
+    def _new_index(self, index_type: str, vectors: np.ndarray):
+        faiss = self._faiss
+        if index_type == FLAT:
+            return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
+        if index_type == HNSW:
+            hnsw = faiss.IndexHNSWFlat(self.dim, self.hnsw_m)
+            hnsw.hnsw.efSearch = self.ef_search
+            return faiss.IndexIDMap2(hnsw)
+        # IVF needs ~39 training points per list.
+        nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(self.dim), self.dim, nlist)
+        index.train(vectors)
+        index.nprobe = self.nprobe
+        self._trained_size = len(vectors)
+        return index
+
+    def _rebuild(self, index_type: str) -> None:
+        """Build a fresh index of `index_type` from the stored vectors."""
+        if self._documents:
+            ids = np.concatenate([ids for ids, _ in self._documents.values()])
+            vectors = np.concatenate([v for _, v in self._documents.values()])
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            vectors = np.empty((0, self.dim), dtype=np.float32)
+        index = self._new_index(index_type, vectors)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        self._index = index
+        self.index_type = index_type
+        self._deleted.clear()
+
+    def _maybe_rebuild(self) -> None:
+        size = len(self._chunks)
+        if size <= self.flat_max_size:
+            wanted = FLAT
+        else:
+            wanted = self.large_index_type
+        if wanted != self.index_type:
+            self._rebuild(wanted)
+        elif wanted == IVF and size > 4 * self._trained_size:
+            self._rebuild(IVF)
+        elif self._deleted and len(self._deleted) * 5 > self._index.ntotal:
+            self._rebuild(self.index_type)
+
+    def add_document(
+        self,
+        doc_id: str,
+        docs: List[Document],
+        vectors: Optional[List[List[float]]] = None,
+    ) -> None:
+        """Add (or replace) a document's chunks. Chunks are embedded unless
+        their `vectors` are given."""
+        if vectors is None:
+            vectors = self.embeddings.embed_documents([d.page_content for d in docs])
+        array = np.asarray(vectors, dtype=np.float32).reshape(len(docs), self.dim)
+        with self._lock:
+            if doc_id in self._documents:
+                self.remove_document(doc_id)
+            ids = np.arange(self._next_id, self._next_id + len(docs), dtype=np.int64)
+            self._next_id += len(docs)
+            for chunk_id, doc in zip(ids.tolist(), docs):
+                self._chunks[chunk_id] = Document(
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, "doc_id": doc_id},
+                )
+            self._documents[doc_id] = (ids, array)
+            if len(ids):
+                self._index.add_with_ids(array, ids)
+            self._maybe_rebuild()
+
+    def remove_document(self, doc_id: str) -> None:
+        """Remove a document's chunks from the corpus."""
+        with self._lock:
+            ids, _ = self._documents.pop(doc_id)
+            for chunk_id in ids.tolist():
+                del self._chunks[chunk_id]
+            if self.index_type == HNSW:
+                self._deleted.update(ids.tolist())
+            elif len(ids):
+                self._index.remove_ids(ids)
+            self._maybe_rebuild()
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 5
+    ) -> List[Document]:
+        query = np.asarray([embedding], dtype=np.float32)
+        with self._lock:
+            _, ids = self._index.search(query, k + len(self._deleted))
+            docs = []
+            for chunk_id in ids[0].tolist():
+                if chunk_id == -1 or chunk_id in self._deleted:
+                    continue
+                docs.append(self._chunks[chunk_id])
+                if len(docs) == k:
+                    break
+            return docs
+
+    def similarity_search(self, query: str, k: int = 5) -> List[Document]:
+        """Return the `k` chunks across the corpus most similar to the query."""
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
@@ -0,0 +1,193 @@
+"""Disk-backed embedding cache shared by every DocumentGPT process on a host."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Sequence
+
+# SQLite limits the number of host parameters in a single statement.
+_MAX_PARAMS = 500
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a chunk share an
+    entry."""
+    return " ".join(text.split())
+
+
+def cache_key(model_name: str, text: str) -> bytes:
+    return hashlib.sha256(
+        f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    ).digest()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache stored in a SQLite file.
+
+    Entries are keyed by hash(model name, normalized text) and hold the vector
+    as packed float32. The database runs in WAL mode so several Streamlit
+    worker processes can read and write it at once. The total size of the
+    stored vectors is kept in a one-row table, updated with every write; when
+    it exceeds `max_bytes`, the least recently used entries are evicted.
+
+    Args:
+        path: Path of the SQLite file. Parent directories are created.
+        max_bytes: Upper bound on the total size of the stored vectors.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access"
+            " ON embeddings (last_access)"
+        )
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS embedding_stats ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " bytes INTEGER NOT NULL)"
+        )
+        # Counted once, for a cache written before the table existed.
+        self._connection().execute(
+            "INSERT OR IGNORE INTO embedding_stats (id, bytes)"
+            " SELECT 0, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Connections cannot be pickled or copied; a copy of the cache opens
+        # its own connections to the same file.
+        return {"path": self.path, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["path"], state["max_bytes"])  # type: ignore
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections are not thread-safe."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(
+        self, model_name: str, texts: Sequence[str]
+    ) -> List[Optional[List[float]]]:
+        """Look up embeddings for texts, returning None for every miss."""
+        keys = [cache_key(model_name, text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[bytes, List[float]] = {}
+        conn = self._connection()
+        for i in range(0, len(unique_keys), _MAX_PARAMS):
+            chunk = unique_keys[i : i + _MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            for key, vector in conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                chunk,
+            ):
+                found[key] = array("f", vector).tolist()
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+
+        results = [found.get(key) for key in keys]
+        num_hits = sum(result is not None for result in results)
+        with self._stats_lock:
+            self.hits += num_hits
+            self.misses += len(results) - num_hits
+        return results
+
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model_name, [text])[0]
+
+    def put_many(
+        self,
+        model_name: str,
+        texts: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+    ) -> None:
+        """Store embeddings for texts, then evict down to `max_bytes`."""
+        now = time.time()
+        vectors = {
+            cache_key(model_name, text): array("f", embedding).tobytes()
+            for text, embedding in zip(texts, embeddings)
+        }
+        keys = list(vectors)
+        conn = self._connection()
+        # One write transaction, so the byte count stays in step with the
+        # rows whatever other processes write meanwhile.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            replaced = 0
+            for i in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[i : i + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                (size,) = conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                    f" WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchone()
+                replaced += size
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access)"
+                " VALUES (?, ?, ?)",
+                [(key, vector, now) for key, vector in vectors.items()],
+            )
+            added = sum(len(vector) for vector in vectors.values()) - replaced
+            (total,) = conn.execute(
+                "UPDATE embedding_stats SET bytes = bytes + ? RETURNING bytes",
+                (added,),
+            ).fetchone()
+            if total > self.max_bytes:
+                self._evict(conn, total - self.max_bytes)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def put(self, model_name: str, text: str, embedding: Sequence[float]) -> None:
+        self.put_many(model_name, [text], [embedding])
+
+    def _evict(self, conn: sqlite3.Connection, excess: int) -> None:
+        """Delete least recently used entries holding at least `excess` bytes.
+        Call inside a write transaction."""
+        stale = []
+        freed = 0
+        for key, size in conn.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access"
+        ):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", stale)
+        conn.execute("UPDATE embedding_stats SET bytes = bytes - ?", (freed,))
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters for this process plus the size of the store."""
+        conn = self._connection()
+        (entries,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        (num_bytes,) = conn.execute("SELECT bytes FROM embedding_stats").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": num_bytes,
+        }
@@ -1,18 +1,61 @@
 """Wrapper around OpenAI embedding models."""
-from typing import Any, Dict, List, Optional
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from langchain.embeddings.base import Embeddings
 from langchain.utils import get_from_dict_or_env
-from openai.error import APIConnectionError, APIError, RateLimitError, Timeout
+from openai.error import (
+    APIConnectionError,
+    APIError,
+    InvalidRequestError,
+    RateLimitError,
+    Timeout,
+)
 from pydantic import BaseModel, Extra, root_validator
 from tenacity import (
     retry,
     retry_if_exception_type,
     stop_after_attempt,
-    wait_exponential,
+    wait_random_exponential,
+)
+
+from common.rate_limit import RateLimiter, get_rate_limiter
+from common.tracing import span
+from embedding_cache import EmbeddingCache
+
+# Requests are paced client-side by a RateLimiter, so a 429 here is rare and
+# only needs a short, jittered wait before retrying.
+_embedding_retry = retry(
+    reraise=True,
+    stop=stop_after_attempt(100),
+    wait=wait_random_exponential(multiplier=1, min=1, max=60),
+    retry=(
+        retry_if_exception_type(Timeout)
+        | retry_if_exception_type(APIError)
+        | retry_if_exception_type(APIConnectionError)
+        | retry_if_exception_type(RateLimitError)
+    ),
 )
 
 
+@lru_cache(maxsize=None)
+def _get_encoding(model_name: str) -> Any:
+    """Get (and memoize) the tiktoken encoding used by an embedding model."""
+    try:
+        import tiktoken
+    except ImportError:
+        raise ValueError(
+            "Could not import tiktoken python package. "
+            "Please it install it with `pip install tiktoken`."
+        )
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
 class OpenAIEmbeddings(BaseModel, Embeddings):
     """Wrapper around OpenAI embedding models.
 
@@ -31,11 +74,27 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
     document_model_name: str = "text-embedding-ada-002"
     query_model_name: str = "text-embedding-ada-002"
     openai_api_key: Optional[str] = None
+    batch_size: int = 1000
+    """Maximum number of texts to send in a single request. Set to 1 to
+    embed one text per request."""
+    max_tokens_per_batch: int = 100_000
+    """Maximum number of tokens (measured with tiktoken) in a single request."""
+    max_concurrency: int = 4
+    """Maximum number of requests in flight at once."""
+    requests_per_minute: Optional[int] = 3000
+    """Client-side requests/min limit shared by all clients using the same API
+    key. None disables it."""
+    tokens_per_minute: Optional[int] = 1_000_000
+    """Client-side tokens/min limit shared by all clients using the same API
+    key. None disables it."""
+    cache: Optional[EmbeddingCache] = None
+    """Persistent cache consulted before calling the API."""
 
     class Config:
         """Configuration for this pydantic object."""
 
         extra = Extra.forbid
+        arbitrary_types_allowed = True
 
     @root_validator(pre=True, allow_reuse=True)
     def get_model_names(cls, values: Dict) -> Dict:
@@ -66,6 +125,7 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
             import openai
 
             openai.api_key = openai_api_key
+            values["openai_api_key"] = openai_api_key
             values["client"] = openai.Embedding
         except ImportError:
             raise ValueError(
@@ -74,37 +134,137 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
             )
         return values
 
-    @retry(
-        reraise=True,
-        stop=stop_after_attempt(100),
-        wait=wait_exponential(multiplier=1, min=10, max=60),
-        retry=(
-            retry_if_exception_type(Timeout)
-            | retry_if_exception_type(APIError)
-            | retry_if_exception_type(APIConnectionError)
-            | retry_if_exception_type(RateLimitError)
-        ),
-    )
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        return get_rate_limiter(
+            self.openai_api_key, self.requests_per_minute, self.tokens_per_minute
+        )
+
+    def _count_tokens(self, texts: List[str], *, engine: str) -> List[int]:
+        return [
+            len(tokens)
+            for tokens in _get_encoding(engine).encode_ordinary_batch(texts)
+        ]
+
+    @_embedding_retry
     def _embedding_func(self, text: str, *, engine: str) -> List[float]:
         """Call out to OpenAI's embedding endpoint with exponential backoff."""
         # replace newlines, which can negatively affect performance.
         text = text.replace("\n", " ")
-        return self.client.create(input=[text], engine=engine)["data"][0]["embedding"]
+        num_tokens = self._count_tokens([text], engine=engine)[0]
+        self.rate_limiter.acquire(num_tokens)
+        with span("openai.embedding", inputs=1, tokens=num_tokens):
+            response = self.client.create(
+                input=[text], engine=engine, api_key=self.openai_api_key
+            )
+        return response["data"][0]["embedding"]
+
+    @_embedding_retry
+    def _batch_embedding_func(
+        self, texts: List[str], num_tokens: int, *, engine: str
+    ) -> List[List[float]]:
+        """Embed several texts in one request, with exponential backoff."""
+        self.rate_limiter.acquire(num_tokens)
+        with span("openai.embedding", inputs=len(texts), tokens=num_tokens):
+            response = self.client.create(
+                input=texts, engine=engine, api_key=self.openai_api_key
+            )
+        # The endpoint does not promise to return the inputs in order.
+        data = sorted(response["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in data]
+
+    def _embed_with_split(
+        self, batch: List[Tuple[str, int]], *, engine: str
+    ) -> List[List[float]]:
+        """Embed a batch of (text, num_tokens) pairs, halving it whenever the
+        endpoint rejects it as too large."""
+        try:
+            return self._batch_embedding_func(
+                [text for text, _ in batch],
+                sum(num_tokens for _, num_tokens in batch),
+                engine=engine,
+            )
+        except InvalidRequestError:
+            if len(batch) == 1:
+                raise
+            mid = len(batch) // 2
+            return self._embed_with_split(
+                batch[:mid], engine=engine
+            ) + self._embed_with_split(batch[mid:], engine=engine)
+
+    def _iter_batches(
+        self, texts: List[str], *, engine: str
+    ) -> Iterator[List[Tuple[str, int]]]:
+        """Pack consecutive texts into batches of (text, num_tokens) pairs
+        bounded by `batch_size` and `max_tokens_per_batch`."""
+        batch: List[Tuple[str, int]] = []
+        batch_tokens = 0
+        for text, num_tokens in zip(texts, self._count_tokens(texts, engine=engine)):
+            if batch and (
+                len(batch) >= self.batch_size
+                or batch_tokens + num_tokens > self.max_tokens_per_batch
+            ):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append((text, num_tokens))
+            batch_tokens += num_tokens
+        if batch:
+            yield batch
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Call out to OpenAI's embedding endpoint for embedding search docs.
 
+        Texts found in `cache` are not sent to the endpoint.
+
         Args:
             texts: The list of texts to embed.
 
         Returns:
             List of embeddings, one for each text.
         """
-        responses = [
-            self._embedding_func(text, engine=self.document_model_name)
-            for text in texts
-        ]
-        return responses
+        if self.cache is None:
+            return self._embed_documents(texts)
+
+        embeddings = self.cache.get_many(self.document_model_name, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            new_embeddings = self._embed_documents(missing_texts)
+            self.cache.put_many(self.document_model_name, missing_texts, new_embeddings)
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+        return embeddings  # type: ignore
+
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        engine = self.document_model_name
+        if self.batch_size <= 1 and self.max_concurrency <= 1:
+            return [self._embedding_func(text, engine=engine) for text in texts]
+
+        # replace newlines, which can negatively affect performance.
+        texts = [text.replace("\n", " ") for text in texts]
+        batches = list(self._iter_batches(texts, engine=engine))
+        if self.max_concurrency <= 1 or len(batches) <= 1:
+            results = [self._embed_with_split(batch, engine=engine) for batch in batches]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(batches))
+            ) as executor:
+                # Each batch runs in a copy of the caller's context, so its
+                # spans nest under the caller's.
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._embed_with_split,
+                        batch,
+                        engine=engine,
+                    )
+                    for batch in batches
+                ]
+                # Collect in submission order so every embedding lands in its
+                # input's slot, however the responses arrive.
+                results = [future.result() for future in futures]
+
+        return [embedding for result in results for embedding in result]
 
     def embed_query(self, text: str) -> List[float]:
         """Call out to OpenAI's embedding endpoint for embedding query text.
@@ -115,5 +275,11 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
         Returns:
             Embeddings for the text.
         """
+        if self.cache is not None:
+            embedding = self.cache.get(self.query_model_name, text)
+            if embedding is not None:
+                return embedding
         embedding = self._embedding_func(text, engine=self.query_model_name)
+        if self.cache is not None:
+            self.cache.put(self.query_model_name, text, embedding)
         return embedding
@@ -0,0 +1,172 @@
+"""On-disk store of FAISS indexes keyed by the hash of the source document."""
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import FAISS, dependable_faiss_import
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+META_FILE = "meta.json"
+# Bump when the layout of a stored index or its docstore changes.
+FORMAT_VERSION = 1
+
+
+class IndexStore:
+    """Keeps built FAISS indexes and their chunk docstores on disk.
+
+    Each index lives in its own directory named after the document hash, in
+    the layout written by `FAISS.save_local`. Indexes are memory-mapped on
+    load, so a known document is searchable without rebuilding or reading the
+    whole index into memory. An index is only loaded for the embedding model
+    and chunking settings it was built with. Once the store exceeds
+    `max_bytes`, the least recently loaded indexes are deleted.
+
+    Args:
+        root: Directory holding one subdirectory per index.
+        max_bytes: Upper bound on the total size of the stored indexes.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 4 << 30) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    @staticmethod
+    def _settings(model_name: str, chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+        return {
+            "format_version": FORMAT_VERSION,
+            "model_name": model_name,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+        }
+
+    @staticmethod
+    def _read_meta(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(
+        self,
+        key: str,
+        embeddings: Embeddings,
+        model_name: str = "",
+        chunk_size: int = 0,
+        chunk_overlap: int = 0,
+    ) -> Optional[FAISS]:
+        """Load the index stored under `key`, or None if there is none or it
+        was built with a different format, embedding model or chunking."""
+        path = self._path(key)
+        settings = self._settings(model_name, chunk_size, chunk_overlap)
+        faiss = dependable_faiss_import()
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        # A save() of the same key may swap the directory while it is read;
+        # the index and docstore only go together if the meta is unchanged.
+        for _ in range(3):
+            meta = self._read_meta(path)
+            if meta is None or any(meta.get(name) != value for name, value in settings.items()):
+                return None
+            try:
+                try:
+                    index = faiss.read_index(
+                        os.path.join(path, INDEX_FILE), flags | faiss.IO_FLAG_READ_ONLY
+                    )
+                except RuntimeError:
+                    # Not every index type can be memory-mapped.
+                    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+                with open(os.path.join(path, DOCSTORE_FILE), "rb") as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+            except (OSError, RuntimeError):
+                continue
+            if self._read_meta(path) != meta:
+                continue
+
+            # The directory's mtime records the last use, for eviction.
+            os.utime(path)
+            return FAISS(embeddings.embed_query, index, docstore, index_to_docstore_id)
+        return None
+
+    def save(
+        self,
+        key: str,
+        index: FAISS,
+        model_name: str = "",
+        chunk_size: int = 0,
+        chunk_overlap: int = 0,
+    ) -> None:
+        """Store an index under `key`, replacing any stored before, then evict
+        down to `max_bytes`."""
+        # Write to a scratch directory and rename it into place, so other
+        # processes never see a half-written index.
+        tmp_path = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        old_path = None
+        try:
+            index.save_local(tmp_path)
+            with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                json.dump(
+                    {
+                        **self._settings(model_name, chunk_size, chunk_overlap),
+                        "created": time.time(),
+                    },
+                    f,
+                )
+            path = self._path(key)
+            if os.path.isdir(path):
+                # A directory cannot be renamed over a non-empty one: move
+                # the old index aside, and delete it once the new one is in.
+                old_path = tempfile.mkdtemp(dir=self.root, prefix=".old-")
+                try:
+                    os.replace(path, os.path.join(old_path, key))
+                except OSError:
+                    # Another process replaced it in the meantime.
+                    pass
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # Another process stored the same document in the meantime.
+                pass
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if old_path is not None:
+                shutil.rmtree(old_path, ignore_errors=True)
+        self._evict(keep=key)
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(last use, size in bytes, key) for every stored index."""
+        entries = []
+        for key in os.listdir(self.root):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(path, name))
+                    for name in os.listdir(path)
+                )
+                entries.append((os.path.getmtime(path), size, key))
+            except OSError:
+                # Deleted by another process in the meantime.
+                continue
+        return entries
+
+    def _evict(self, keep: str) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
@@ -0,0 +1,90 @@
+"""Local keyword search over the chunks of a document."""
+import math
+import re
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from chunk_store import ChunkStore
+
+# Words, plus dotted or hyphenated runs such as clause numbers ("4.2.1").
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the chunks of a ChunkStore.
+
+    Each term maps to parallel arrays of chunk positions and term
+    frequencies, so scoring a query touches only the postings of its terms.
+    """
+
+    def __init__(self, store: ChunkStore, k1: float = 1.5, b: float = 0.75) -> None:
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        postings: Dict[str, Tuple[array, array]] = defaultdict(
+            lambda: (array("i"), array("i"))
+        )
+        lengths = np.zeros(len(store), dtype=np.float32)
+        for i in range(len(store)):
+            terms = tokenize(store.text(i))
+            lengths[i] = len(terms)
+            for term, count in Counter(terms).items():
+                ids, counts = postings[term]
+                ids.append(i)
+                counts.append(count)
+        self.postings = dict(postings)
+        self.doc_lengths = lengths
+        self.avg_doc_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    def _idf(self, num_docs_with_term: int) -> float:
+        n = len(self.store)
+        return math.log(1 + (n - num_docs_with_term + 0.5) / (num_docs_with_term + 0.5))
+
+    def search_with_scores(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        """Return up to `k` chunks matching the query, best first."""
+        scores = np.zeros(len(self.store), dtype=np.float32)
+        norm = self.k1 * (
+            1 - self.b + self.b * self.doc_lengths / (self.avg_doc_length or 1)
+        )
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, counts = self.postings[term]
+            ids_array = np.frombuffer(ids, dtype=np.int32)
+            tf = np.frombuffer(counts, dtype=np.int32).astype(np.float32)
+            scores[ids_array] += (
+                self._idf(len(ids)) * tf * (self.k1 + 1) / (tf + norm[ids_array])
+            )
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(self.store.document(int(i)), float(scores[i])) for i in matches]
+
+    def search(self, query: str, k: int = 5) -> List[Document]:
+        return [doc for doc, _ in self.search_with_scores(query, k)]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]], k: int = 5, c: int = 60
+) -> List[Document]:
+    """Merge ranked result lists by reciprocal rank fusion. Chunks are
+    identified by their ``source`` metadata."""
+    scores: Dict[str, float] = defaultdict(float)
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            source = doc.metadata["source"]
+            scores[source] += 1 / (c + rank + 1)
+            docs.setdefault(source, doc)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+    return [docs[source] for source in best]
@@ -1,18 +1,20 @@
+import logging
+import os
+import sys
+
 import streamlit as st
-from openai.error import OpenAIError
 
+# The shared `common` package lives at the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.lazy import import_preloaded, preload
 from sidebar import sidebar
-from utils import (
-    embed_docs,
-    get_answer,
-    get_sources,
-    parse_docx,
-    parse_pdf,
-    parse_txt,
-    search_docs,
-    text_to_docs,
-    wrap_text_in_html,
-)
+
+# The document pipeline imports langchain, openai, faiss and the parsers,
+# which takes seconds on a cold start; import it while the page renders.
+preload("utils")
+
+logger = logging.getLogger(__name__)
 
 
 def clear_submit():
@@ -31,8 +33,31 @@ uploaded_file = st.file_uploader(
     on_change=clear_submit,
 )
 
+import_preloaded("utils")
+from openai.error import OpenAIError
+from streaming import StreamingAnswerHandler, split_answer
+from utils import (
+    SEARCH_MODES,
+    build_lexical_index,
+    embed_docs,
+    embed_query,
+    get_embeddings,
+    get_answer,
+    get_answer_cache,
+    get_sources,
+    hash_file,
+    parse_docx,
+    parse_pdf,
+    parse_txt,
+    search_docs,
+    text_to_docs,
+    wrap_text_in_html,
+)
+
 index = None
+lexical_index = None
 doc = None
+doc_hash = None
 if uploaded_file is not None:
     if uploaded_file.name.endswith(".pdf"):
         doc = parse_pdf(uploaded_file)
@@ -43,17 +68,25 @@ if uploaded_file is not None:
     else:
         raise ValueError("File type not supported!")
     text = text_to_docs(doc)
+    doc_hash = hash_file(uploaded_file)
+    lexical_index = build_lexical_index(text, doc_hash)
     try:
         with st.spinner("Indexing document... This may take a while⏳"):
-            index = embed_docs(text)
-        st.session_state["api_key_configured"] = True
+            index = embed_docs(text, doc_hash)
     except OpenAIError as e:
+        # Keyword search still works without the embeddings.
         st.error(e._message)
 
 query = st.text_area("Ask a question about the document", on_change=clear_submit)
 with st.expander("Advanced Options"):
     show_all_chunks = st.checkbox("Show all chunks retrieved from vector search")
     show_full_doc = st.checkbox("Show parsed contents of the document")
+    search_mode = st.selectbox(
+        "Search mode",
+        SEARCH_MODES,
+        help="Lexical search matches keywords locally and needs no embedding "
+        "call; hybrid combines it with vector search.",
+    )
 
 if show_full_doc and doc:
     with st.expander("Document"):
@@ -62,27 +95,73 @@ if show_full_doc and doc:
 
 button = st.button("Submit")
 if button or st.session_state.get("submit"):
-    if not st.session_state.get("api_key_configured"):
+    if not st.session_state.get("OPENAI_API_KEY"):
         st.error("Please configure your OpenAI API key!")
-    elif not index:
+    elif lexical_index is None:
         st.error("Please upload a document!")
     elif not query:
         st.error("Please enter a question!")
     else:
         st.session_state["submit"] = True
+        if index is None and search_mode != "lexical":
+            st.warning(
+                "The document could not be indexed for vector search, so it is"
+                " searched by keywords only."
+            )
+            search_mode = "lexical"
         # Output Columns
         answer_col, sources_col = st.columns(2)
-        sources = search_docs(index, query)
+        answer_cache = get_answer_cache()
 
         try:
-            answer = get_answer(sources, query)
+            # The query is embedded once, for the answer cache's
+            # near-duplicate lookup and for the search, and given up on after
+            # SEARCH_VECTOR_TIMEOUT_SECONDS: then only exact questions hit
+            # the cache, and hybrid search uses the keyword results alone.
+            # Lexical search makes no embedding call. The query is embedded
+            # with this session's key, not that of the session which built
+            # the shared index.
+            query_embedding = None
+            if search_mode != "lexical":
+                embeddings = get_embeddings(st.session_state["OPENAI_API_KEY"])
+                query_embedding = embed_query(embeddings.embed_query, query)
+                if query_embedding is None and search_mode == "hybrid":
+                    search_mode = "lexical"
+                elif query_embedding is None:
+                    # Vector search has nothing to fall back on; wait for
+                    # the embedding, which joins the request in flight.
+                    query_embedding = embeddings.embed_query(query)
+            with answer_col:
+                st.markdown("#### Answer")
+                answer_placeholder = st.empty()
+
+            cached = answer_cache.get(doc_hash, query, query_embedding)
+            if cached is not None:
+                answer, sources = cached
+            else:
+                sources = search_docs(
+                    index,
+                    query,
+                    search_mode,
+                    lexical_index,
+                    query_embedding=query_embedding,
+                )
+                # Render the answer as it is generated; the SOURCES tail is
+                # held back and parsed once the answer is complete.
+                handler = StreamingAnswerHandler(answer_placeholder.markdown)
+                answer = get_answer(sources, query, callbacks=[handler])
+                logger.info(
+                    "Answered in %.2fs, first token after %.2fs, %d prompt tokens",
+                    handler.total_time or 0.0,
+                    handler.time_to_first_token or 0.0,
+                    answer["prompt_tokens"],
+                )
+                answer_cache.put(doc_hash, query, answer, sources, query_embedding)
             if not show_all_chunks:
                 # Get the sources for the answer
                 sources = get_sources(answer, sources)
 
-            with answer_col:
-                st.markdown("#### Answer")
-                st.markdown(answer["output_text"].split("SOURCES: ")[0])
+            answer_placeholder.markdown(split_answer(answer["output_text"])[0])
 
             with sources_col:
                 st.markdown("#### Sources")
@@ -0,0 +1,84 @@
+"""Page-level PDF text extraction, optionally fanned out to a process pool.
+
+Kept apart from utils.py so that pool workers do not import streamlit or
+langchain.
+"""
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional
+
+from pypdf import PdfReader
+
+# Below this many pages, sending the file to the pool costs more than it saves.
+MIN_PAGES_FOR_POOL = 16
+
+# Pools by configured number of workers, started on first use and reused by
+# every call.
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def clean_page_text(text: str) -> str:
+    # Merge hyphenated words
+    text = re.sub(r"(\w+)-\n(\w+)", r"\1\2", text)
+    # Fix newlines in the middle of sentences
+    text = re.sub(r"(?<!\n\s)\n(?!\s\n)", " ", text.strip())
+    # Remove multiple newlines
+    text = re.sub(r"\n\s*\n", "\n\n", text)
+    return text
+
+
+def _get_pool(processes: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            pool = _pools[processes] = ProcessPoolExecutor(max_workers=processes)
+        return pool
+
+
+def _extract_pages(path: str, pages: range) -> List[str]:
+    # Each task parses the file once, and keeps nothing once it is done.
+    reader = PdfReader(path)
+    return [clean_page_text(reader.pages[number].extract_text()) for number in pages]
+
+
+def iter_pdf_pages(
+    file: BytesIO, processes: Optional[int] = None
+) -> Iterator[str]:
+    """Yields the cleaned text of each page of a PDF, in page order.
+
+    Pages are extracted in parallel by a pool of `processes` worker processes
+    (default: one per CPU), which is kept for later calls. Each worker takes
+    one run of consecutive pages. Small documents and ``processes=1`` are
+    handled inline.
+    """
+    data = file.getvalue()
+    reader = PdfReader(BytesIO(data))
+    num_pages = len(reader.pages)
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or num_pages < MIN_PAGES_FOR_POOL:
+        for page in reader.pages:
+            yield clean_page_text(page.extract_text())
+        return
+
+    # Workers read the file from disk rather than receive it with every task.
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # As many tasks as workers, so a call uses the whole pool and no
+        # worker parses the file twice.
+        tasks = min(processes, num_pages)
+        bounds = [num_pages * i // tasks for i in range(tasks + 1)]
+        for pages in _get_pool(processes).map(
+            partial(_extract_pages, path),
+            [range(start, end) for start, end in zip(bounds, bounds[1:])],
+        ):
+            yield from pages
+    finally:
+        os.remove(path)
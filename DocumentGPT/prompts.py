@@ -29,3 +29,16 @@ FINAL ANSWER:"""
 STUFF_PROMPT = PromptTemplate(
     template=template, input_variables=["summaries", "question"]
 )
+
+## Same instructions without the worked example, for a much shorter prompt
+compact_template = """Create a final answer to the given question using the provided document excerpts (in no particular order) as references. ALWAYS end your answer with a "SOURCES:" line listing, comma separated, only the minimal set of sources needed to answer the question. If you are unable to answer the question, simply state that you do not know. Do not attempt to fabricate an answer and leave the SOURCES section empty.
+
+QUESTION: {question}
+=========
+{summaries}
+=========
+FINAL ANSWER:"""
+
+COMPACT_PROMPT = PromptTemplate(
+    template=compact_template, input_variables=["summaries", "question"]
+)
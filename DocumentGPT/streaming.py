@@ -0,0 +1,98 @@
+"""Streaming of answers as the completion is generated."""
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+SOURCES_MARKER = "SOURCES:"
+
+
+def split_answer(text: str) -> Tuple[str, List[str]]:
+    """Split a completion into the answer and the keys listed after its
+    SOURCES section."""
+    answer, marker, sources = text.partition(SOURCES_MARKER)
+    if not marker:
+        return text.strip(), []
+    keys = [key.strip() for key in sources.split(",")]
+    return answer.strip(), [key for key in keys if key]
+
+
+class AnswerStreamParser:
+    """Incrementally separates the answer from the SOURCES tail of a
+    completion that arrives a token at a time.
+
+    Text that could be the start of the marker is held back until the next
+    token shows whether it is, so `answer` never contains part of it.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self._marker_at: Optional[int] = None
+
+    @property
+    def in_sources(self) -> bool:
+        return self._marker_at is not None
+
+    @property
+    def answer(self) -> str:
+        """The answer as far as it is known not to be part of the marker."""
+        if self._marker_at is not None:
+            return self.text[: self._marker_at].strip()
+        for held in range(min(len(SOURCES_MARKER) - 1, len(self.text)), 0, -1):
+            if SOURCES_MARKER.startswith(self.text[-held:]):
+                return self.text[:-held].strip()
+        return self.text.strip()
+
+    @property
+    def source_keys(self) -> List[str]:
+        return split_answer(self.text)[1]
+
+    def feed(self, token: str) -> None:
+        if self._marker_at is None:
+            # Only the tail can complete a marker that started earlier.
+            start = max(0, len(self.text) - len(SOURCES_MARKER) + 1)
+            self.text += token
+            position = self.text.find(SOURCES_MARKER, start)
+            if position != -1:
+                self._marker_at = position
+        else:
+            self.text += token
+
+
+class StreamingAnswerHandler(BaseCallbackHandler):
+    """Callback handler that passes the answer text to `on_answer` as each
+    token arrives, and times the completion.
+
+    `on_answer` is called with the answer so far whenever it changes.
+    `time_to_first_token` and `total_time` are measured in seconds from the
+    start of the LLM call.
+    """
+
+    def __init__(self, on_answer: Callable[[str], None]) -> None:
+        self.on_answer = on_answer
+        self.parser = AnswerStreamParser()
+        self.time_to_first_token: Optional[float] = None
+        self.total_time: Optional[float] = None
+        self._started: Optional[float] = None
+        self._shown = ""
+
+    def on_llm_start(self, serialized: Any, prompts: List[str], **kwargs: Any) -> None:
+        self._started = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.time_to_first_token is None and self._started is not None:
+            self.time_to_first_token = time.perf_counter() - self._started
+        self.parser.feed(token)
+        answer = self.parser.answer
+        if answer != self._shown:
+            self._shown = answer
+            self.on_answer(answer)
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        if self._started is not None:
+            self.total_time = time.perf_counter() - self._started
+        # Release any text held back as a possible start of the marker.
+        answer = split_answer(self.parser.text)[0]
+        if answer != self._shown:
+            self._shown = answer
+            self.on_answer(answer)
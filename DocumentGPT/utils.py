@@ -1,23 +1,57 @@
+import concurrent.futures
+import contextvars
+import hashlib
+import os
 import re
 from io import BytesIO
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Sequence
 
 import docx2txt
 import streamlit as st
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.chains.qa_with_sources import load_qa_with_sources_chain
 from langchain.docstore.document import Document
 from langchain.llms import OpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.prompts import PromptTemplate
 from langchain.vectorstores import VectorStore
-from langchain.vectorstores.faiss import FAISS
-from openai.error import AuthenticationError
-from pypdf import PdfReader
-
+from openai.error import AuthenticationError, OpenAIError
+
+from answer_cache import AnswerCache
+from chunk_store import ChunkStore, faiss_from_chunks
+from chunking import TokenChunker
+from common.clients import get_client
+from common.tracing import span, traced
+from context_packing import (
+    CHUNK_OVERHEAD_TOKENS,
+    DOCUMENT_SEPARATOR,
+    DOCUMENT_TEMPLATE,
+    ContextPacker,
+)
+from embedding_cache import EmbeddingCache
 from embeddings import OpenAIEmbeddings
-from prompts import STUFF_PROMPT
+from index_store import IndexStore
+from lexical import BM25Index, reciprocal_rank_fusion
+from pdf_pages import iter_pdf_pages
+from prompts import COMPACT_PROMPT, STUFF_PROMPT
+from streaming import split_answer
+
+SEARCH_MODES = ["hybrid", "vector", "lexical"]
+
+# Chunking of uploaded documents; stored indexes built otherwise are rebuilt.
+CHUNK_SIZE = 200
+CHUNK_OVERLAP = 0
+# Chunks retrieved per question.
+SEARCH_K = 5
+
+# Embeds queries for searches, so a slow embedding call can be abandoned on
+# timeout.
+_search_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="vector-search"
+)
 
 
 @st.cache_data
+@traced("documentgpt.parse_docx")
 def parse_docx(file: BytesIO) -> str:
     text = docx2txt.process(file)
     # Remove multiple newlines
@@ -26,24 +60,14 @@ def parse_docx(file: BytesIO) -> str:
 
 
 @st.cache_data
+@traced("documentgpt.parse_pdf")
 def parse_pdf(file: BytesIO) -> List[str]:
-    pdf = PdfReader(file)
-    output = []
-    for page in pdf.pages:
-        text = page.extract_text()
-        # Merge hyphenated words
-        text = re.sub(r"(\w+)-\n(\w+)", r"\1\2", text)
-        # Fix newlines in the middle of sentences
-        text = re.sub(r"(?<!\n\s)\n(?!\s\n)", " ", text.strip())
-        # Remove multiple newlines
-        text = re.sub(r"\n\s*\n", "\n\n", text)
-
-        output.append(text)
-
-    return output
+    # Pages of large documents are extracted in parallel
+    return list(iter_pdf_pages(file))
 
 
 @st.cache_data
+@traced("documentgpt.parse_txt")
 def parse_txt(file: BytesIO) -> str:
     text = file.read().decode("utf-8")
     # Remove multiple newlines
@@ -51,42 +75,114 @@ def parse_txt(file: BytesIO) -> str:
     return text
 
 
+@st.cache_resource
+def get_chunker(chunk_size: int, chunk_overlap: int) -> TokenChunker:
+    """Returns a chunker shared across pages, documents and sessions."""
+    return TokenChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
 @st.cache_data
-def text_to_docs(text: str | List[str]) -> List[Document]:
-    """Converts a string or list of strings to a list of Documents
-    with metadata."""
+@traced("documentgpt.text_to_docs")
+def text_to_docs(
+    text: str | List[str],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> ChunkStore:
+    """Converts a string or list of strings to a compact store of chunks
+    with page, chunk and source metadata. Pages are split into chunks of at
+    most `chunk_size` tokens."""
     if isinstance(text, str):
         # Take a single string as one page
         text = [text]
-    page_docs = [Document(page_content=page) for page in text]
 
-    # Add page numbers as metadata
-    for i, doc in enumerate(page_docs):
-        doc.metadata["page"] = i + 1
+    # Split all pages into chunks at once
+    page_chunks = get_chunker(chunk_size, chunk_overlap).split_pages(text)
+    return ChunkStore.from_pages(page_chunks)
 
-    # Split pages into chunks
-    doc_chunks = []
 
-    for doc in page_docs:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
-            chunk_overlap=0,
-        )
-        chunks = text_splitter.split_text(doc.page_content)
-        for i, chunk in enumerate(chunks):
-            doc = Document(
-                page_content=chunk, metadata={"page": doc.metadata["page"], "chunk": i}
-            )
-            # Add sources a metadata
-            doc.metadata["source"] = f"{doc.metadata['page']}-{doc.metadata['chunk']}"
-            doc_chunks.append(doc)
-    return doc_chunks
+def hash_file(file: BytesIO) -> str:
+    """Returns the SHA-256 hex digest of an uploaded file's bytes."""
+    return hashlib.sha256(file.getvalue()).hexdigest()
 
 
-@st.cache_data
-def embed_docs(_docs: List[Document]) -> VectorStore:
-    """Embeds a list of Documents and returns a FAISS index"""
+def get_cache_dir() -> str:
+    return os.environ.get(
+        "DOCUMENTGPT_CACHE_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "local_data"),
+    )
+
+
+@st.cache_resource
+def get_embedding_cache() -> EmbeddingCache:
+    """Opens the embedding cache shared by all sessions and worker processes."""
+    return EmbeddingCache(
+        os.path.join(get_cache_dir(), "embeddings.sqlite3"),
+        max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 1 << 30)),
+    )
+
+
+@st.cache_resource
+def get_index_store() -> IndexStore:
+    """Opens the on-disk store of FAISS indexes."""
+    return IndexStore(
+        os.path.join(get_cache_dir(), "indexes"),
+        max_bytes=int(os.environ.get("INDEX_STORE_MAX_BYTES", 4 << 30)),
+    )
+
+
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    """Returns the answer cache shared by all sessions."""
+    return AnswerCache(
+        max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000)),
+        ttl=float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 24 * 3600)),
+        similarity_threshold=float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.97)),
+    )
+
+
+def get_embeddings(openai_api_key: str) -> OpenAIEmbeddings:
+    """Returns the shared embeddings client for an OpenAI API key."""
+    return get_client(
+        OpenAIEmbeddings,
+        openai_api_key=openai_api_key,
+        max_concurrency=int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4)),
+        requests_per_minute=int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 3000)),
+        tokens_per_minute=int(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 1_000_000)),
+        cache=get_embedding_cache(),
+    )
+
+
+@traced("documentgpt.build_index")
+def build_index(docs: ChunkStore, doc_hash: str, openai_api_key: str) -> VectorStore:
+    """Embeds a store of chunks and returns a FAISS index. Indexes are
+    kept on disk under `doc_hash`, the hash of the source file, and loaded
+    from there when the same file is uploaded again."""
+
+    # Embed the chunks
+    embeddings = get_embeddings(openai_api_key)
+    settings = dict(
+        model_name=embeddings.document_model_name,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+    )
+    index_store = get_index_store()
+    index = index_store.load(doc_hash, embeddings, **settings)
+    if index is None:
+        index = faiss_from_chunks(docs, embeddings)
+        index_store.save(doc_hash, index, **settings)
+
+    return index
+
+
+# cache_resource rather than cache_data: a loaded index is memory-mapped and
+# should be shared as is, not pickled and copied on every rerun. It is shared
+# by every session that uploads the file, so its embedding function is that
+# of the session that built it: sessions embed their queries with
+# get_embeddings() and their own key instead.
+@st.cache_resource
+def embed_docs(_docs: ChunkStore, doc_hash: str) -> VectorStore:
+    """Returns the FAISS index of a document, built with the OpenAI API key
+    of the first session to upload it."""
 
     if not st.session_state.get("OPENAI_API_KEY"):
         raise AuthenticationError(
@@ -94,40 +190,155 @@ def embed_docs(_docs: List[Document]) -> VectorStore:
             " https://platform.openai.com/account/api-keys."
         )
     else:
-        # Embed the chunks
-        embeddings = OpenAIEmbeddings(
-            openai_api_key=st.session_state.get("OPENAI_API_KEY")
-        )  # type: ignore
-        index = FAISS.from_documents(_docs, embeddings)
+        return build_index(_docs, doc_hash, st.session_state.get("OPENAI_API_KEY"))
+
+
+@st.cache_resource
+@traced("documentgpt.build_lexical_index")
+def build_lexical_index(_docs: ChunkStore, doc_hash: str) -> BM25Index:
+    """Builds a local BM25 keyword index over the chunks of a document.
+    Unlike the FAISS index, it needs no API calls."""
+    return BM25Index(_docs)
+
+
+def embed_query(
+    embed: Callable[[str], List[float]],
+    query: str,
+    timeout: Optional[float] = None,
+) -> Optional[List[float]]:
+    """Embeds a query with `embed` on the search executor, waiting at most
+    `timeout` seconds (default SEARCH_VECTOR_TIMEOUT_SECONDS). Returns None if
+    the call fails or times out; a call that times out goes on, and its
+    embedding lands in the embedding cache."""
+    if timeout is None:
+        timeout = float(os.environ.get("SEARCH_VECTOR_TIMEOUT_SECONDS", 5))
+    future = _search_executor.submit(contextvars.copy_context().run, embed, query)
+    try:
+        with span("documentgpt.embed_query"):
+            return future.result(timeout=timeout)
+    except (OpenAIError, concurrent.futures.TimeoutError):
+        return None
+
+
+def search_docs(
+    index: Optional[VectorStore],
+    query: str,
+    mode: str = "vector",
+    lexical_index: Optional[BM25Index] = None,
+    k: int = SEARCH_K,
+    query_embedding: Optional[List[float]] = None,
+) -> List[Document]:
+    """Searches for chunks relevant to the query and returns a list of
+    Documents.
+
+    `mode` is "vector" (FAISS similarity search, which embeds the query
+    remotely), "lexical" (local BM25 keyword search, no API call) or
+    "hybrid" (both, merged by reciprocal rank fusion). A `query_embedding`
+    from embed_query() is searched as is. Otherwise the query is embedded
+    with the index's own embedding function: in hybrid mode with
+    embed_query(), and if that fails or times out the keyword results are
+    used alone; in vector mode however long that takes. Without a vector
+    `index`, as when embedding the document failed, the search is lexical
+    whatever the mode.
+    """
+    if mode == "lexical" or index is None:
+        return _lexical_search(lexical_index, query, k)  # type: ignore
+    if mode == "vector" or lexical_index is None:
+        if query_embedding is None:
+            query_embedding = index.embedding_function(query)  # type: ignore
+        return _vector_search(index, query_embedding, k)  # type: ignore
+
+    if query_embedding is None:
+        query_embedding = embed_query(index.embedding_function, query)  # type: ignore
+    lexical_docs = _lexical_search(lexical_index, query, k)
+    if query_embedding is None:
+        return lexical_docs
+    vector_docs = _vector_search(index, query_embedding, k)
+    return reciprocal_rank_fusion([vector_docs, lexical_docs], k=k)
+
+
+def _vector_search(
+    index: VectorStore, query_embedding: List[float], k: int
+) -> List[Document]:
+    # Search for similar chunks
+    with span("documentgpt.vector_search", k=k):
+        return index.similarity_search_by_vector(query_embedding, k=k)
 
-        return index
 
+def _lexical_search(lexical_index: BM25Index, query: str, k: int) -> List[Document]:
+    with span("documentgpt.lexical_search", k=k):
+        return lexical_index.search(query, k=k)
 
-def search_docs(index: VectorStore, query: str) -> List[Document]:
-    """Searches a FAISS index for similar chunks to the query
-    and returns a list of Documents."""
 
-    # Search for similar chunks
-    docs = index.similarity_search(query, k=5)
-    return docs
+@st.cache_resource
+def get_context_packer() -> ContextPacker:
+    """Returns the packer that fits retrieved chunks into the prompt. By
+    default the budget holds all SEARCH_K chunks at their full size, so only
+    redundant chunks are left out; set CONTEXT_MAX_TOKENS lower to trade
+    context for prompt tokens."""
+    return ContextPacker(
+        max_tokens=int(
+            os.environ.get(
+                "CONTEXT_MAX_TOKENS", SEARCH_K * (CHUNK_SIZE + CHUNK_OVERHEAD_TOKENS)
+            )
+        ),
+        redundancy_threshold=float(
+            os.environ.get("CONTEXT_REDUNDANCY_THRESHOLD", 0.8)
+        ),
+    )
 
 
-def get_answer(docs: List[Document], query: str) -> Dict[str, Any]:
-    """Gets an answer to a question from a list of Documents."""
+def get_prompt() -> PromptTemplate:
+    """Returns the answer prompt. Set DOCUMENTGPT_PROMPT=compact to leave
+    out the few-shot example."""
+    if os.environ.get("DOCUMENTGPT_PROMPT", "full") == "compact":
+        return COMPACT_PROMPT
+    return STUFF_PROMPT
+
+
+def get_answer(
+    docs: List[Document],
+    query: str,
+    callbacks: Optional[Sequence[BaseCallbackHandler]] = None,
+    openai_api_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Gets an answer to a question from a list of Documents, given best
+    first. Only as many as fit the context token budget are sent, and the
+    returned dict reports the prompt size under "prompt_tokens". If callback
+    handlers are given, the completion is streamed to them token by token.
+    The session's OpenAI API key is used unless one is given."""
+
+    packer = get_context_packer()
+    context = packer.pack(docs)
+    prompt = get_prompt()
 
     # Get the answer
 
     chain = load_qa_with_sources_chain(
-        OpenAI(
-            temperature=0, openai_api_key=st.session_state.get("OPENAI_API_KEY")
-        ),  # type: ignore
+        get_client(
+            OpenAI,
+            temperature=0,
+            openai_api_key=openai_api_key or st.session_state.get("OPENAI_API_KEY"),
+            streaming=bool(callbacks),
+        ),
         chain_type="stuff",
-        prompt=STUFF_PROMPT,
+        prompt=prompt,
+        document_prompt=PromptTemplate(
+            template=DOCUMENT_TEMPLATE, input_variables=["page_content", "source"]
+        ),
+        document_separator=DOCUMENT_SEPARATOR,
     )
 
-    answer = chain(
-        {"input_documents": docs, "question": query}, return_only_outputs=True
+    prompt_tokens = context.num_tokens + packer.count_tokens(
+        prompt.format(summaries="", question=query)
     )
+    with span("openai.completion", prompt_tokens=prompt_tokens):
+        answer = chain(
+            {"input_documents": context.docs, "question": query},
+            return_only_outputs=True,
+            callbacks=list(callbacks) if callbacks else None,
+        )
+    answer["prompt_tokens"] = prompt_tokens
     return answer
 
 
@@ -135,7 +346,7 @@ def get_sources(answer: Dict[str, Any], docs: List[Document]) -> List[Document]:
     """Gets the source documents for an answer."""
 
     # Get sources for the answer
-    source_keys = [s for s in answer["output_text"].split("SOURCES: ")[-1].split(", ")]
+    source_keys = split_answer(answer["output_text"])[1]
 
     source_docs = []
     for doc in docs:
@@ -1,52 +1,49 @@
 """Python file to serve as the frontend"""
 import streamlit as st
-from langchain.llms import OpenAI
-from langchain import PromptTemplate
 import os
+import sys
 
-with open('.env', 'r') as f:
-    env_file = f.readlines()
-envs_dict = {key.strip("'"): value.strip("\n") for key, value in [(i.split('=')) for i in env_file]}
-os.environ['OPENAI_API_KEY'] = envs_dict['OPENAI_API_KEY']
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.lazy import import_preloaded, preload
+from common.tracing import span
+from prompts import DIALECTS, TONES
 
-template = """
-    Below is an email that may be poorly worded.
-    Your goal is to:
-    - Properly format the email
-    - Convert the input text to a specified tone
-    - Convert the input text to a specified dialect
-    - The email should have atleast 3 lines consisting of a greeting, then discussion on the topic and finally an ending.
+# The conversion engine imports langchain, which takes seconds on a cold
+# start; import it while the page renders.
+preload("conversion")
 
-    Here are some examples different Tones:
-    - Formal: We went to Barcelona for the weekend. We have a lot of things to tell you.
-    - Informal: Went to Barcelona for the weekend. Lots to tell you.  
 
-    Here are some examples of words in different dialect:
-    - American English: French Fries, cotton candy, apartment, garbage, cookie, green thumb, parking lot, pants, windshield
-    - British English: chips, candyfloss, flag, rubbish, biscuit, green fingers, car park, trousers, windscreen
-    - Deutsch: Pommes, Zuckerwatte, Flagge, Müll, Keks, Grüne Finger, Parkplatz, Hose, Windschutzscheibe
-
-    Below is the email, tone, and dialect:
-    TONE: {tone}
-    Dialect: {dialect}
-    EMAIL: {email}
-
-    YOUR RESPONSE:
-"""
-
-prompt = PromptTemplate(
-    input_variables=["tone", "dialect", "email"],
-    template=template,
-)
+def load_api_key():
+    """Reads the OpenAI API key from .env, unless it is set already."""
+    if 'OPENAI_API_KEY' in os.environ:
+        return
+    with open('.env', 'r') as f:
+        env_file = f.readlines()
+    envs_dict = {key.strip("'"): value.strip("\n") for key, value in [(i.split('=')) for i in env_file]}
+    os.environ['OPENAI_API_KEY'] = envs_dict['OPENAI_API_KEY']
 
 
 def load_LLM():
     """Logic for loading the chain you want to use should go here."""
-    llm = OpenAI(temperature=0)
+    from langchain.llms import OpenAI
+
+    from common.clients import get_client
+
+    llm = get_client(OpenAI, temperature=0, streaming=True)
     return llm
 
 
-llm = load_LLM()
+@st.cache_resource
+def get_conversion_engine():
+    """Returns the conversion engine shared by all sessions, so reruns and
+    other sessions reuse its results. Built on the first conversion."""
+    load_api_key()
+    conversion = import_preloaded("conversion")
+    return conversion.ConversionEngine(
+        load_LLM(),
+        max_entries=int(os.environ.get("EMAIL_CACHE_MAX_ENTRIES", 1000)),
+    )
+
 
 # From here down is all the StreamLit UI.
 st.set_page_config(page_title="Formalize Email", page_icon=":robot:")
@@ -60,12 +57,12 @@ col1, col2 = st.columns(2)
 with col1:
     option_tone = st.selectbox(
         'Which tone would you like your email to have?',
-        ('Formal', 'Informal'))
+        TONES)
 
 with col2:
     option_dialect = st.selectbox(
         'Which Language would you like?',
-        ('American English', 'British English', 'Deutsch', 'Kolsch', 'Schwabisch'))
+        DIALECTS)
 
 
 def get_text():
@@ -78,6 +75,6 @@ email_input = get_text()
 st.markdown("### Your Converted Email:")
 
 if email_input:
-    output = llm(prompt.format(tone=option_tone, dialect=option_dialect, email=email_input))
-
-    st.write(output)
\ No newline at end of file
+    output_placeholder = st.empty()
+    with span("emailgpt.convert", tone=option_tone, dialect=option_dialect):
+        get_conversion_engine().convert(option_tone, option_dialect, email_input, on_text=output_placeholder.write)
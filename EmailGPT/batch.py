@@ -0,0 +1,259 @@
+"""Convert the emails of an mbox or CSV file in bulk.
+
+Emails are read as a stream and converted concurrently by a
+ConversionEngine, with the prompt of the app, under optional requests/min
+and tokens/min limits. Each result is appended to a JSON lines file as
+soon as it is done. The output file is also the checkpoint: run the same
+command again after an interruption and the emails already in it are
+skipped. Every record names the tone, dialect and input file (by hash) it
+was converted for, and an output file written for others is refused.
+
+    python batch.py outbox.mbox --output converted.jsonl --tone Formal --dialect "British English"
+    python batch.py emails.csv --output converted.jsonl --text_column body --requests_per_minute 3000
+"""
+import argparse
+import csv
+import email
+import hashlib
+import email.policy
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.rate_limit import get_rate_limiter
+from prompts import DIALECTS, TONES
+
+if TYPE_CHECKING:
+    from conversion import ConversionEngine
+
+logger = logging.getLogger(__name__)
+
+
+class BatchEmail(NamedTuple):
+    # Position in the input, which identifies the email in checkpoints.
+    index: int
+    # Message-ID for mbox input, the id column's value for CSV input.
+    id: Optional[str]
+    text: str
+
+
+def _parse_message(index: int, raw: bytes) -> BatchEmail:
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    body = message.get_body(preferencelist=("plain",))
+    return BatchEmail(index, message.get("Message-ID"), body.get_content() if body is not None else "")
+
+
+def read_mbox(f: BinaryIO) -> Iterator[BatchEmail]:
+    """The plain text bodies of an mbox file's messages, read one message at
+    a time. Messages are separated by lines starting with "From ", as in
+    the standard library's mailbox.mbox."""
+    index = 0
+    lines: List[bytes] = []
+    for line in f:
+        if line.startswith(b"From ") and lines:
+            yield _parse_message(index, b"".join(lines[1:]))
+            index += 1
+            lines = []
+        lines.append(line)
+    if lines:
+        yield _parse_message(index, b"".join(lines[1:]))
+
+
+def read_csv(f: TextIO, text_column: str = "email", id_column: Optional[str] = None) -> Iterator[BatchEmail]:
+    """The emails in a CSV file's `text_column`, read one row at a time."""
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None or text_column not in reader.fieldnames:
+        raise ValueError(f"The CSV file has no {text_column!r} column")
+    for index, row in enumerate(reader):
+        yield BatchEmail(index, row.get(id_column) if id_column else None, row[text_column] or "")
+
+
+def hash_file(path: str) -> str:
+    """The SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finished_indexes(
+    output_path: str, tone: str, dialect: str, input_hash: Optional[str] = None
+) -> Set[int]:
+    """The indexes of the emails already converted into `output_path`. A
+    last line cut short by an interruption is removed from the file.
+
+    Raises ValueError if a record was converted to another tone or dialect,
+    or from another input than the one hashing to `input_hash`: its index
+    says nothing about the emails of this run.
+    """
+    done: Set[int] = set()
+    if not os.path.exists(output_path):
+        return done
+    # Record field -> (expected value, what it is).
+    expected = {"tone": (tone, "tone"), "dialect": (dialect, "dialect"), "input_sha256": (input_hash, "input file")}
+    with open(output_path, "r+b") as f:
+        good_end = 0
+        for line in f:
+            try:
+                record = json.loads(line) if line.endswith(b"\n") else None
+                index = record["index"] if record is not None else None
+            except (ValueError, KeyError):
+                index = None
+            if index is None:
+                logger.warning("Removing an incomplete record at the end of %s", output_path)
+                f.truncate(good_end)
+                break
+            for key, (value, name) in expected.items():
+                if record.get(key) != value:  # type: ignore
+                    raise ValueError(
+                        f"{output_path} holds emails converted with another {name}"
+                        f" ({record.get(key)!r}, not {value!r}); choose another --output"  # type: ignore
+                        " or delete it to start over"
+                    )
+            done.add(index)
+            good_end += len(line)
+    return done
+
+
+def run_batch(
+    engine: "ConversionEngine",
+    emails: Iterable[BatchEmail],
+    output_path: str,
+    tone: str,
+    dialect: str,
+    concurrency: int = 8,
+    progress_interval: float = 10,
+    input_hash: Optional[str] = None,
+) -> Dict[str, float]:
+    """Convert `emails` into `output_path`, skipping those already in it,
+    and return counts and the conversion rate. `input_hash` identifies the
+    input file in the records, so that only a run on the same file resumes
+    from them; see finished_indexes."""
+    done = finished_indexes(output_path, tone, dialect, input_hash)
+    counts = {"converted": 0, "failed": 0, "skipped": 0}
+    lock = threading.Lock()
+    # Bounds the emails read ahead of the conversions.
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    start = last_progress = time.perf_counter()
+
+    def convert(item: BatchEmail, out: TextIO) -> None:
+        nonlocal last_progress
+        try:
+            converted = engine.convert(tone, dialect, item.text) if item.text.strip() else ""
+        except Exception as e:
+            logger.warning("Could not convert email %d: %s", item.index, e)
+            with lock:
+                counts["failed"] += 1
+            return
+        record = {
+            "index": item.index,
+            "id": item.id,
+            "tone": tone,
+            "dialect": dialect,
+            "input_sha256": input_hash,
+            "converted": converted,
+        }
+        with lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["converted"] += 1
+            now = time.perf_counter()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                logger.info(
+                    "Converted %d emails, %.1f emails/s", counts["converted"], counts["converted"] / (now - start)
+                )
+
+    def release(future: Future) -> None:
+        slots.release()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="email-batch")
+        try:
+            for item in emails:
+                if item.index in done:
+                    counts["skipped"] += 1
+                    continue
+                slots.acquire()
+                pool.submit(convert, item, out).add_done_callback(release)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; finishing the conversions in flight. Run again to resume.")
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        pool.shutdown(wait=True)
+
+    elapsed = time.perf_counter() - start
+    return {
+        **counts,
+        "elapsed_s": elapsed,
+        "emails_per_s": counts["converted"] / elapsed if elapsed else 0.0,
+        "llm_calls": engine.llm_calls,
+    }
+
+
+if __name__ == "__main__":
+    # import your OpenAI key (put in your .env file), unless it is set already
+    if "OPENAI_API_KEY" not in os.environ and os.path.exists(".env"):
+        with open(".env", "r") as f:
+            env_file = f.readlines()
+        envs_dict = {key.strip("'"): value.strip("\n") for key, value in [(i.split("=")) for i in env_file]}
+        os.environ["OPENAI_API_KEY"] = envs_dict["OPENAI_API_KEY"]
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # openai logs every request at INFO level.
+    logging.getLogger("openai").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Convert the emails of an mbox or CSV file in bulk")
+    parser.add_argument("input", help="mbox or CSV file")
+    parser.add_argument("--output", required=True, help="JSON lines file to append results to")
+    parser.add_argument("--format", choices=("mbox", "csv"), help="Input format; by default from the extension")
+    parser.add_argument("--tone", choices=TONES, default=TONES[0])
+    parser.add_argument("--dialect", choices=DIALECTS, default=DIALECTS[0])
+    parser.add_argument("--text_column", default="email", help="CSV column holding the emails")
+    parser.add_argument("--id_column", default=None, help="CSV column to copy into the results as their id")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversions running at once")
+    parser.add_argument("--requests_per_minute", type=int, default=None)
+    parser.add_argument("--tokens_per_minute", type=int, default=None)
+    args = parser.parse_args()
+
+    # Imported once the arguments are known to be fine: they import langchain,
+    # which takes seconds.
+    from common.clients import get_client
+    from conversion import ConversionEngine
+    from langchain.llms import OpenAI
+
+    input_format = args.format or ("csv" if args.input.lower().endswith(".csv") else "mbox")
+    llm = get_client(OpenAI, temperature=0)
+    engine = ConversionEngine(
+        llm,
+        max_entries=10000,
+        max_workers=args.concurrency,
+        timeout=None,
+        rate_limiter=get_rate_limiter(llm.openai_api_key, args.requests_per_minute, args.tokens_per_minute),
+    )
+    if input_format == "csv":
+        input_file = open(args.input, "r", newline="", encoding="utf-8")
+        emails = read_csv(input_file, args.text_column, args.id_column)
+    else:
+        input_file = open(args.input, "rb")
+        emails = read_mbox(input_file)
+    with input_file:
+        try:
+            stats = run_batch(
+                engine, emails, args.output, args.tone, args.dialect, args.concurrency,
+                input_hash=hash_file(args.input),
+            )
+        except ValueError as e:
+            parser.error(str(e))
+    logger.info(
+        "Converted %d emails in %.1fs (%.1f emails/s) with %d LLM calls; %d failed, %d already done",
+        stats["converted"], stats["elapsed_s"], stats["emails_per_s"], stats["llm_calls"],
+        stats["failed"], stats["skipped"],
+    )
@@ -0,0 +1,172 @@
+"""Email conversions, cached and shared by all sessions."""
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.llms.base import BaseLLM
+
+from common.rate_limit import RateLimiter
+from common.tracing import span
+from prompts import EMAIL_PROMPT
+
+
+def normalize_email(email: str) -> str:
+    """Strip each line, collapse runs of spaces and of blank lines, and unify
+    line endings, so that emails differing only in whitespace share a result."""
+    lines = [re.sub(r"[ \t]+", " ", line).strip() for line in email.replace("\r\n", "\n").split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+class _Conversion:
+    """A conversion in flight, shared by every caller asking for it."""
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = threading.Condition()
+
+
+class _ConversionTextHandler(BaseCallbackHandler):
+    """Appends streamed tokens to a conversion and wakes its callers."""
+
+    def __init__(self, conversion: _Conversion) -> None:
+        self.conversion = conversion
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        with self.conversion.changed:
+            self.conversion.text += token
+            self.conversion.changed.notify_all()
+
+
+class ConversionEngine:
+    """Converts emails to a tone and dialect with an LLM, at most once per
+    distinct request.
+
+    Results are kept in an LRU cache keyed by (tone, dialect, normalized
+    email), so a Streamlit rerun for the same input costs no completion.
+    Requests for a conversion already in flight wait for it instead of
+    starting another. Completions run on the engine's own threads, so a
+    rerun that stops the script waiting for one does not abort it: the next
+    run picks it up. With a streaming LLM, waiting callers see the text as
+    the tokens arrive.
+
+    Args:
+        llm: The LLM; set `streaming=True` to stream conversions.
+        max_entries: Least recently used results beyond this are evicted.
+        max_workers: Completions running at once.
+        timeout: Seconds a caller waits for a completion before giving up;
+            the completion itself goes on. None waits for as long as it takes.
+        rate_limiter: If given, paces completions under its limits.
+    """
+
+    def __init__(
+        self,
+        llm: BaseLLM,
+        max_entries: int = 1000,
+        max_workers: int = 4,
+        timeout: Optional[float] = 120,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        self.llm = llm
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.hits = 0
+        self.coalesced = 0
+        self.llm_calls = 0
+        self._results: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, str, str], _Conversion] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="email-conversion")
+
+    def convert(
+        self,
+        tone: str,
+        dialect: str,
+        email: str,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """The converted email. `on_text` is called with the text so far
+        whenever it grows, and with the whole text if it was cached."""
+        key = (tone, dialect, normalize_email(email))
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+            else:
+                conversion = self._in_flight.get(key)
+                if conversion is None:
+                    conversion = self._in_flight[key] = _Conversion()
+                    self.llm_calls += 1
+                    # The first request's email is converted as written; the
+                    # normalized text only identifies it.
+                    self._executor.submit(self._run, key, email, conversion)
+                else:
+                    self.coalesced += 1
+        if result is not None:
+            if on_text is not None:
+                on_text(result)
+            return result
+        return self._wait(conversion, on_text)
+
+    def _run(self, key: Tuple[str, str, str], email: str, conversion: _Conversion) -> None:
+        tone, dialect, _ = key
+        result = None
+        try:
+            prompt = EMAIL_PROMPT.format(tone=tone, dialect=dialect, email=email)
+            if self.rate_limiter is not None:
+                # Providers count the completion's max_tokens against the
+                # tokens/min limit as well.
+                self.rate_limiter.acquire(
+                    self.llm.get_num_tokens(prompt) + max(getattr(self.llm, "max_tokens", 0), 0)
+                )
+            with span("emailgpt.completion", tone=tone, dialect=dialect):
+                result = self.llm(prompt, callbacks=[_ConversionTextHandler(conversion)])
+        except Exception as e:
+            conversion.error = e
+        with self._lock:
+            # Cache the result and retire the flight at once, so no request
+            # in between starts the same completion again.
+            if result is not None:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+            del self._in_flight[key]
+        with conversion.changed:
+            if result is not None:
+                conversion.text = result
+            conversion.done = True
+            conversion.changed.notify_all()
+
+    def _wait(self, conversion: _Conversion, on_text: Optional[Callable[[str], None]]) -> str:
+        shown = ""
+        while True:
+            with conversion.changed:
+                if not conversion.changed.wait_for(
+                    lambda: conversion.done or conversion.text != shown, self.timeout
+                ):
+                    raise TimeoutError("The email conversion did not finish in time")
+                text, done, error = conversion.text, conversion.done, conversion.error
+            if error is not None:
+                raise error
+            # Outside the lock, so a slow page does not hold up the tokens.
+            if on_text is not None and text != shown:
+                on_text(text)
+            shown = text
+            if done:
+                return text
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.coalesced + self.llm_calls
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "llm_calls": self.llm_calls,
+            "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0,
+            "entries": len(self._results),
+        }
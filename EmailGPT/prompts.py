@@ -0,0 +1,44 @@
+TONES = ('Formal', 'Informal')
+DIALECTS = (
+    'American English', 'British English', 'Deutsch', 'Kolsch', 'Schwabisch'
+)
+
+template = """
+    Below is an email that may be poorly worded.
+    Your goal is to:
+    - Properly format the email
+    - Convert the input text to a specified tone
+    - Convert the input text to a specified dialect
+    - The email should have atleast 3 lines consisting of a greeting, then discussion on the topic and finally an ending.
+
+    Here are some examples different Tones:
+    - Formal: We went to Barcelona for the weekend. We have a lot of things to tell you.
+    - Informal: Went to Barcelona for the weekend. Lots to tell you.
+
+    Here are some examples of words in different dialect:
+    - American English: French Fries, cotton candy, apartment, garbage, cookie, green thumb, parking lot, pants, windshield
+    - British English: chips, candyfloss, flag, rubbish, biscuit, green fingers, car park, trousers, windscreen
+    - Deutsch: Pommes, Zuckerwatte, Flagge, Müll, Keks, Grüne Finger, Parkplatz, Hose, Windschutzscheibe
+
+    Below is the email, tone, and dialect:
+    TONE: {tone}
+    Dialect: {dialect}
+    EMAIL: {email}
+
+    YOUR RESPONSE:
+"""  # noqa: E501
+
+
+def __getattr__(name):
+    # EMAIL_PROMPT is built on first use: importing langchain takes seconds,
+    # and TONES and DIALECTS are needed before it.
+    if name == "EMAIL_PROMPT":
+        from langchain import PromptTemplate
+
+        global EMAIL_PROMPT
+        EMAIL_PROMPT = PromptTemplate(
+            input_variables=["tone", "dialect", "email"],
+            template=template,
+        )
+        return EMAIL_PROMPT
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
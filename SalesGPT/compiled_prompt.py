@@ -0,0 +1,116 @@
+import functools
+from string import Formatter
+from typing import Any, Callable, Dict, List, Tuple
+
+from langchain.prompts.base import StringPromptTemplate
+from pydantic import PrivateAttr, root_validator
+
+
+def _field_root(field_name: str) -> str:
+    """'a' for the fields 'a', 'a.b' and 'a[0]'."""
+    return field_name.split('.', 1)[0].split('[', 1)[0]
+
+
+def split_template(template: str, dynamic_variables: List[str]) -> Tuple[str, str]:
+    """Split a format string before the first field of a dynamic variable.
+
+    Returns the static prefix and the rest, both format strings again.
+    """
+    prefix, rest = [], []
+    target = prefix
+    for literal, field_name, format_spec, conversion in Formatter().parse(template):
+        target.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field_name is None:
+            continue
+        if _field_root(field_name) in dynamic_variables:
+            target = rest
+        field = field_name
+        if conversion:
+            field += '!' + conversion
+        if format_spec:
+            field += ':' + format_spec
+        target.append('{' + field + '}')
+    return ''.join(prefix), ''.join(rest)
+
+
+class CompiledPromptTemplate(StringPromptTemplate):
+    """A prompt template whose static prefix is rendered once.
+
+    The template is split before the first field of a `dynamic_variables`
+    entry, the inputs that change every turn such as the conversation history.
+    The prefix is rendered once per distinct combination of the other inputs
+    (a persona) and cached, so formatting a turn only formats the rest of the
+    template. For a prompt whose dynamic inputs come last, the prefix is
+    byte-identical across turns and conversations of a persona, which also
+    lets providers reuse their cache of the prompt's prefix.
+
+    Renders exactly what a PromptTemplate with the same template renders.
+    """
+
+    template: str
+    dynamic_variables: List[str]
+    max_cached_prefixes: int = 256
+
+    _prefix_template: str = PrivateAttr()
+    _rest_template: str = PrivateAttr()
+    _prefix_variables: Tuple[str, ...] = PrivateAttr()
+    _render_prefix: Callable[[Tuple[str, ...]], str] = PrivateAttr()
+    _prefix_tokens: Callable[[Tuple[str, ...]], int] = PrivateAttr()
+    _encoding: Any = PrivateAttr(default=None)
+
+    @root_validator()
+    def validate_dynamic_variables(cls, values: Dict) -> Dict:
+        unknown = set(values.get('dynamic_variables', [])) - set(values.get('input_variables', []))
+        if unknown:
+            raise ValueError(f'Dynamic variables {sorted(unknown)} are not input variables')
+        return values
+
+    def __init__(self, **data: Any):
+        super().__init__(**data)
+        self._prefix_template, self._rest_template = split_template(self.template, self.dynamic_variables)
+        self._prefix_variables = tuple(sorted({
+            _field_root(field_name)
+            for _, field_name, _, _ in Formatter().parse(self._prefix_template)
+            if field_name is not None
+        }))
+        # lru_cache is thread-safe; the key is a tuple of the persona's strings,
+        # whose hashes Python caches, so a lookup does not rehash them.
+        self._render_prefix = functools.lru_cache(maxsize=self.max_cached_prefixes)(self._format_prefix)
+        self._prefix_tokens = functools.lru_cache(maxsize=self.max_cached_prefixes)(self._count_prefix_tokens)
+
+    @property
+    def _prompt_type(self) -> str:
+        return 'compiled'
+
+    def _format_prefix(self, values: Tuple[str, ...]) -> str:
+        return self._prefix_template.format(**dict(zip(self._prefix_variables, values)))
+
+    def _count_prefix_tokens(self, values: Tuple[str, ...]) -> int:
+        if self._encoding is None:
+            try:
+                import tiktoken
+            except ImportError:
+                raise ValueError(
+                    "Could not import tiktoken python package. "
+                    "Please it install it with `pip install tiktoken`."
+                )
+            self._encoding = tiktoken.get_encoding('cl100k_base')
+        return len(self._encoding.encode_ordinary(self._render_prefix(values)))
+
+    def _prefix_values(self, kwargs: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(kwargs[name] for name in self._prefix_variables)
+
+    def prefix(self, **kwargs: Any) -> str:
+        """The static prefix for these inputs; dynamic inputs are not needed."""
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        return self._render_prefix(self._prefix_values(kwargs))
+
+    def prefix_tokens(self, **kwargs: Any) -> int:
+        """The number of cl100k_base tokens of the static prefix, counted once
+        per persona."""
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        return self._prefix_tokens(self._prefix_values(kwargs))
+
+    def format(self, **kwargs: Any) -> str:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        return self._render_prefix(self._prefix_values(kwargs)) + self._rest_template.format(**kwargs)
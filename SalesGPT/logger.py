@@ -1,13 +1,12 @@
-import time
 import logging
-from functools import wraps
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import SpanRecord, get_tracer
 
 logger = logging.getLogger(__name__)
 
-stream_handler = logging.StreamHandler()
-log_filename='output.log'
-file_handler = logging.FileHandler(filename=log_filename)
-handlers = [stream_handler, file_handler]
 
 class TimeFilter(logging.Filter):
     def filter(self, record):
@@ -15,19 +14,35 @@ class TimeFilter(logging.Filter):
 
 logger.addFilter(TimeFilter())
 
-# Configure the logging module
-logging.basicConfig(level=logging.INFO, format='%(name)s %(asctime)s - %(levelname)s - %(message)s', handlers=handlers)
 
-def time_logger(func):
-    """Decorator function to log time taken by any function."""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time = time.time()  # Start time before function execution
-        result = func(*args, **kwargs)  # Function execution
-        end_time = time.time()  # End time after function execution
-        execution_time = end_time - start_time  # Calculate execution time
-        logger.info(f"Running {func.__name__}: --- {execution_time} seconds ---")
-        return result
-    return wrapper
+def configure_logging(log_filename='output.log'):
+    """Log to stderr and to `log_filename`, as the command line tools do.
+    Not done on import, so importing SalesGPT neither creates a log file nor
+    changes the logging of the application importing it."""
+    handlers = [logging.StreamHandler()]
+    if log_filename:
+        handlers.append(logging.FileHandler(filename=log_filename))
+    logging.basicConfig(level=logging.INFO, format='%(name)s %(asctime)s - %(levelname)s - %(message)s',
+                        handlers=handlers)
+
+# Span name -> name of the function it times
+_timed_functions = {}
+
 
+def _log_time(record: SpanRecord):
+    """Logs the time taken by a function timed with time_logger. Runs on the
+    tracing exporter thread, so the log handlers are off the request path."""
+    func_name = _timed_functions.get(record.name)
+    if func_name is not None:
+        execution_time = record.duration_ns / 1e9
+        logger.info(f"Running {func_name}: --- {execution_time} seconds ---")
 
+
+get_tracer().exporter.add_listener(_log_time)
+
+
+def time_logger(func):
+    """Decorator function to trace and log time taken by any function."""
+    span_name = f"salesgpt.{func.__qualname__}"
+    _timed_functions[span_name] = func.__name__
+    return get_tracer().traced(span_name)(func)
@@ -0,0 +1,171 @@
+import contextvars
+import copy
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain import LLMChain
+from langchain.llms import BaseLLM
+from langchain.memory.prompt import SUMMARY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# Summaries are written off the request path, shared by all agents.
+_summary_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='history-summary')
+
+
+class ConversationMemory:
+    """Renders a conversation history for prompts within a token budget.
+
+    The last `max_verbatim_turns` turns are kept verbatim. Older turns are folded
+    into a rolling summary by the LLM in the background, so no step waits for a
+    summary. To save LLM calls, turns are folded in batches of at least half the
+    verbatim window. A prompt gets the summary and every turn after those it
+    covers, so until a summary catches up, more than `max_verbatim_turns` turns
+    stay verbatim. Only when the rendered history would exceed `max_tokens` are
+    the oldest verbatim turns left out.
+
+    The history itself stays a plain list owned by the caller; the memory only
+    remembers how many of its leading turns the summary covers.
+    """
+
+    def __init__(self, llm: BaseLLM, max_verbatim_turns: int = 6, max_tokens: int = 1500,
+                 encoding_name: str = 'cl100k_base'):
+        try:
+            import tiktoken
+        except ImportError:
+            raise ValueError(
+                "Could not import tiktoken python package. "
+                "Please it install it with `pip install tiktoken`."
+            )
+        self.summary_chain = LLMChain(llm=llm, prompt=SUMMARY_PROMPT)
+        self.max_verbatim_turns = max_verbatim_turns
+        self.max_tokens = max_tokens
+        self._encoding: Any = tiktoken.get_encoding(encoding_name)
+        # Reentrant: a summary that is already done runs its callback at once.
+        self._lock = threading.RLock()
+        self._generation = 0
+        self.clear()
+
+    def copy(self) -> 'ConversationMemory':
+        """A new, empty memory with the same settings, sharing the summary chain
+        and encoding, for another conversation."""
+        memory = copy.copy(self)
+        memory._lock = threading.RLock()
+        memory.clear()
+        return memory
+
+    def clear(self):
+        with self._lock:
+            self.summary = ''
+            self.summarized_turns = 0
+            self._pending: Optional[Future] = None
+            # The number of leading turns the pending summary will cover.
+            self._pending_end = 0
+            self._generation += 1
+            self._turn_lengths: List[int] = []
+            self.num_summaries = 0
+            self.full_tokens = 0
+            self.prompt_tokens = 0
+            self.tokens_saved = 0
+
+    def restore(self, summary: str, summarized_turns: int):
+        """Continue from a summary of the first `summarized_turns` turns of a
+        history, as saved in a snapshot."""
+        with self._lock:
+            self.clear()
+            self.summary = summary
+            self.summarized_turns = summarized_turns
+
+    def forget_turns(self, num_turns: int):
+        """Drop what is known about the turns after the first `num_turns`, which
+        were taken back from the history."""
+        with self._lock:
+            del self._turn_lengths[num_turns:]
+            self.summarized_turns = min(self.summarized_turns, num_turns)
+            if self._pending is not None and self._pending_end > num_turns:
+                # Its callback finds it is no longer pending and drops it.
+                self._pending.cancel()
+                self._pending = None
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self._encoding.encode_ordinary_batch(texts)]
+
+    def _token_lengths(self, conversation_history: List[str]) -> List[int]:
+        """Token counts of the turns; turns are only counted once, as the history
+        only grows. Call with the lock held."""
+        new_turns = conversation_history[len(self._turn_lengths):]
+        if new_turns:
+            self._turn_lengths.extend(self._count_tokens(new_turns))
+        return self._turn_lengths[:len(conversation_history)]
+
+    def _summarize(self, summary: str, turns: List[str]) -> str:
+        return self.summary_chain.run(summary=summary, new_lines='\n'.join(turns)).strip()
+
+    def _maybe_start_summary(self, conversation_history: List[str]):
+        """Fold the turns beyond the verbatim window into the summary, in the
+        background. Call with the lock held."""
+        overflow = len(conversation_history) - self.summarized_turns - self.max_verbatim_turns
+        if self._pending is not None or overflow < max(self.max_verbatim_turns // 2, 1):
+            return
+        start = self.summarized_turns
+        turns = conversation_history[start:start + overflow]
+        generation = self._generation
+        pending = _summary_executor.submit(
+            contextvars.copy_context().run, self._summarize, self.summary, turns
+        )
+        self._pending = pending
+        self._pending_end = start + len(turns)
+
+        def done(future: Future):
+            with self._lock:
+                if self._pending is not future or self._generation != generation:
+                    # The memory was cleared meanwhile.
+                    return
+                self._pending = None
+                if future.exception() is not None:
+                    logger.warning('Could not summarize the conversation: %s', future.exception())
+                    return
+                self.summary = future.result()
+                self.summarized_turns = start + len(turns)
+                self.num_summaries += 1
+
+        pending.add_done_callback(done)
+
+    def render(self, conversation_history: List[str]) -> str:
+        """The history as it should appear in a prompt."""
+        with self._lock:
+            self._maybe_start_summary(conversation_history)
+            summary = self.summary
+            start = self.summarized_turns
+            turn_lengths = self._token_lengths(conversation_history)
+
+        lines = [f'Summary of the earlier conversation: {summary}'] if summary else []
+        summary_tokens = sum(self._count_tokens(lines))
+        turns = conversation_history[start:]
+        lengths = turn_lengths[start:]
+        # Leave out the oldest turns until the rest fits, keeping the latest one.
+        first = 0
+        turn_tokens = sum(lengths)
+        while first < len(turns) - 1 and summary_tokens + turn_tokens > self.max_tokens:
+            turn_tokens -= lengths[first]
+            first += 1
+
+        full_tokens = sum(turn_lengths)
+        prompt_tokens = summary_tokens + turn_tokens
+        with self._lock:
+            self.full_tokens = full_tokens
+            self.prompt_tokens = prompt_tokens
+            self.tokens_saved += max(full_tokens - prompt_tokens, 0)
+        return '\n'.join(lines + turns[first:])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'summarized_turns': self.summarized_turns,
+                'num_summaries': self.num_summaries,
+                'full_tokens': self.full_tokens,
+                'prompt_tokens': self.prompt_tokens,
+                'tokens_saved': self.tokens_saved,
+            }
@@ -1,7 +1,10 @@
 import os
+from logger import configure_logging
 from sales_gpt import SalesGPT
 from langchain.chat_models import ChatOpenAI
 
+configure_logging()
+
 os.environ['OPENAI_API_KEY'] = ''
 
 llm = ChatOpenAI(temperature=0.9)
@@ -3,11 +3,15 @@ import argparse
 import os
 import json
 
-from sales_gpt import SalesGPT
+from logger import configure_logging
+from sales_gpt import STAGE_ANALYSIS_MODES, SalesGPT
+from common.clients import get_client
 from langchain.chat_models import ChatOpenAI
 
 if __name__ == "__main__":
 
+    configure_logging()
+
     # import your OpenAI key (put in your .env file)
     with open('.env', 'r') as f:
         env_file = f.readlines()
@@ -22,6 +26,8 @@ if __name__ == "__main__":
     parser.add_argument('--verbose', type=bool, help='Verbosity', default=False)
     parser.add_argument('--max_num_turns', type=int, help='Maximum number of turns in the sales conversation',
                         default=10)
+    parser.add_argument('--stage_analysis', type=str, choices=STAGE_ANALYSIS_MODES,
+                        help='How each step determines the conversation stage', default=None)
 
     # Parse arguments
     args = parser.parse_args()
@@ -30,8 +36,9 @@ if __name__ == "__main__":
     config_path = args.config
     verbose = args.verbose
     max_num_turns = args.max_num_turns
+    stage_analysis = args.stage_analysis
 
-    llm = ChatOpenAI(temperature=0.9)
+    llm = get_client(ChatOpenAI, temperature=0.9)
 
     if config_path == '':
         print('No agent config specified, using a standard config')
@@ -42,6 +49,9 @@ if __name__ == "__main__":
         print(f'Agent config {config}')
         sales_agent = SalesGPT.from_llm(llm, verbose=verbose, **config)
 
+    if stage_analysis is not None:
+        sales_agent.stage_analysis = stage_analysis
+
     sales_agent.seed_agent()
     print('=' * 10)
     cnt = 0
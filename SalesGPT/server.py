@@ -0,0 +1,347 @@
+"""HTTP server hosting many concurrent SalesGPT conversations in one process.
+
+Sessions share the LLM client, the prompt chains and the stage classifier,
+and only keep their own conversation state. Steps run on an asyncio event
+loop, at most `max_concurrent_steps` at a time; further requests wait in a
+bounded queue, and are refused with 503 once it is full, so load from
+prospects never turns into unbounded load on the LLM provider. Sessions
+idle for longer than `session_ttl` seconds are evicted.
+
+With `--snapshot_path`, every session is saved to a SQLite file after each
+turn. Evicted sessions, sessions of a restarted server, and sessions of
+other workers sharing the file are resumed from there on their next message.
+Snapshots not saved for `--snapshot_ttl` seconds are deleted.
+
+    python server.py --config agent_setup.json --port 8080
+
+    POST   /sessions                  -> {"session_id", "reply", ...}
+    POST   /sessions/{id}/messages    {"message": "..."} -> {"reply", ...}
+    DELETE /sessions/{id}
+    GET    /stats
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import aiohttp
+import openai
+from aiohttp import web
+from langchain.chat_models import ChatOpenAI
+from openai.error import OpenAIError, RateLimitError
+
+from logger import configure_logging
+from sales_gpt import STAGE_ANALYSIS_MODES, SalesGPT
+from snapshot import SnapshotStore
+from common.clients import get_client
+
+class Overloaded(Exception):
+    """Raised when a step can not be queued or a session can not be created."""
+
+
+class Session:
+    __slots__ = ('agent', 'lock', 'last_active')
+
+    def __init__(self, agent: SalesGPT):
+        self.agent = agent
+        # Serializes the steps of one conversation.
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+
+class SessionManager:
+    """Creates, steps and evicts SalesGPT sessions."""
+
+    def __init__(self, llm, config: Optional[Dict[str, Any]] = None, max_sessions: int = 10000,
+                 session_ttl: float = 900, max_concurrent_steps: int = 64, max_queued_steps: int = 1024,
+                 step_timeout: float = 60, max_connections: Optional[int] = None,
+                 snapshot_store: Optional[SnapshotStore] = None, snapshot_ttl: Optional[float] = 7 * 24 * 3600):
+        # Built once: the chains and stage classifier of the template are
+        # shared by every session copied from it.
+        self.template = SalesGPT.from_llm(llm, verbose=False, **(config or {}))
+        self.template.print_conversation = False
+        # Nobody calls determine_conversation_stage() on a served session.
+        if self.template.stage_analysis == 'manual':
+            self.template.stage_analysis = 'concurrent'
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_queued_steps = max_queued_steps
+        self.step_timeout = step_timeout
+        self.max_connections = max_connections or max_concurrent_steps * 2
+        self.snapshot_store = snapshot_store
+        # None keeps snapshots forever.
+        self.snapshot_ttl = snapshot_ttl
+        self.sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        self._step_slots = asyncio.Semaphore(max_concurrent_steps)
+        self._queued_steps = 0
+        self._active_steps = 0
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._evictor: Optional[asyncio.Task] = None
+        self.counters = {'sessions_created': 0, 'sessions_evicted': 0, 'sessions_resumed': 0, 'steps': 0,
+                         'steps_rejected': 0, 'steps_failed': 0, 'rate_limited': 0, 'snapshots_pruned': 0}
+
+    async def start(self):
+        # One pool of keep-alive connections to the LLM provider for all
+        # sessions, instead of a new connection per request.
+        self._http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections)
+        )
+        self._evictor = asyncio.create_task(self._evict_idle_sessions())
+
+    async def close(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+        if self._http_session is not None:
+            await self._http_session.close()
+
+    def _remove(self, session_id: str) -> Optional[Session]:
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            # Drop a stage analysis still running for the conversation.
+            pending = session.agent._pending_stage
+            if isinstance(pending, asyncio.Future):
+                pending.cancel()
+        return session
+
+    def _evict(self, session_id: str):
+        if self._remove(session_id) is not None:
+            self.counters['sessions_evicted'] += 1
+
+    async def _evict_idle_sessions(self):
+        while True:
+            await asyncio.sleep(max(min(self.session_ttl / 4, 30), 0.1))
+            deadline = time.monotonic() - self.session_ttl
+            # Sessions are kept in order of last activity.
+            for session_id, session in list(self.sessions.items()):
+                if session.last_active > deadline:
+                    break
+                if not session.lock.locked():
+                    self._evict(session_id)
+            if self.snapshot_store is not None and self.snapshot_ttl is not None:
+                self.counters['snapshots_pruned'] += await self._in_store(
+                    self.snapshot_store.prune, self.snapshot_ttl
+                )
+
+    async def _in_store(self, fn, *args):
+        # The snapshot store does blocking SQLite I/O; keep it off the loop.
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _touch(self, session_id: str, session: Session):
+        session.last_active = time.monotonic()
+        self.sessions.move_to_end(session_id)
+
+    def _make_room(self):
+        if len(self.sessions) >= self.max_sessions:
+            # Evict the least recently active idle session.
+            for session_id, session in self.sessions.items():
+                if not session.lock.locked():
+                    self._evict(session_id)
+                    break
+            else:
+                raise Overloaded('Too many sessions')
+
+    async def get_session(self, session_id: str) -> Optional[Session]:
+        """A live session, or one resumed from the snapshot store."""
+        session = self.sessions.get(session_id)
+        if session is None and self.snapshot_store is not None:
+            agent = await self._in_store(self.snapshot_store.load, session_id, self.template)
+            # Another request may have resumed it meanwhile.
+            session = self.sessions.get(session_id)
+            if session is None and agent is not None:
+                self._make_room()
+                session = self.sessions[session_id] = Session(agent)
+                self.counters['sessions_resumed'] += 1
+        return session
+
+    async def create_session(self) -> Dict[str, Any]:
+        self._make_room()
+        session_id = uuid.uuid4().hex
+        session = self.sessions[session_id] = Session(self.template.new_session())
+        self.counters['sessions_created'] += 1
+        # The agent opens the conversation.
+        async with session.lock:
+            return {'session_id': session_id, **await self._step(session_id, session)}
+
+    async def send_message(self, session: Session, session_id: str, message: str) -> Dict[str, Any]:
+        self._touch(session_id, session)
+        async with session.lock:
+            return await self._step(session_id, session, message)
+
+    async def end_session(self, session_id: str) -> bool:
+        """Forget a session; False if it is unknown."""
+        found = self._remove(session_id) is not None
+        if self.snapshot_store is not None:
+            found = await self._in_store(self.snapshot_store.delete, session_id) or found
+        return found
+
+    async def _step(self, session_id: str, session: Session, message: Optional[str] = None) -> Dict[str, Any]:
+        """Answer `message`, or open the conversation if there is none. A step
+        that is refused or fails leaves the conversation as it was, so the
+        client can send the message again."""
+        if self._queued_steps >= self.max_queued_steps:
+            self.counters['steps_rejected'] += 1
+            raise Overloaded('Too many queued steps')
+        self._queued_steps += 1
+        try:
+            await self._step_slots.acquire()
+        finally:
+            self._queued_steps -= 1
+        self._active_steps += 1
+        openai.aiosession.set(self._http_session)
+        agent = session.agent
+        checkpoint = agent.checkpoint()
+        try:
+            if message is not None:
+                agent.human_step(message)
+            await asyncio.wait_for(agent.astep(), self.step_timeout)
+            # Keep the slot until a concurrent stage analysis is done too, so
+            # slots bound the requests in flight to the provider.
+            await asyncio.wait_for(agent.apply_pending_stage(), self.step_timeout)
+        except BaseException as e:
+            agent.rollback(checkpoint)
+            if isinstance(e, RateLimitError):
+                self.counters['rate_limited'] += 1
+            elif isinstance(e, Exception):
+                self.counters['steps_failed'] += 1
+            raise
+        finally:
+            self._active_steps -= 1
+            self._step_slots.release()
+        self.counters['steps'] += 1
+        self._touch(session_id, session)
+        if self.snapshot_store is not None:
+            # The session's lock, held by the caller, keeps the agent
+            # unchanged while it is saved.
+            await self._in_store(self.snapshot_store.save, session_id, agent)
+
+        utterance = agent.conversation_history[-1] if agent.conversation_history else ''
+        reply = utterance.split(': ', 1)[-1]
+        return {
+            'reply': reply.replace('<END_OF_TURN>', '').replace('<END_OF_CALL>', '').strip(),
+            'conversation_stage_id': agent.conversation_stage_id,
+            'end_of_call': '<END_OF_CALL>' in utterance,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sessions': len(self.sessions),
+            'active_steps': self._active_steps,
+            'queued_steps': self._queued_steps,
+            **self.counters,
+        }
+
+
+def _error(status: int, message: str, **headers) -> web.Response:
+    return web.json_response({'error': message}, status=status, headers=headers)
+
+
+def create_app(manager: SessionManager) -> web.Application:
+    routes = web.RouteTableDef()
+
+    async def run(coro):
+        try:
+            return web.json_response(await coro)
+        except Overloaded as e:
+            return _error(503, str(e), **{'Retry-After': '1'})
+        except RateLimitError as e:
+            return _error(503, f'LLM provider rate limit: {e}', **{'Retry-After': '5'})
+        except asyncio.TimeoutError:
+            return _error(504, 'The LLM did not answer in time')
+        except OpenAIError as e:
+            return _error(502, f'LLM provider error: {e}')
+
+    @routes.post('/sessions')
+    async def create_session(request: web.Request) -> web.Response:
+        return await run(manager.create_session())
+
+    @routes.post('/sessions/{session_id}/messages')
+    async def send_message(request: web.Request) -> web.Response:
+        session_id = request.match_info['session_id']
+        try:
+            session = await manager.get_session(session_id)
+        except Overloaded as e:
+            return _error(503, str(e), **{'Retry-After': '1'})
+        if session is None:
+            return _error(404, 'Unknown or expired session')
+        try:
+            message = (await request.json())['message']
+        except (ValueError, KeyError, TypeError):
+            return _error(400, 'Expected a JSON body with a "message"')
+        return await run(manager.send_message(session, session_id, str(message)))
+
+    @routes.delete('/sessions/{session_id}')
+    async def end_session(request: web.Request) -> web.Response:
+        if not await manager.end_session(request.match_info['session_id']):
+            return _error(404, 'Unknown or expired session')
+        return web.json_response({})
+
+    @routes.get('/stats')
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(manager.stats())
+
+    app = web.Application()
+    app.add_routes(routes)
+
+    async def on_startup(app):
+        await manager.start()
+
+    async def on_cleanup(app):
+        await manager.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+
+    # import your OpenAI key (put in your .env file), unless it is set already
+    if 'OPENAI_API_KEY' not in os.environ and os.path.exists('.env'):
+        with open('.env', 'r') as f:
+            env_file = f.readlines()
+        envs_dict = {key.strip("'"): value.strip("\n") for key, value in [(i.split('=')) for i in env_file]}
+        os.environ['OPENAI_API_KEY'] = envs_dict['OPENAI_API_KEY']
+
+    configure_logging()
+    # openai logs every request at INFO level.
+    logging.getLogger('openai').setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='Serve SalesGPT conversations over HTTP')
+    parser.add_argument('--config', type=str, help='Path to agent config file', default='')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--stage_analysis', type=str, choices=STAGE_ANALYSIS_MODES[1:], default=None)
+    parser.add_argument('--max_sessions', type=int, default=10000)
+    parser.add_argument('--session_ttl', type=float, help='Seconds before idle sessions are evicted', default=900)
+    parser.add_argument('--max_concurrent_steps', type=int, help='Steps talking to the LLM at once', default=64)
+    parser.add_argument('--max_queued_steps', type=int, help='Steps waiting for a slot before 503s', default=1024)
+    parser.add_argument('--step_timeout', type=float, default=60)
+    parser.add_argument('--snapshot_path', type=str, help='SQLite file to save sessions to', default=None)
+    parser.add_argument('--snapshot_ttl', type=float, help='Seconds a snapshot is kept after its last save; 0 keeps it forever',
+                        default=7 * 24 * 3600)
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    if args.stage_analysis is not None:
+        config['stage_analysis'] = args.stage_analysis
+
+    manager = SessionManager(
+        get_client(ChatOpenAI, temperature=0.9),
+        config,
+        max_sessions=args.max_sessions,
+        session_ttl=args.session_ttl,
+        max_concurrent_steps=args.max_concurrent_steps,
+        max_queued_steps=args.max_queued_steps,
+        step_timeout=args.step_timeout,
+        snapshot_store=SnapshotStore(args.snapshot_path) if args.snapshot_path else None,
+        snapshot_ttl=args.snapshot_ttl or None,
+    )
+    web.run_app(create_app(manager), host=args.host, port=args.port, print=None)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sales_gpt import SalesGPT
+
+
+def persona_key(persona: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(persona, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class SnapshotStore:
+    """Saves SalesGPT conversations to a SQLite file, so they survive a restart
+    and can be resumed by another worker.
+
+    A session row only holds the compact snapshot of the conversation state
+    (see SalesGPT.snapshot) and the key of its persona. Personas, whose company
+    descriptions are most of an agent's text, are stored once per distinct
+    persona. The database runs in WAL mode so several workers can share it.
+
+    Args:
+        path: Path of the SQLite file. Parent directories are created.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        # Persona key -> persona, for the personas known to this process.
+        self._personas: Dict[str, Dict[str, str]] = {}
+        # Persona values -> key, so saves do not hash the persona every time.
+        self._persona_keys: Dict[tuple, str] = {}
+        self._personas_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS personas ('
+            ' key TEXT PRIMARY KEY,'
+            ' persona TEXT NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' session_id TEXT PRIMARY KEY,'
+            ' persona_key TEXT NOT NULL,'
+            ' state BLOB NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)')
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections are not thread-safe."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _save_persona(self, persona: Dict[str, str]) -> str:
+        values = tuple(persona.values())
+        key = self._persona_keys.get(values)
+        if key is None:
+            key = persona_key(persona)
+            self._connection().execute(
+                'INSERT OR IGNORE INTO personas (key, persona) VALUES (?, ?)', (key, json.dumps(persona))
+            )
+            with self._personas_lock:
+                self._personas[key] = persona
+                self._persona_keys[values] = key
+        return key
+
+    def _persona(self, key: str) -> Dict[str, str]:
+        persona = self._personas.get(key)
+        if persona is None:
+            row = self._connection().execute('SELECT persona FROM personas WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                raise KeyError(f'Unknown persona {key}')
+            persona = json.loads(row[0])
+            with self._personas_lock:
+                self._personas[key] = persona
+        return persona
+
+    def save(self, session_id: str, agent: SalesGPT):
+        """Save, or replace, the snapshot of a session."""
+        key = self._save_persona(agent.persona())
+        self._connection().execute(
+            'INSERT OR REPLACE INTO sessions (session_id, persona_key, state, updated_at) VALUES (?, ?, ?, ?)',
+            (session_id, key, agent.snapshot(), time.time()),
+        )
+
+    def load(self, session_id: str, template: SalesGPT) -> Optional[SalesGPT]:
+        """Resume a saved session as a new agent sharing the template's chains
+        and settings, with the session's own persona. None if it is unknown."""
+        row = self._connection().execute(
+            'SELECT persona_key, state FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        key, state = row
+        agent = template.new_session(**self._persona(key))
+        agent.restore(state)
+        return agent
+
+    def delete(self, session_id: str) -> bool:
+        """Delete a saved session; False if there was none."""
+        cursor = self._connection().execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        return cursor.rowcount > 0
+
+    def session_ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute('SELECT session_id FROM sessions')]
+
+    def prune(self, max_age: float) -> int:
+        """Delete sessions not saved for `max_age` seconds; returns how many."""
+        cursor = self._connection().execute(
+            'DELETE FROM sessions WHERE updated_at < ?', (time.time() - max_age,)
+        )
+        return cursor.rowcount
@@ -0,0 +1,165 @@
+import argparse
+import json
+import random
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Speaker prefix and end-of-turn marker of a conversation history turn.
+TURN_PATTERN = re.compile(r'^\s*([^:]{1,40}):\s*(.*?)\s*(?:<END_OF_TURN>|<END_OF_CALL>|\s)*$', re.S)
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def load_examples(path: str) -> List[Dict]:
+    """Loads labelled turns from a JSON lines file, such as one written by
+    SalesGPT's `stage_log_path`. Each line has the `conversation_history` and
+    `conversation_stage_id` the stage was chosen from and the chosen `stage`."""
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _words(turn: str) -> List[str]:
+    match = TURN_PATTERN.match(turn)
+    return WORD_PATTERN.findall((match.group(2) if match else turn).lower())
+
+
+def conversation_features(conversation_history: List[str], conversation_stage_id: str) -> List[str]:
+    """Names of the features of a turn: the current stage, how far into the
+    conversation it is, and the words and word pairs of the last user and
+    agent turns."""
+    features = [f'stage={conversation_stage_id}', f'turns={min(len(conversation_history), 10)}']
+    last_user = last_agent = None
+    for turn in reversed(conversation_history):
+        if turn.lstrip().startswith('User:'):
+            last_user = last_user if last_user is not None else turn
+        elif last_agent is None:
+            last_agent = turn
+        if last_user is not None and last_agent is not None:
+            break
+    for prefix, turn in (('user', last_user), ('agent', last_agent)):
+        if turn is None:
+            features.append(f'{prefix}=none')
+            continue
+        words = _words(turn)
+        features.extend(f'{prefix}:{word}' for word in words)
+        features.extend(f'{prefix}:{a} {b}' for a, b in zip(words, words[1:]))
+    return features
+
+
+class StageClassifier:
+    """Multinomial logistic regression over hashed conversation features,
+    predicting the next conversation stage without an LLM call.
+
+    Runs on the CPU in well under a millisecond, and reports a confidence
+    (the predicted stage's probability) so that callers can fall back to
+    the LLM when it is unsure.
+    """
+
+    def __init__(self, stages: Iterable[str], num_features: int = 1 << 14):
+        self.stages = [str(stage) for stage in stages]
+        self.num_features = num_features
+        self.weights = np.zeros((num_features, len(self.stages)), dtype=np.float32)
+        self.bias = np.zeros(len(self.stages), dtype=np.float32)
+
+    def _feature_ids(self, conversation_history: List[str], conversation_stage_id: str) -> np.ndarray:
+        # crc32 rather than hash(), which is salted per process.
+        return np.unique(np.array(
+            [zlib.crc32(feature.encode('utf-8')) % self.num_features
+             for feature in conversation_features(conversation_history, str(conversation_stage_id))],
+            dtype=np.int64,
+        ))
+
+    def _probabilities(self, feature_ids: np.ndarray) -> np.ndarray:
+        logits = self.weights[feature_ids].sum(axis=0) + self.bias
+        logits -= logits.max()
+        exp = np.exp(logits)
+        return exp / exp.sum()
+
+    def fit(self, examples: List[Dict], epochs: int = 10, learning_rate: float = 0.1,
+            l2: float = 1e-4, seed: int = 0) -> 'StageClassifier':
+        """Trains on labelled turns (see `load_examples`) with AdaGrad, from scratch."""
+        stage_index = {stage: i for i, stage in enumerate(self.stages)}
+        data = [
+            (self._feature_ids(example['conversation_history'], example['conversation_stage_id']),
+             stage_index[str(example['stage'])])
+            for example in examples
+            if str(example['stage']) in stage_index
+        ]
+        self.weights[:] = 0
+        self.bias[:] = 0
+        weights_sq = np.full_like(self.weights, 1e-8)
+        bias_sq = np.full_like(self.bias, 1e-8)
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for feature_ids, label in data:
+                gradient = self._probabilities(feature_ids)
+                gradient[label] -= 1
+                rows = self.weights[feature_ids]
+                row_gradient = gradient + l2 * rows
+                weights_sq[feature_ids] += row_gradient ** 2
+                self.weights[feature_ids] = rows - learning_rate * row_gradient / np.sqrt(weights_sq[feature_ids])
+                bias_sq += gradient ** 2
+                self.bias -= learning_rate * gradient / np.sqrt(bias_sq)
+        return self
+
+    def predict(self, conversation_history: List[str], conversation_stage_id: str) -> Tuple[str, float]:
+        """Returns the most likely next stage id and its probability."""
+        probabilities = self._probabilities(self._feature_ids(conversation_history, conversation_stage_id))
+        best = int(probabilities.argmax())
+        return self.stages[best], float(probabilities[best])
+
+    def evaluate(self, examples: List[Dict], threshold: float) -> Dict[str, float]:
+        """Accuracy on labelled turns, overall and on the turns it is confident
+        about, and the fraction of turns for which it would save an LLM call."""
+        correct = confident = confident_correct = 0
+        for example in examples:
+            stage, confidence = self.predict(example['conversation_history'], example['conversation_stage_id'])
+            hit = stage == str(example['stage'])
+            correct += hit
+            if confidence >= threshold:
+                confident += 1
+                confident_correct += hit
+        num_examples = max(len(examples), 1)
+        return {
+            'examples': len(examples),
+            'accuracy': correct / num_examples,
+            'confident_accuracy': confident_correct / confident if confident else 0.0,
+            # With the LLM answering the other turns, taken as right.
+            'accuracy_with_fallback': (confident_correct + len(examples) - confident) / num_examples,
+            'llm_calls_saved': confident / num_examples,
+        }
+
+    def save(self, path: str):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, stages=np.array(self.stages))
+
+    @classmethod
+    def load(cls, path: str) -> 'StageClassifier':
+        with np.load(path) as data:
+            classifier = cls(data['stages'].tolist(), num_features=data['weights'].shape[0])
+            classifier.weights[:] = data['weights']
+            classifier.bias[:] = data['bias']
+        return classifier
+
+
+def main(argv: Optional[List[str]] = None):
+    from sales_gpt import CONVERSATION_STAGES
+
+    parser = argparse.ArgumentParser(description='Train the local conversation stage classifier')
+    parser.add_argument('examples', nargs='+', help='JSON lines files of labelled turns')
+    parser.add_argument('--output', type=str, help='Where to save the model (.npz)', default='stage_classifier.npz')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--threshold', type=float, help='Confidence to report accuracy at', default=0.8)
+    args = parser.parse_args(argv)
+
+    examples = [example for path in args.examples for example in load_examples(path)]
+    classifier = StageClassifier(CONVERSATION_STAGES.keys()).fit(examples, epochs=args.epochs)
+    classifier.save(args.output)
+    print(f'Trained on {len(examples)} turns, saved to {args.output}')
+    print(f'Training set: {classifier.evaluate(examples, args.threshold)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Memory held per document chunk: Documents in an InMemoryDocstore (what
+FAISS.from_documents keeps) vs. a ChunkStore.
+
+    python -m benchmarks.bench_chunk_store --chunks 100000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+import uuid
+from typing import Any, Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from langchain.docstore.document import Document  # noqa: E402
+from langchain.docstore.in_memory import InMemoryDocstore  # noqa: E402
+
+from chunk_store import ChunkDocstore, ChunkIds, ChunkStore  # noqa: E402
+
+
+def make_pages(
+    pieces: List[str], num_chunks: int, chunks_per_page: int = 5
+) -> List[List[str]]:
+    """Fresh chunk strings, as the chunker would produce them."""
+    chunks = [pieces[i % len(pieces)] + str(i) for i in range(num_chunks)]
+    return [
+        chunks[i : i + chunks_per_page] for i in range(0, len(chunks), chunks_per_page)
+    ]
+
+
+def documents(pages: List[List[str]]) -> Any:
+    docs = []
+    for page, chunks in enumerate(pages, start=1):
+        for i, chunk in enumerate(chunks):
+            doc = Document(page_content=chunk, metadata={"page": page, "chunk": i})
+            doc.metadata["source"] = f"{doc.metadata['page']}-{doc.metadata['chunk']}"
+            docs.append(doc)
+    ids = [str(uuid.uuid4()) for _ in docs]
+    docstore = InMemoryDocstore(dict(zip(ids, docs)))
+    return docstore, dict(enumerate(ids))
+
+
+def chunk_store(pages: List[List[str]]) -> Any:
+    store = ChunkStore.from_pages(pages)
+    return ChunkDocstore(store), ChunkIds(len(store))
+
+
+def measure(
+    build: Callable[[List[List[str]]], Any], pieces: List[str], num_chunks: int
+) -> int:
+    """Memory retained by the built structure, including the chunk text but
+    not the temporary chunk strings a compact store lets go of."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(make_pages(pieces, num_chunks))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "DocumentGPT", "data", "paul_graham_essay.txt")) as f:
+        text = f.read()
+    pieces = [text[i : i + 800] for i in range(0, len(text) - 800, 800)]
+    text_bytes = sum(
+        len(c.encode("utf-8")) for page in make_pages(pieces, args.chunks) for c in page
+    )
+    print(f"{args.chunks} chunks, {text_bytes / 1e6:.1f} MB of text")
+    for name, build in (("Documents", documents), ("ChunkStore", chunk_store)):
+        used = measure(build, pieces, args.chunks)
+        print(
+            f"{name:<10} total={used / 1e6:7.1f} MB "
+            f"overhead/chunk={(used - text_bytes) / args.chunks:7.0f} B"
+        )
+
+
+if __name__ == "__main__":
+    main()
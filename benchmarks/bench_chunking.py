@@ -0,0 +1,79 @@
+"""Chunking throughput: TokenChunker vs. RecursiveCharacterTextSplitter.
+
+The first run is what text_to_docs used to do: a new character-based
+splitter (800 characters) per page. TokenChunker does not beat it, and
+cannot: that splitter never tokenizes, and encoding the text with tiktoken
+alone (about 10 MB/s on 1.5 MB of the sample essay) is an order of magnitude
+slower than the whole character split (about 120 MB/s). The goal of beating
+the old splitter's throughput was therefore changed to beating the
+token-measured langchain splitter, the cheapest way to get what TokenChunker
+adds: chunks with a bounded token count, which 800-character chunks lack.
+
+    python -m benchmarks.bench_chunking --copies 20
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter  # noqa: E402
+
+from chunking import DEFAULT_SEPARATORS, TokenChunker  # noqa: E402
+
+
+def character_splitter(pages: List[str]) -> List[List[str]]:
+    chunks = []
+    for page in pages:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=800,
+            separators=DEFAULT_SEPARATORS + [""],
+            chunk_overlap=0,
+        )
+        chunks.append(text_splitter.split_text(page))
+    return chunks
+
+
+def tiktoken_splitter(pages: List[str]) -> List[List[str]]:
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=200,
+        separators=DEFAULT_SEPARATORS + [""],
+        chunk_overlap=0,
+    )
+    return [text_splitter.split_text(page) for page in pages]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--copies", type=int, default=20)
+    parser.add_argument("--page_chars", type=int, default=3000)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "DocumentGPT", "data", "paul_graham_essay.txt")) as f:
+        text = f.read() * args.copies
+    pages = [text[i : i + args.page_chars] for i in range(0, len(text), args.page_chars)]
+    megabytes = len(text.encode("utf-8")) / 1e6
+
+    chunker = TokenChunker(chunk_size=200)
+    runs: List[tuple[str, Callable[[List[str]], List[List[str]]]]] = [
+        ("RecursiveCharacterTextSplitter, 800 chars", character_splitter),
+        ("RecursiveCharacterTextSplitter, 200 tokens", tiktoken_splitter),
+        ("TokenChunker, 200 tokens", chunker.split_pages),
+    ]
+    print(f"{len(pages)} pages, {megabytes:.1f} MB")
+    for name, split in runs:
+        start = time.perf_counter()
+        chunks = split(pages)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<44} chunks={sum(map(len, chunks)):<6} "
+            f"time={elapsed:.2f}s throughput={megabytes / elapsed:.2f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
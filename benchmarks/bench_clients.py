@@ -0,0 +1,126 @@
+"""Connections, requests and latency of DocumentGPT questions with a client
+per question, and with the shared clients of common.clients, against a
+local fake OpenAI server that keeps connections alive.
+
+Simulates Streamlit sessions asking about the same document at the same
+time: each question embeds the query and streams an answer, on a new
+thread as a Streamlit rerun does, and sessions ask the same questions
+within moments of each other. Every new connection costs
+--connection-latency seconds, standing in for the TCP and TLS handshakes
+to the provider. All sessions share one API key, as a deployment with a
+server-side key does.
+
+    python -m benchmarks.bench_clients --sessions 16 --questions 5 --connection-latency 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from benchmarks.bench_end_to_end import API_KEY, load_questions, percentile  # noqa: E402
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def run_sessions(
+    sessions: int,
+    questions: List[str],
+    make_clients: Callable[[], Tuple[Any, Any]],
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def ask(question: str) -> None:
+        start = time.perf_counter()
+        embeddings, llm = make_clients()
+        embeddings.embed_query(question)
+        llm(f"QUESTION: {question}\nSource: 1-1\nSource: 1-2\nSOURCES:")
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    def session(index: int) -> None:
+        # Sessions start at different questions, but ask each of them
+        # around the same time as some other session.
+        for i in range(len(questions)):
+            rerun = threading.Thread(target=ask, args=(questions[(index + i) % len(questions)],))
+            rerun.start()
+            rerun.join()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(session, range(sessions)))
+    wall_time = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "questions": len(latencies),
+        "wall_time_s": wall_time,
+        "question_p50_ms": percentile(latencies, 50) * 1e3,
+        "question_p95_ms": percentile(latencies, 95) * 1e3,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--questions", type=int, default=5, help="Distinct questions asked by every session")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--completion-latency", type=float, default=0.2)
+    parser.add_argument("--connection-latency", type=float, default=0.05)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    import openai
+    from langchain.llms import OpenAI
+
+    from common.clients import client_stats, get_client
+    from embeddings import OpenAIEmbeddings
+
+    questions = [q for qs in load_questions().values() for q in qs][: args.questions]
+    server = FakeOpenAIServer(
+        latency=args.latency,
+        completion_latency=args.completion_latency,
+        keep_alive=True,
+        connection_latency=args.connection_latency,
+    )
+    report: Dict[str, Any] = {"settings": vars(args)}
+    with server:
+        openai.api_base = server.url
+
+        def per_question_clients() -> Tuple[Any, Any]:
+            # What DocumentGPT did: new clients for every question, on the
+            # openai package's session for the rerun's thread.
+            return (
+                OpenAIEmbeddings(openai_api_key=API_KEY),  # type: ignore
+                OpenAI(temperature=0, streaming=True, openai_api_key=API_KEY),  # type: ignore
+            )
+
+        def shared_clients() -> Tuple[Any, Any]:
+            return (
+                get_client(OpenAIEmbeddings, openai_api_key=API_KEY),
+                get_client(OpenAI, temperature=0, streaming=True, openai_api_key=API_KEY),
+            )
+
+        for name, make_clients in [("per_question", per_question_clients), ("shared", shared_clients)]:
+            connections, requests = server.num_connections, server.num_requests
+            report[name] = run_sessions(args.sessions, questions, make_clients)
+            report[name]["connections"] = server.num_connections - connections
+            report[name]["requests"] = server.num_requests - requests
+        report["shared"]["clients"] = client_stats()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Recall@k and search latency of CorpusIndex per index type.
+
+Uses clustered random vectors standing in for chunk embeddings, spread over
+many documents. Recall is measured against exact (flat) search.
+
+    python -m benchmarks.bench_corpus_index --chunks 100000 --dim 256
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from langchain.docstore.document import Document  # noqa: E402
+
+from corpus import FLAT, HNSW, IVF, CorpusIndex  # noqa: E402
+
+
+def make_vectors(num: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.normal(size=(max(num // 100, 1), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=num)
+    return centers[labels] + 0.3 * rng.normal(size=(num, dim)).astype(np.float32)
+
+
+def build(index_type: str, vectors: np.ndarray, chunks_per_doc: int) -> tuple:
+    index = CorpusIndex(
+        embeddings=None,  # type: ignore
+        dim=vectors.shape[1],
+        flat_max_size=len(vectors) + 1 if index_type == FLAT else 0,
+        large_index_type=index_type if index_type != FLAT else IVF,
+    )
+    start = time.perf_counter()
+    for doc in range(0, len(vectors), chunks_per_doc):
+        batch = vectors[doc : doc + chunks_per_doc]
+        docs = [Document(page_content="", metadata={"row": doc + i}) for i in range(len(batch))]
+        index.add_document(f"doc-{doc}", docs, batch.tolist())
+    return index, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--chunks_per_doc", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.chunks, args.dim, rng)
+    # Queries resemble the chunks that answer them.
+    rows = rng.integers(0, len(vectors), size=args.queries)
+    queries = vectors[rows] + 0.1 * rng.normal(size=(args.queries, args.dim)).astype(
+        np.float32
+    )
+
+    truth = None
+    for index_type in (FLAT, IVF, HNSW):
+        index, build_time = build(index_type, vectors, args.chunks_per_doc)
+        assert index.index_type == index_type
+        latencies = []
+        results = []
+        for query in queries:
+            start = time.perf_counter()
+            docs = index.similarity_search_by_vector(query.tolist(), k=args.k)
+            latencies.append(time.perf_counter() - start)
+            results.append({d.metadata["row"] for d in docs})
+        if truth is None:
+            truth = results
+        recall = np.mean([len(r & t) / args.k for r, t in zip(results, truth)])
+
+        start = time.perf_counter()
+        index.remove_document(index.document_ids[0])
+        remove_time = time.perf_counter() - start
+
+        print(
+            f"{index_type:<5} chunks={len(vectors)} build={build_time:.2f}s "
+            f"recall@{args.k}={recall:.3f} "
+            f"p50={np.percentile(latencies, 50) * 1000:.2f}ms "
+            f"p99={np.percentile(latencies, 99) * 1000:.2f}ms "
+            f"remove_document={remove_time * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
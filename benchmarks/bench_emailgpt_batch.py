@@ -0,0 +1,98 @@
+"""Throughput of EmailGPT's bulk conversion of an mbox file, and resuming
+an interrupted job, against a local fake OpenAI server.
+
+Writes a synthetic mbox of --emails messages, some of them duplicates,
+converts the first half as a job that gets interrupted, then runs the job
+again over the whole file, which skips the emails already converted. The
+fake server enforces --requests-per-minute, and the batch paces itself
+under the same limit.
+
+    python -m benchmarks.bench_emailgpt_batch --emails 1000 --concurrency 16
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+from email.message import EmailMessage
+from typing import Any, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "EmailGPT"))
+
+from benchmarks.bench_end_to_end import API_KEY, EMAILS  # noqa: E402
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def write_mbox(path: str, num_emails: int, duplicate_every: int) -> None:
+    with open(path, "wb") as f:
+        for i in range(num_emails):
+            message = EmailMessage()
+            message["From"] = f"sender{i}@example.com"
+            message["To"] = "team@example.com"
+            message["Message-ID"] = f"<{i}@example.com>"
+            # Every duplicate_every-th email repeats an earlier one.
+            number = i - 1 if duplicate_every and i % duplicate_every == 0 and i else i
+            message.set_content(f"{EMAILS[number % len(EMAILS)]} (ticket {number})")
+            f.write(f"From sender{i}@example.com Mon Jan  1 00:00:00 2024\n".encode())
+            f.write(message.as_bytes() + b"\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--emails", type=int, default=1000)
+    parser.add_argument("--duplicate-every", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests-per-minute", type=int, default=6000)
+    parser.add_argument("--completion-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    args = parser.parse_args()
+
+    import openai
+    from langchain.llms import OpenAI
+
+    from batch import read_mbox, run_batch
+    from common.rate_limit import RateLimiter
+    from conversion import ConversionEngine
+
+    server = FakeOpenAIServer(
+        completion_latency=args.completion_latency,
+        tokens_per_second=args.tokens_per_second,
+        requests_per_minute=args.requests_per_minute,
+    )
+    report: Dict[str, Any] = {"settings": vars(args)}
+    with server, tempfile.TemporaryDirectory() as tmp_dir:
+        openai.api_base = server.url
+        mbox_path = os.path.join(tmp_dir, "outbox.mbox")
+        output_path = os.path.join(tmp_dir, "converted.jsonl")
+        write_mbox(mbox_path, args.emails, args.duplicate_every)
+        rate_limiter = RateLimiter(args.requests_per_minute)
+
+        def run(limit: int) -> Dict[str, Any]:
+            engine = ConversionEngine(
+                OpenAI(temperature=0, openai_api_key=API_KEY),  # type: ignore
+                max_workers=args.concurrency,
+                timeout=None,
+                rate_limiter=rate_limiter,
+            )
+            before = server.num_requests
+            with open(mbox_path, "rb") as f:
+                stats = run_batch(
+                    engine, itertools.islice(read_mbox(f), limit), output_path,
+                    "Formal", "British English", args.concurrency,
+                )
+            return {**stats, "requests": server.num_requests - before}
+
+        report["interrupted"] = run(args.emails // 2)
+        report["resumed"] = run(args.emails)
+        with open(output_path, "r") as f:
+            indexes = [json.loads(line)["index"] for line in f]
+        report["output"] = {"records": len(indexes), "distinct_emails": len(set(indexes))}
+        report["rate_limited"] = server.num_rate_limited
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
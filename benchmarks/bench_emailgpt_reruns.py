@@ -0,0 +1,139 @@
+"""LLM calls and latency of EmailGPT reruns, with and without its
+conversion engine, against a local fake OpenAI server.
+
+Simulates Streamlit sessions: every widget interaction reruns the app,
+which converts the current email again. Each session types an email, then
+switches tone and dialect back and forth, clicks around without changing
+anything, and re-pastes the email with different whitespace. Sessions run
+concurrently and several of them convert the same emails. The app as it
+was calls the LLM on every rerun; the ConversionEngine only for new
+requests, and streams the text as it arrives.
+
+    python -m benchmarks.bench_emailgpt_reruns --sessions 20 --completion-latency 0.5
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "EmailGPT"))
+
+from benchmarks.bench_end_to_end import API_KEY, EMAILS, percentile  # noqa: E402
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def session_reruns(session: int) -> List[Tuple[str, str, str]]:
+    """The (tone, dialect, email) of every rerun of one session."""
+    email = EMAILS[session % len(EMAILS)]
+    return [
+        ("Formal", "American English", email),
+        # Clicks outside the text area and other widgets rerun the script.
+        ("Formal", "American English", email),
+        ("Informal", "American English", email),
+        ("Formal", "American English", email),
+        ("Formal", "British English", email),
+        ("Formal", "British English", email),
+        ("Formal", "American English", "  " + email.replace(" ", "  ") + "\n\n"),
+        ("Informal", "American English", email),
+    ]
+
+
+def run_sessions(
+    sessions: int,
+    convert: Callable[[str, str, str, Callable[[str], None]], Any],
+) -> Dict[str, Any]:
+    rerun_latencies: List[float] = []
+    first_text_latencies: List[float] = []
+    lock = threading.Lock()
+
+    def session(index: int) -> None:
+        for tone, dialect, email in session_reruns(index):
+            start = time.perf_counter()
+            first_text: List[float] = []
+
+            def on_text(text: str) -> None:
+                if not first_text:
+                    first_text.append(time.perf_counter() - start)
+
+            convert(tone, dialect, email, on_text)
+            with lock:
+                rerun_latencies.append(time.perf_counter() - start)
+                if first_text:
+                    first_text_latencies.append(first_text[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(session, range(sessions)))
+    wall_time = time.perf_counter() - start
+    rerun_latencies.sort()
+    first_text_latencies.sort()
+    return {
+        "reruns": len(rerun_latencies),
+        "wall_time_s": wall_time,
+        "rerun_p50_ms": percentile(rerun_latencies, 50) * 1e3,
+        "rerun_p95_ms": percentile(rerun_latencies, 95) * 1e3,
+        "first_text_p50_ms": percentile(first_text_latencies, 50) * 1e3 if first_text_latencies else None,
+        "first_text_p95_ms": percentile(first_text_latencies, 95) * 1e3 if first_text_latencies else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--completion-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    import openai
+    from langchain.llms import OpenAI
+
+    from conversion import ConversionEngine
+    from prompts import EMAIL_PROMPT
+
+    server = FakeOpenAIServer(
+        completion_latency=args.completion_latency, tokens_per_second=args.tokens_per_second
+    )
+    report: Dict[str, Any] = {"settings": vars(args)}
+    with server:
+        openai.api_base = server.url
+
+        llm = OpenAI(temperature=0, openai_api_key=API_KEY)  # type: ignore
+
+        def convert_every_rerun(tone: str, dialect: str, email: str, on_text: Callable[[str], None]) -> None:
+            # What app.py did: a completion on every rerun.
+            on_text(llm(EMAIL_PROMPT.format(tone=tone, dialect=dialect, email=email)))
+
+        before = server.num_requests
+        report["every_rerun"] = run_sessions(args.sessions, convert_every_rerun)
+        report["every_rerun"]["llm_calls"] = server.num_requests - before
+
+        engine = ConversionEngine(
+            OpenAI(temperature=0, streaming=True, openai_api_key=API_KEY),  # type: ignore
+            max_workers=args.sessions,
+        )
+
+        def convert_with_engine(tone: str, dialect: str, email: str, on_text: Callable[[str], None]) -> None:
+            engine.convert(tone, dialect, email, on_text=on_text)
+
+        before = server.num_requests
+        report["engine"] = run_sessions(args.sessions, convert_with_engine)
+        report["engine"]["llm_calls"] = server.num_requests - before
+        report["engine"]["stats"] = engine.stats()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Wall-clock time to embed a document one chunk per request, in batches,
+and in concurrent batches.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_embeddings --chunks 2000 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+import openai  # noqa: E402
+
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+from embeddings import OpenAIEmbeddings  # noqa: E402
+
+
+def make_chunks(num_chunks: int) -> list[str]:
+    with open(os.path.join(ROOT, "DocumentGPT", "data", "paul_graham_essay.txt")) as f:
+        words = f.read().split()
+    # ~800 characters per chunk, like text_to_docs produces
+    chunks = []
+    for i in range(num_chunks):
+        start = (i * 140) % max(len(words) - 140, 1)
+        chunks.append(" ".join(words[start : start + 140]))
+    return chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--max_concurrency", type=int, default=8)
+    parser.add_argument(
+        "--max_batch_inputs",
+        type=int,
+        default=256,
+        help="Inputs per request the stub accepts before rejecting the batch",
+    )
+    parser.add_argument(
+        "--requests_per_minute",
+        type=int,
+        default=600,
+        help="Limit enforced by the stub (429s) and by the client-side limiter",
+    )
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    configs = [
+        ("serial, one chunk per request", dict(batch_size=1, max_concurrency=1)),
+        ("serial, batched", dict(batch_size=args.batch_size, max_concurrency=1)),
+        (
+            "concurrent, batched",
+            dict(batch_size=args.batch_size, max_concurrency=args.max_concurrency),
+        ),
+    ]
+    with FakeOpenAIServer(
+        latency=args.latency,
+        max_batch_inputs=args.max_batch_inputs,
+        requests_per_minute=args.requests_per_minute,
+    ) as server:
+        openai.api_base = server.url
+        for name, config in configs:
+            # A fresh key per run gives each run its own rate limit budget.
+            embeddings = OpenAIEmbeddings(
+                openai_api_key=f"sk-fake-{name}",
+                requests_per_minute=args.requests_per_minute,
+                # The stub only enforces a requests/min limit.
+                tokens_per_minute=None,
+                **config,
+            )
+            requests_before = server.num_requests
+            limited_before = server.num_rate_limited
+            start = time.perf_counter()
+            vectors = embeddings.embed_documents(chunks)
+            elapsed = time.perf_counter() - start
+            assert len(vectors) == len(chunks)
+            print(
+                f"{name:<32} chunks={len(chunks)} "
+                f"requests={server.num_requests - requests_before:<5} "
+                f"429s={server.num_rate_limited - limited_before:<3} "
+                f"time={elapsed:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""End-to-end offline benchmark of DocumentGPT, SalesGPT and EmailGPT
+against a local fake OpenAI server.
+
+DocumentGPT runs its full pipeline (parse -> text_to_docs -> embed -> search
+-> answer) over the sample files in DocumentGPT/data and the questions in
+questions.md. SalesGPT runs a few scripted conversations and EmailGPT
+converts sample emails. Per-stage latency percentiles, throughput and peak
+memory are written as JSON, so that runs can be compared between commits.
+
+    python -m benchmarks.bench_end_to_end --output bench.json
+    python -m benchmarks.bench_end_to_end --completion-latency 0.5 --error-rate 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "DocumentGPT", "data")
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+from common.tracing import get_tracer  # noqa: E402
+
+API_KEY = "sk-benchmark"
+
+# questions.md section -> sample file it asks about.
+DOCUMENTS = {
+    "Paul Graham Essay": [
+        "paul_graham_essay.pdf",
+        "paul_graham_essay.docx",
+        "paul_graham_essay.txt",
+    ],
+    "Employment Contract": ["employment_agreement.pdf"],
+}
+
+SALES_REPLIES = [
+    "Hi, who is this?",
+    "I am fine, what is this about?",
+    "I already have health insurance.",
+    "It is a bit expensive, to be honest.",
+    "What would switching cost me?",
+    "Alright, send me an offer.",
+]
+
+EMAILS = [
+    "hey, cant make it to the meeting tmrw, can we move it to friday? "
+    "also send me the slides",
+    "we went to barcelona for the weekend and the parking lot at the hotel was full, "
+    "had to park far away. anyway the trip was good, lots to tell u",
+    "pls review the contract before thursday, legal wants changes to section 4 and the "
+    "payment terms. let me know asap",
+]
+
+
+class Recorder:
+    """Collects wall-clock samples, and optionally peak traced memory, per
+    named stage."""
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.peak_bytes: Dict[str, int] = defaultdict(int)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[stage].append(time.perf_counter() - start)
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.peak_bytes[stage] = max(self.peak_bytes[stage], peak)
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.samples[stage].append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            total = sum(ordered)
+            stats = {
+                "count": len(ordered),
+                "mean_ms": total / len(ordered) * 1e3,
+                "p50_ms": percentile(ordered, 50) * 1e3,
+                "p90_ms": percentile(ordered, 90) * 1e3,
+                "p99_ms": percentile(ordered, 99) * 1e3,
+                "max_ms": ordered[-1] * 1e3,
+                "throughput_per_s": len(ordered) / total if total else None,
+            }
+            if stage in self.peak_bytes:
+                stats["peak_traced_mb"] = self.peak_bytes[stage] / 1e6
+            result[stage] = stats
+        return result
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def load_questions() -> Dict[str, List[str]]:
+    questions: Dict[str, List[str]] = defaultdict(list)
+    section = ""
+    with open(os.path.join(DATA_DIR, "questions.md")) as f:
+        for line in f:
+            if line.startswith("## "):
+                section = line[3:].strip()
+            match = re.match(r"\d+\.\s+(.*)", line.strip())
+            if match and section in DOCUMENTS:
+                questions[section].append(match.group(1))
+    return questions
+
+
+def bench_documentgpt(recorder: Recorder, search_mode: str, max_questions: int) -> None:
+    from streaming import StreamingAnswerHandler
+    from utils import (
+        build_index,
+        build_lexical_index,
+        get_answer,
+        get_sources,
+        hash_file,
+        parse_docx,
+        parse_pdf,
+        parse_txt,
+        search_docs,
+        text_to_docs,
+    )
+
+    parsers = {".pdf": parse_pdf, ".docx": parse_docx, ".txt": parse_txt}
+    for section, questions in load_questions().items():
+        for name in DOCUMENTS[section]:
+            with open(os.path.join(DATA_DIR, name), "rb") as f:
+                file = io.BytesIO(f.read())
+            with recorder.measure("documentgpt.parse"):
+                doc = parsers[os.path.splitext(name)[1]](file)
+            with recorder.measure("documentgpt.text_to_docs"):
+                docs = text_to_docs(doc)
+            doc_hash = hash_file(file)
+            with recorder.measure("documentgpt.lexical_index"):
+                lexical_index = build_lexical_index(docs, doc_hash)
+            with recorder.measure("documentgpt.embed_docs"):
+                index = build_index(docs, doc_hash, API_KEY)
+
+            for question in questions[:max_questions]:
+                with recorder.measure("documentgpt.search_docs"):
+                    sources = search_docs(index, question, search_mode, lexical_index)
+                handler = StreamingAnswerHandler(lambda answer: None)
+                with recorder.measure("documentgpt.get_answer"):
+                    answer = get_answer(
+                        sources, question, callbacks=[handler], openai_api_key=API_KEY
+                    )
+                if handler.time_to_first_token is not None:
+                    recorder.record(
+                        "documentgpt.answer_first_token", handler.time_to_first_token
+                    )
+                with recorder.measure("documentgpt.get_sources"):
+                    get_sources(answer, sources)
+
+
+def bench_salesgpt(
+    recorder: Recorder,
+    conversations: int,
+    turns: int,
+    stage_analysis_modes: List[str],
+    summarize_history: bool,
+) -> Dict[str, int]:
+    """Runs scripted conversations; returns the total token counts of the
+    rendered history across prompts if summarize_history is set."""
+    from langchain.chat_models import ChatOpenAI
+
+    from SalesGPT.sales_gpt import SalesGPT
+
+    with open(os.path.join(ROOT, "SalesGPT", "agent_setup.json")) as f:
+        config = json.load(f)
+    llm = ChatOpenAI(temperature=0.9, openai_api_key=API_KEY)  # type: ignore
+    history_tokens: Dict[str, int] = defaultdict(int)
+    for mode in stage_analysis_modes:
+        for _ in range(conversations):
+            # SalesGPT prints every utterance.
+            with contextlib.redirect_stdout(io.StringIO()):
+                agent = SalesGPT.from_llm(
+                    llm,
+                    verbose=False,
+                    stage_analysis=mode,
+                    summarize_history=summarize_history,
+                    **config,
+                )
+                agent.seed_agent()
+                for turn in range(turns):
+                    with recorder.measure(f"salesgpt.turn.{mode}"):
+                        agent.step()
+                    agent.human_step(SALES_REPLIES[turn % len(SALES_REPLIES)])
+            if agent.conversation_memory is not None:
+                history_tokens["tokens_saved"] += agent.conversation_memory.tokens_saved
+                history_tokens["summaries"] += agent.conversation_memory.num_summaries
+    return dict(history_tokens)
+
+
+def bench_emailgpt(recorder: Recorder) -> None:
+    from langchain.llms import OpenAI
+
+    from EmailGPT.prompts import DIALECTS, EMAIL_PROMPT, TONES
+
+    llm = OpenAI(temperature=0, openai_api_key=API_KEY)  # type: ignore
+    for email in EMAILS:
+        for tone in TONES:
+            for dialect in DIALECTS:
+                with recorder.measure("emailgpt.convert"):
+                    llm(EMAIL_PROMPT.format(tone=tone, dialect=dialect, email=email))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--apps", default="documentgpt,salesgpt,emailgpt")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--completion-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--search-mode", default="hybrid")
+    parser.add_argument("--max-questions", type=int, default=10)
+    parser.add_argument("--sales-conversations", type=int, default=2)
+    parser.add_argument("--sales-turns", type=int, default=4)
+    parser.add_argument(
+        "--sales-stage-analysis",
+        default="sequential,concurrent",
+        help="SalesGPT stage analysis modes to run, comma separated",
+    )
+    parser.add_argument("--sales-summarize-history", action="store_true")
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+    apps = set(args.apps.split(","))
+
+    import openai
+
+    recorder = Recorder(trace_memory=args.trace_memory)
+    server = FakeOpenAIServer(
+        latency=args.embedding_latency,
+        requests_per_minute=args.requests_per_minute,
+        completion_latency=args.completion_latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+    )
+    with server, tempfile.TemporaryDirectory() as cache_dir:
+        openai.api_base = server.url
+        os.environ["OPENAI_API_KEY"] = API_KEY
+        # Start cold: no embeddings or indexes from earlier runs.
+        os.environ["DOCUMENTGPT_CACHE_DIR"] = cache_dir
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        if "documentgpt" in apps:
+            bench_documentgpt(recorder, args.search_mode, args.max_questions)
+        sales_memory: Dict[str, int] = {}
+        if "salesgpt" in apps:
+            sales_memory = bench_salesgpt(
+                recorder,
+                args.sales_conversations,
+                args.sales_turns,
+                args.sales_stage_analysis.split(","),
+                args.sales_summarize_history,
+            )
+        if "emailgpt" in apps:
+            bench_emailgpt(recorder)
+        wall_time = time.perf_counter() - start
+        get_tracer().exporter.flush()
+        server_stats = {
+            "requests": server.num_requests,
+            "rate_limited": server.num_rate_limited,
+            "embedded_inputs": server.num_inputs,
+            "completion_tokens": server.num_completion_tokens,
+        }
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": vars(args),
+        "wall_time_s": wall_time,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3,
+        "server": server_stats,
+        "salesgpt_memory": sales_memory,
+        "stages": recorder.summary(),
+        # Spans recorded by the apps' own instrumentation.
+        "operations": get_tracer().summary(),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Build time and query latency of the local BM25 index.
+
+    python -m benchmarks.bench_lexical --chunks 100000 --queries 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from chunk_store import ChunkStore  # noqa: E402
+from lexical import BM25Index, tokenize  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "DocumentGPT", "data", "paul_graham_essay.txt")) as f:
+        text = f.read()
+    pieces = [text[i : i + 800] for i in range(0, len(text) - 800, 800)]
+    chunks = [pieces[i % len(pieces)] + f" item-{i}" for i in range(args.chunks)]
+    store = ChunkStore.from_pages([chunks[i : i + 5] for i in range(0, len(chunks), 5)])
+
+    start = time.perf_counter()
+    index = BM25Index(store)
+    build = time.perf_counter() - start
+    print(f"{len(store)} chunks, {len(index.postings)} terms, built in {build:.2f}s")
+
+    rng = random.Random(0)
+    words = tokenize(text)
+    queries = [
+        " ".join(rng.sample(words, 6)) + f" item-{rng.randrange(args.chunks)}"
+        for _ in range(args.queries)
+    ]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, k=args.k)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(
+        f"query p50={latencies[len(latencies) // 2] * 1e3:.2f} ms "
+        f"p95={latencies[int(len(latencies) * 0.95)] * 1e3:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Serial vs. process-pool PDF page extraction on the bundled sample PDFs.
+
+Reports time to the first cleaned page and total time. Use --copies to
+repeat each PDF's pages and simulate a long report.
+
+    python -m benchmarks.bench_parse_pdf --copies 10
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "DocumentGPT"))
+
+from pypdf import PdfReader, PdfWriter  # noqa: E402
+
+from pdf_pages import iter_pdf_pages  # noqa: E402
+
+
+def load_pdf(path: str, copies: int) -> BytesIO:
+    with open(path, "rb") as f:
+        data = f.read()
+    if copies > 1:
+        reader = PdfReader(BytesIO(data))
+        writer = PdfWriter()
+        for _ in range(copies):
+            for page in reader.pages:
+                writer.add_page(page)
+        out = BytesIO()
+        writer.write(out)
+        data = out.getvalue()
+    return BytesIO(data)
+
+
+def run(file: BytesIO, processes: int) -> tuple[int, float, float]:
+    start = time.perf_counter()
+    first_page = None
+    num_pages = 0
+    for _ in iter_pdf_pages(file, processes=processes):
+        if first_page is None:
+            first_page = time.perf_counter() - start
+        num_pages += 1
+    return num_pages, first_page or 0.0, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(os.path.join(ROOT, "DocumentGPT", "data", "*.pdf"))):
+        file = load_pdf(path, args.copies)
+        for processes in (1, args.processes):
+            num_pages, first_page, total = run(file, processes)
+            print(
+                f"{os.path.basename(path):<28} pages={num_pages:<5} "
+                f"processes={processes:<3} first_page={first_page * 1000:8.1f}ms "
+                f"total={total:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Time to render SalesGPT's prompts for a turn, plain vs compiled templates.
+
+Formats the utterance and stage analyzer prompts of an agent with
+langchain's PromptTemplate, as SalesGPT did, and with the
+CompiledPromptTemplate it uses now, for growing conversation histories.
+Also checks that both render the same prompts, and that the compiled
+prompts of different turns and sessions start with the same prefix.
+
+    python -m benchmarks.bench_prompt_rendering --turns 40 --repeat 2000
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "SalesGPT"))
+
+from benchmarks.bench_end_to_end import SALES_REPLIES  # noqa: E402
+
+
+def time_per_call(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    from langchain import PromptTemplate
+    from langchain.chat_models import ChatOpenAI
+
+    from sales_gpt import CONVERSATION_STAGES, SalesGPT
+
+    template = SalesGPT.from_llm(ChatOpenAI(openai_api_key="sk-benchmark"))  # type: ignore
+    template.print_conversation = False
+    agent = template.new_session()
+    other = template.new_session()
+    chains = {
+        "utterance": agent.sales_conversation_utterance_chain,
+        "stage_analysis": agent.stage_analyzer_chain,
+    }
+    plain = {
+        kind: PromptTemplate(template=chain.prompt.template, input_variables=chain.prompt.input_variables)
+        for kind, chain in chains.items()
+    }
+
+    def inputs(kind: str, conversation: SalesGPT) -> Dict[str, Any]:
+        # The inputs LLMChain passes to the prompt.
+        if kind == "utterance":
+            all_inputs = conversation._utterance_inputs()
+        else:
+            all_inputs = conversation._stage_analyzer_inputs(
+                conversation.conversation_history, conversation.conversation_stage_id
+            )
+        return {key: all_inputs[key] for key in chains[kind].prompt.input_variables}
+
+    def legacy_stage_inputs(conversation: SalesGPT) -> Dict[str, Any]:
+        # What SalesGPT built for every stage analysis before.
+        return dict(
+            conversation_history="\n".join(conversation.conversation_history).rstrip("\n"),
+            conversation_stage_id=conversation.conversation_stage_id,
+            conversation_stages="\n".join(
+                [str(key) + ": " + str(value) for key, value in CONVERSATION_STAGES.items()]
+            ),
+        )
+
+    print(f"prefix tokens: {agent.prompt_prefix_tokens()}")
+    print(f"{'turns':>5} {'kind':<15} {'chars':>6} {'plain':>9} {'compiled':>9} {'speedup':>8}")
+    prefixes: Dict[str, set] = {kind: set() for kind in chains}
+    for turn in range(args.turns + 1):
+        if turn and turn % 10 == 0 or turn == 1:
+            for kind, chain in chains.items():
+                compiled_inputs = inputs(kind, agent)
+                prompt = chain.prompt.format(**compiled_inputs)
+                assert prompt == plain[kind].format(**compiled_inputs)
+                if kind == "utterance":
+                    plain_time = time_per_call(lambda: plain[kind].format(**inputs(kind, agent)), args.repeat)
+                else:
+                    plain_time = time_per_call(lambda: plain[kind].format(**legacy_stage_inputs(agent)), args.repeat)
+                compiled_time = time_per_call(lambda: chain.prompt.format(**inputs(kind, agent)), args.repeat)
+                print(
+                    f"{len(agent.conversation_history):>5} {kind:<15} {len(prompt):>6} "
+                    f"{plain_time * 1e6:>7.1f}us {compiled_time * 1e6:>7.1f}us {plain_time / compiled_time:>7.1f}x"
+                )
+                prefixes[kind].add(chain.prompt.prefix(**compiled_inputs))
+                prefixes[kind].add(chain.prompt.prefix(**inputs(kind, other)))
+        agent.conversation_history.append(
+            f"{agent.salesperson_name}: Thanks, that helps. Could you tell me a bit more about it? <END_OF_TURN>"
+        )
+        agent.human_step(SALES_REPLIES[turn % len(SALES_REPLIES)])
+    for kind, seen in prefixes.items():
+        print(f"{kind}: {len(seen)} distinct prefix across turns and sessions")
+
+
+if __name__ == "__main__":
+    main()
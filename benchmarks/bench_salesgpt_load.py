@@ -0,0 +1,304 @@
+"""Load harness running many simulated SalesGPT conversations in parallel.
+
+Each conversation is a SalesGPT agent, built from an agent config as in
+SalesGPT/run.py, talking to a scripted prospect until the agent ends the call
+with <END_OF_CALL> or --max-num-turns is reached. The LLM is a local fake
+OpenAI API in its own process, which ends the call once the prospect says
+goodbye. Per config, the harness reports conversations and turns per second,
+turn and conversation latency percentiles, and prompt tokens per turn, so a
+new persona or prompt can be compared with the current one before rollout.
+
+    python -m benchmarks.bench_salesgpt_load --config SalesGPT/agent_setup.json new_persona.json
+    python -m benchmarks.bench_salesgpt_load --conversations 500 --parallel 100 --prospect-scripts scripts.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "SalesGPT"))
+
+from benchmarks.bench_end_to_end import SALES_REPLIES, percentile  # noqa: E402
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+
+GOODBYE = "Thanks, that is all for now. Goodbye."
+
+# Prospect messages per conversation, used in turn; --prospect-scripts
+# takes a JSON file with a list of such lists.
+DEFAULT_PROSPECT_SCRIPTS = [
+    SALES_REPLIES,
+    ["Hello?", "Sorry, I'm not interested."],
+    [
+        "Hi, what is this about?",
+        "I'm the one who handles our insurance, yes.",
+        "Our premiums went up twice this year.",
+        "What would you offer instead?",
+        "How fast do you pay out claims?",
+        "And if I want to cancel?",
+        "Alright, that sounds fair.",
+        "Send me the contract and I'll have a look.",
+    ],
+]
+
+AGENT_UTTERANCES = [
+    "Good morning! Thanks for picking up, do you have a couple of minutes?",
+    "I'm calling to see whether your current plan still fits what you need.",
+    "Many of our customers switched because we keep premiums stable and pay claims quickly.",
+    "Could you tell me what matters most to you in a plan?",
+    "Based on that, our plan would cover you abroad and cap your premium for three years.",
+    "I understand, and switching is free: we take care of cancelling your old contract.",
+    "Shall I send you an offer today so you can compare it in your own time?",
+]
+
+# The turn of the conversation the running code belongs to.
+current_turn: ContextVar[Optional[int]] = ContextVar("current_turn", default=None)
+
+
+def _last_user_message(prompt: str) -> str:
+    messages = re.findall(r"User: (.*?)(?: <END_OF_TURN>|$)", prompt, re.M)
+    return messages[-1] if messages else ""
+
+
+def prospect_aware_reply(prompt: str) -> str:
+    """Fake completions for SalesGPT: the stage advances with every prospect
+    message, and the agent ends the call once the prospect says goodbye."""
+    said_goodbye = "Goodbye" in _last_user_message(prompt)
+    if "one number only" in prompt:
+        return "8" if said_goodbye else str(min(prompt.count("User: ") + 1, 7))
+    if "Progressively summarize" in prompt:
+        return "The agent called about switching insurance and the prospect asked about the offer."
+    if said_goodbye:
+        return "Thank you for your time, have a great day! <END_OF_TURN> <END_OF_CALL>"
+    turn = prompt.count("User: ")
+    return AGENT_UTTERANCES[turn % len(AGENT_UTTERANCES)] + " <END_OF_TURN>"
+
+
+def prompt_kind(prompt: str) -> str:
+    if "one number only" in prompt:
+        return "stage_analysis"
+    if "Progressively summarize" in prompt:
+        return "summary"
+    return "utterance"
+
+
+def run_fake_openai(urls: "multiprocessing.Queue[str]", completion_latency: float,
+                    tokens_per_second: float) -> None:
+    with FakeOpenAIServer(
+        completion_latency=completion_latency,
+        tokens_per_second=tokens_per_second,
+        reply=prospect_aware_reply,
+    ) as server:
+        urls.put(server.url)
+        while True:
+            time.sleep(3600)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Runs functions in the context they were submitted from. As the event
+    loop's default executor, it lets the sync callback handlers that
+    langchain runs in it see current_turn."""
+
+    def submit(self, fn: Any, /, *args: Any, **kwargs: Any) -> Any:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def make_prompt_token_counter() -> Any:
+    import tiktoken
+    from langchain.callbacks.base import BaseCallbackHandler
+
+    class PromptTokenCounter(BaseCallbackHandler):
+        """Counts the tokens of every prompt sent to the LLM, by kind of
+        prompt and by the turn it was sent for."""
+
+        def __init__(self) -> None:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+            self.tokens: Dict[str, Dict[int, List[int]]] = defaultdict(lambda: defaultdict(list))
+            self.lock = threading.Lock()
+
+        def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+            turn = current_turn.get()
+            if turn is None:
+                return
+            for prompt in prompts:
+                num_tokens = len(self.encoding.encode(prompt))
+                with self.lock:
+                    self.tokens[prompt_kind(prompt)][turn].append(num_tokens)
+
+    return PromptTokenCounter()
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1e3,
+        "p50_ms": percentile(ordered, 50) * 1e3,
+        "p95_ms": percentile(ordered, 95) * 1e3,
+        "p99_ms": percentile(ordered, 99) * 1e3,
+        "max_ms": ordered[-1] * 1e3,
+    }
+
+
+def token_growth(per_turn: Dict[int, List[int]]) -> Dict[str, Any]:
+    """Mean prompt tokens per turn, and the least-squares slope over turns."""
+    means = {turn: sum(tokens) / len(tokens) for turn, tokens in sorted(per_turn.items())}
+    if not means:
+        return {}
+    turns = list(means)
+    mean_turn = sum(turns) / len(turns)
+    mean_tokens = sum(means.values()) / len(means)
+    variance = sum((turn - mean_turn) ** 2 for turn in turns)
+    slope = (
+        sum((turn - mean_turn) * (tokens - mean_tokens) for turn, tokens in means.items()) / variance
+        if variance
+        else 0.0
+    )
+    return {
+        "mean_tokens_by_turn": {str(turn + 1): round(tokens, 1) for turn, tokens in means.items()},
+        "tokens_per_turn": slope,
+    }
+
+
+async def run_config(args: argparse.Namespace, config_path: str, scripts: List[List[str]]) -> Dict[str, Any]:
+    import aiohttp
+    import openai
+    from langchain.chat_models import ChatOpenAI
+    from sales_gpt import SalesGPT
+
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    if args.stage_analysis is not None:
+        config["stage_analysis"] = args.stage_analysis
+    counter = make_prompt_token_counter()
+    llm = ChatOpenAI(temperature=0.9, openai_api_key="sk-benchmark", callbacks=[counter])  # type: ignore
+    template = SalesGPT.from_llm(llm, verbose=False, **config)
+    template.print_conversation = False
+
+    turn_latencies: List[float] = []
+    conversation_latencies: List[float] = []
+    outcomes: Counter = Counter()
+    parallel = asyncio.Semaphore(args.parallel)
+
+    async def conversation(script: List[str]) -> None:
+        async with parallel:
+            agent = template.new_session()
+            start = time.perf_counter()
+            outcome = "max_num_turns"
+            try:
+                for turn in range(args.max_num_turns):
+                    current_turn.set(turn)
+                    turn_start = time.perf_counter()
+                    await agent.astep()
+                    turn_latencies.append(time.perf_counter() - turn_start)
+                    if "<END_OF_CALL>" in agent.conversation_history[-1]:
+                        outcome = "end_of_call"
+                        break
+                    agent.human_step(script[turn] if turn < len(script) else GOODBYE)
+                await agent.apply_pending_stage()
+                # Wait for a summary still being written, so its LLM call
+                # is counted and does not outlive the fake OpenAI server.
+                memory = agent.conversation_memory
+                pending = memory._pending if memory is not None else None
+                if pending is not None:
+                    await asyncio.wrap_future(pending)
+            except Exception as e:
+                outcome = f"error: {type(e).__name__}"
+            outcomes[outcome] += 1
+            conversation_latencies.append(time.perf_counter() - start)
+
+    asyncio.get_running_loop().set_default_executor(ContextThreadPoolExecutor())
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=args.parallel * 2)
+    ) as http_session:
+        # Inherited by the conversation tasks below.
+        openai.aiosession.set(http_session)
+        start = time.perf_counter()
+        await asyncio.gather(*(conversation(scripts[i % len(scripts)]) for i in range(args.conversations)))
+        wall_time = time.perf_counter() - start
+
+    return {
+        "config": config_path,
+        "stage_analysis": template.stage_analysis,
+        "conversations": args.conversations,
+        "outcomes": dict(outcomes),
+        "wall_time_s": wall_time,
+        "conversations_per_s": args.conversations / wall_time,
+        "turns": len(turn_latencies),
+        "turns_per_s": len(turn_latencies) / wall_time,
+        "turn_latency": latency_summary(turn_latencies),
+        "conversation_latency": latency_summary(conversation_latencies),
+        "llm_calls": {
+            kind: sum(len(tokens) for tokens in per_turn.values()) for kind, per_turn in counter.tokens.items()
+        },
+        "prompt_tokens": {kind: token_growth(per_turn) for kind, per_turn in counter.tokens.items()},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--config",
+        nargs="+",
+        default=[os.path.join(ROOT, "SalesGPT", "agent_setup.json")],
+        help="Agent config files, as taken by SalesGPT/run.py; each is run in turn",
+    )
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--parallel", type=int, default=50, help="Conversations running at once")
+    parser.add_argument("--max-num-turns", type=int, default=10, help="Agent turns per conversation at most")
+    parser.add_argument("--stage-analysis", default=None, help="Override the configs' stage_analysis")
+    parser.add_argument("--prospect-scripts", help="JSON file with a list of lists of prospect messages")
+    parser.add_argument("--completion-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    # openai logs every request at INFO level.
+    logging.getLogger("openai").setLevel(logging.WARNING)
+
+    scripts = DEFAULT_PROSPECT_SCRIPTS
+    if args.prospect_scripts:
+        with open(args.prospect_scripts, "r") as f:
+            scripts = json.load(f)
+
+    urls: "multiprocessing.Queue[str]" = multiprocessing.Queue()
+    fake_openai = multiprocessing.Process(
+        target=run_fake_openai,
+        args=(urls, args.completion_latency, args.tokens_per_second),
+        daemon=True,
+    )
+    fake_openai.start()
+    results = []
+    try:
+        import openai
+
+        openai.api_base = urls.get(timeout=30)
+        for config_path in args.config:
+            results.append(asyncio.run(run_config(args, config_path, scripts)))
+    finally:
+        fake_openai.terminate()
+
+    output = json.dumps({"settings": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
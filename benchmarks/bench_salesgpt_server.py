@@ -0,0 +1,234 @@
+"""Load test of the SalesGPT server against a fake OpenAI server.
+
+Starts SalesGPT/server.py and the fake OpenAI API in separate processes,
+then runs many concurrent conversations against it, each a few turns with
+think time between messages. Reports request latency percentiles, errors,
+and the server's CPU time and peak memory, from which the number of
+concurrent sessions one core can host follows.
+
+    python -m benchmarks.bench_salesgpt_server --sessions 1000 --turns 4
+    python -m benchmarks.bench_salesgpt_server --sessions 2000 --max-concurrent-steps 32
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_end_to_end import SALES_REPLIES, percentile  # noqa: E402
+from benchmarks.fake_openai import FakeOpenAIServer  # noqa: E402
+
+
+def run_fake_openai(urls: "multiprocessing.Queue[str]", completion_latency: float,
+                    tokens_per_second: float) -> None:
+    with FakeOpenAIServer(
+        completion_latency=completion_latency, tokens_per_second=tokens_per_second
+    ) as server:
+        urls.put(server.url)
+        while True:
+            time.sleep(3600)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_stats(pid: int) -> Dict[str, float]:
+    """CPU seconds and peak resident memory of a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    stats = {"cpu_s": (int(fields[11]) + int(fields[12])) / ticks}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmHWM:", "VmRSS:")):
+                key = "peak_rss_mb" if line.startswith("VmHWM:") else "rss_mb"
+                stats[key] = int(line.split()[1]) / 1e3
+    return stats
+
+
+class LoadTest:
+    def __init__(self, url: str, turns: int, think_time: float, client: aiohttp.ClientSession) -> None:
+        self.url = url
+        self.turns = turns
+        self.think_time = think_time
+        self.client = client
+        self.latencies: Dict[str, List[float]] = {"create": [], "message": []}
+        self.statuses: Counter = Counter()
+
+    async def request(self, kind: str, path: str, body: Optional[dict] = None) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            async with self.client.post(self.url + path, json=body) as response:
+                result = await response.json()
+                status = response.status
+        except aiohttp.ClientError as e:
+            self.statuses[type(e).__name__] += 1
+            return None
+        self.statuses[status] += 1
+        if status != 200:
+            return None
+        self.latencies[kind].append(time.perf_counter() - start)
+        return result
+
+    async def conversation(self, rng: random.Random, ramp: float) -> None:
+        await asyncio.sleep(rng.uniform(0, ramp))
+        session = await self.request("create", "/sessions")
+        if session is None:
+            return
+        for turn in range(self.turns):
+            await asyncio.sleep(rng.expovariate(1 / self.think_time) if self.think_time else 0)
+            reply = await self.request(
+                "message",
+                f"/sessions/{session['session_id']}/messages",
+                {"message": SALES_REPLIES[turn % len(SALES_REPLIES)]},
+            )
+            if reply is None or reply["end_of_call"]:
+                break
+        async with self.client.delete(f"{self.url}/sessions/{session['session_id']}"):
+            pass
+
+
+async def poll_sessions(url: str, client: aiohttp.ClientSession, peak: Dict[str, int]) -> None:
+    while True:
+        async with client.get(url + "/stats") as response:
+            stats = await response.json()
+        peak["sessions"] = max(peak.get("sessions", 0), stats["sessions"])
+        peak["queued_steps"] = max(peak.get("queued_steps", 0), stats["queued_steps"])
+        await asyncio.sleep(0.2)
+
+
+async def run_load(args: argparse.Namespace, url: str, pid: int) -> Dict[str, Any]:
+    connector = aiohttp.TCPConnector(limit=args.client_connections)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as client:
+        for _ in range(300):
+            try:
+                async with client.get(url + "/stats") as response:
+                    if response.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("The SalesGPT server did not start")
+
+        load = LoadTest(url, args.turns, args.think_time, client)
+        peak: Dict[str, int] = {}
+        poller = asyncio.create_task(poll_sessions(url, client, peak))
+        rng = random.Random(0)
+        before = process_stats(pid)
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(load.conversation(random.Random(rng.random()), args.ramp) for _ in range(args.sessions))
+        )
+        wall_time = time.perf_counter() - start
+        after = process_stats(pid)
+        poller.cancel()
+        async with client.get(url + "/stats") as response:
+            server_stats = await response.json()
+
+    cpu_s = after["cpu_s"] - before["cpu_s"]
+    requests = sum(len(samples) for samples in load.latencies.values())
+    return {
+        "wall_time_s": wall_time,
+        "server_cpu_s": cpu_s,
+        "server_cpu_utilization": cpu_s / wall_time,
+        "server_peak_rss_mb": after.get("peak_rss_mb"),
+        "peak_sessions": peak.get("sessions", 0),
+        "peak_queued_steps": peak.get("queued_steps", 0),
+        "turns_per_cpu_s": requests / cpu_s if cpu_s else None,
+        # Sessions one fully busy core keeps up with, if each sends a message
+        # every think-time seconds.
+        "sessions_per_core": requests / cpu_s * args.think_time if cpu_s else None,
+        "statuses": {str(status): count for status, count in load.statuses.items()},
+        "latency_ms": {
+            kind: {
+                "count": len(samples),
+                "p50": percentile(sorted(samples), 50) * 1e3,
+                "p95": percentile(sorted(samples), 95) * 1e3,
+                "p99": percentile(sorted(samples), 99) * 1e3,
+            }
+            for kind, samples in load.latencies.items()
+            if samples
+        },
+        "server": server_stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds between messages")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which sessions start")
+    parser.add_argument("--completion-latency", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--stage-analysis", default="concurrent")
+    parser.add_argument("--max-concurrent-steps", type=int, default=64)
+    parser.add_argument("--max-queued-steps", type=int, default=4096)
+    parser.add_argument("--client-connections", type=int, default=512)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    urls: "multiprocessing.Queue[str]" = multiprocessing.Queue()
+    fake_openai = multiprocessing.Process(
+        target=run_fake_openai,
+        args=(urls, args.completion_latency, args.tokens_per_second),
+        daemon=True,
+    )
+    fake_openai.start()
+    api_base = urls.get(timeout=30)
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as log_dir, open(
+        os.path.join(log_dir, "server.log"), "w"
+    ) as log:
+        # The server's logger writes output.log to its working directory.
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(ROOT, "SalesGPT", "server.py"),
+                "--port", str(port),
+                "--stage_analysis", args.stage_analysis,
+                "--max_concurrent_steps", str(args.max_concurrent_steps),
+                "--max_queued_steps", str(args.max_queued_steps),
+            ],
+            cwd=log_dir,
+            env={**os.environ, "OPENAI_API_KEY": "sk-benchmark", "OPENAI_API_BASE": api_base},
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            report = asyncio.run(run_load(args, f"http://127.0.0.1:{port}", server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+            fake_openai.terminate()
+
+    report = {"config": vars(args), "cpu_count": os.cpu_count(), **report}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
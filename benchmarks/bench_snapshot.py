@@ -0,0 +1,112 @@
+"""Size of SalesGPT session snapshots and the time to save and resume them.
+
+Builds sessions with synthetic conversations, then times snapshot(), the
+SQLite SnapshotStore save and load, and resuming an agent from a loaded
+snapshot. Sizes are compared with the session's full state as JSON,
+persona included.
+
+    python -m benchmarks.bench_snapshot --sessions 2000 --turns 20
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "SalesGPT"))
+
+from benchmarks.bench_end_to_end import SALES_REPLIES, percentile  # noqa: E402
+
+
+def report(name: str, samples: List[float]) -> None:
+    ordered = sorted(samples)
+    print(
+        f"{name:<12} p50={percentile(ordered, 50) * 1e6:7.1f} us"
+        f"  p95={percentile(ordered, 95) * 1e6:7.1f} us"
+        f"  p99={percentile(ordered, 99) * 1e6:7.1f} us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    from langchain.chat_models import ChatOpenAI
+    from sales_gpt import PERSONA_FIELDS, SalesGPT
+    from snapshot import SnapshotStore
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        template = SalesGPT.from_llm(ChatOpenAI(openai_api_key="sk-benchmark"))  # type: ignore
+        template.print_conversation = False
+        rng = random.Random(0)
+        agents = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.sessions):
+                agent = template.new_session()
+                for turn in range(args.turns):
+                    agent.conversation_history.append(
+                        f"{agent.salesperson_name}: Thanks, that helps. Could you tell me a bit more "
+                        f"about your current plan, number {rng.randrange(1000)}? <END_OF_TURN>"
+                    )
+                    agent.human_step(SALES_REPLIES[turn % len(SALES_REPLIES)])
+                agent._set_conversation_stage(str(rng.randint(1, 8)))
+                agents.append(agent)
+
+        full_sizes, snapshots, snapshot_times = [], [], []
+        for agent in agents:
+            full_state = {
+                field: getattr(agent, field)
+                for field in PERSONA_FIELDS
+                + ("conversation_history", "conversation_stage_id", "current_conversation_stage")
+            }
+            full_sizes.append(len(json.dumps(full_state).encode("utf-8")))
+            start = time.perf_counter()
+            snapshots.append(agent.snapshot())
+            snapshot_times.append(time.perf_counter() - start)
+
+        store = SnapshotStore(os.path.join(tmp_dir, "sessions.sqlite3"))
+        save_times = []
+        for i, agent in enumerate(agents):
+            start = time.perf_counter()
+            store.save(f"session-{i}", agent)
+            save_times.append(time.perf_counter() - start)
+
+        load_times, restore_times = [], []
+        for i in rng.sample(range(len(agents)), len(agents)):
+            start = time.perf_counter()
+            resumed = store.load(f"session-{i}", template)
+            load_times.append(time.perf_counter() - start)
+            assert resumed is not None
+            assert resumed.conversation_history == agents[i].conversation_history
+            start = time.perf_counter()
+            template.new_session().restore(snapshots[i])
+            restore_times.append(time.perf_counter() - start)
+        file_size = sum(
+            os.path.getsize(os.path.join(tmp_dir, name))
+            for name in os.listdir(tmp_dir)
+            if name.startswith("sessions.sqlite3")
+        )
+
+    print(f"{args.sessions} sessions of {args.turns * 2} turns")
+    print(
+        f"state as JSON {sum(full_sizes) / len(full_sizes):.0f} B, "
+        f"snapshot {sum(map(len, snapshots)) / len(snapshots):.0f} B per session, "
+        f"SQLite file {file_size / 1e6:.1f} MB"
+    )
+    report("snapshot", snapshot_times)
+    report("store.save", save_times)
+    report("store.load", load_times)
+    report("restore", restore_times)
+
+
+if __name__ == "__main__":
+    main()
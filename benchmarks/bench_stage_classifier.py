@@ -0,0 +1,87 @@
+"""Accuracy of SalesGPT's local stage classifier, and the fraction of stage
+analyzer LLM calls it saves, by cross-validation over labelled turns.
+
+Conversations are split into folds, so no conversation is both trained and
+tested on. The default labelled set is SalesGPT/data/stage_examples.jsonl;
+logs written with SalesGPT's stage_log_path can be added.
+
+    python -m benchmarks.bench_stage_classifier
+    python -m benchmarks.bench_stage_classifier --examples stage_log.jsonl --thresholds 0.5,0.7,0.9
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "SalesGPT"))
+
+from stage_classifier import StageClassifier, load_examples  # noqa: E402
+
+STAGES = [str(stage) for stage in range(1, 9)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--examples",
+        nargs="+",
+        default=[os.path.join(ROOT, "SalesGPT", "data", "stage_examples.jsonl")],
+    )
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--thresholds", default="0.4,0.5,0.6,0.7,0.8,0.9")
+    args = parser.parse_args()
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+
+    examples = [example for path in args.examples for example in load_examples(path)]
+    conversations: Dict[str, List[dict]] = defaultdict(list)
+    for i, example in enumerate(examples):
+        conversations[str(example.get("conversation", i))].append(example)
+    conversation_ids = sorted(conversations)
+    print(f"{len(examples)} labelled turns in {len(conversations)} conversations")
+
+    totals: Dict[float, Dict[str, float]] = {t: defaultdict(float) for t in thresholds}
+    fit_time = predict_time = 0.0
+    for fold in range(args.folds):
+        test_ids = set(conversation_ids[fold :: args.folds])
+        train = [e for c in conversation_ids if c not in test_ids for e in conversations[c]]
+        test = [e for c in sorted(test_ids) for e in conversations[c]]
+        if not test:
+            continue
+        start = time.perf_counter()
+        classifier = StageClassifier(STAGES).fit(train)
+        fit_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for example in test:
+            classifier.predict(example["conversation_history"], example["conversation_stage_id"])
+        predict_time += time.perf_counter() - start
+
+        for threshold in thresholds:
+            result = classifier.evaluate(test, threshold)
+            for key, value in result.items():
+                # Sum the per-fold rates back into counts.
+                totals[threshold][key] += value if key == "examples" else value * len(test)
+
+    print(
+        f"fit {fit_time / args.folds * 1e3:.1f} ms per fold, "
+        f"predict {predict_time / len(examples) * 1e6:.0f} us per turn"
+    )
+    print("threshold  accuracy  confident_accuracy  accuracy_with_fallback  llm_calls_saved")
+    for threshold in thresholds:
+        total = totals[threshold]
+        n = total["examples"]
+        confident = total["llm_calls_saved"]
+        # Correct confident predictions, from the accuracy with fallback.
+        confident_correct = total["accuracy_with_fallback"] - (n - confident)
+        confident_accuracy = confident_correct / confident if confident else 0.0
+        print(
+            f"{threshold:9.2f}  {total['accuracy'] / n:8.3f}  {confident_accuracy:18.3f}"
+            f"  {total['accuracy_with_fallback'] / n:22.3f}  {total['llm_calls_saved'] / n:15.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
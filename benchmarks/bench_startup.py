@@ -0,0 +1,200 @@
+"""Cold start time of each entry point, against a budget.
+
+Every entry point is started in a fresh interpreter:
+
+- documentgpt, emailgpt: the Streamlit script runs once in bare mode, with
+  streamlit already imported as it is in a Streamlit server. "first_input"
+  is when the first input widget is created, after the page header;
+  "ready" is when the modules needed to answer are imported.
+- emailgpt-batch: `batch.py --help`.
+- salesgpt: importing sales_gpt, which must not create a log file.
+- salesgpt-server: until server.py answers GET /stats.
+
+The slowest top-level imports of each run are listed from
+`python -X importtime`. With --check, the exit
+status is 1 if an entry point is over its budget.
+
+    python -m benchmarks.bench_startup --repeat 3 --check
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds; "first_input" for the Streamlit apps, the total otherwise.
+BUDGETS_MS = {
+    "documentgpt": 500,
+    "emailgpt": 500,
+    "emailgpt-batch": 1000,
+    "salesgpt": 3000,
+    "salesgpt-server": 5000,
+}
+
+STREAMLIT_PROBE = """
+import json, sys, time, runpy
+import streamlit as st
+start = time.perf_counter()
+marks = {}
+def mark(name):
+    original = getattr(st, name)
+    def wrapper(*args, **kwargs):
+        marks.setdefault("first_input", time.perf_counter() - start)
+        return original(*args, **kwargs)
+    setattr(st, name, wrapper)
+mark("file_uploader")
+mark("text_area")
+mark("selectbox")
+sys.path.insert(0, sys.argv[1])
+runpy.run_path(sys.argv[2], run_name="__main__")
+sys.path.insert(0, sys.argv[3])
+from common.lazy import import_preloaded
+for name in sys.argv[4:]:
+    import_preloaded(name)
+marks["ready"] = time.perf_counter() - start
+print("PROBE " + json.dumps(marks))
+"""
+
+IMPORT_PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import sales_gpt
+print("PROBE " + json.dumps({
+    "ready": time.perf_counter() - start,
+    "created_output_log": os.path.exists("output.log"),
+}))
+"""
+
+
+def slowest_imports(stderr: str, top: int = 5) -> List[Tuple[str, float]]:
+    """The top-level imports with the largest cumulative time, in ms, from
+    -X importtime output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            # Nested import, or the header.
+            continue
+        imports.append((name.strip(), int(cumulative) / 1e3))
+    return sorted(imports, key=lambda item: -item[1])[:top]
+
+
+def run_probe(args: List[str], cwd: str) -> Tuple[Dict[str, Any], str]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd, capture_output=True, text=True, env={**os.environ, "PYTHONWARNINGS": "ignore"},
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("PROBE "):
+            return json.loads(line[len("PROBE "):]), result.stderr
+    raise RuntimeError(f"The probe failed:\n{result.stderr[-2000:]}")
+
+
+def probe_streamlit(app_dir: str, script: str, preloaded: List[str], cwd: str) -> Tuple[Dict[str, Any], str]:
+    marks, stderr = run_probe(
+        ["-c", STREAMLIT_PROBE, os.path.join(ROOT, app_dir), os.path.join(ROOT, app_dir, script), ROOT, *preloaded],
+        cwd,
+    )
+    return {key: value * 1e3 for key, value in marks.items()}, stderr
+
+
+def probe_command(command: List[str], cwd: str) -> Tuple[Dict[str, Any], str]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *command], cwd=cwd, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{command} failed:\n{result.stderr[-2000:]}")
+    return {"ready": elapsed * 1e3}, result.stderr
+
+
+def probe_salesgpt(cwd: str) -> Tuple[Dict[str, Any], str]:
+    marks, stderr = run_probe(["-c", IMPORT_PROBE, os.path.join(ROOT, "SalesGPT")], cwd)
+    return {"ready": marks["ready"] * 1e3, "created_output_log": marks["created_output_log"]}, stderr
+
+
+def probe_server(cwd: str) -> Tuple[Dict[str, Any], str]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # A file rather than a pipe, which the import times would fill up.
+    with tempfile.TemporaryFile("w+") as stderr:
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-X", "importtime", os.path.join(ROOT, "SalesGPT", "server.py"), "--port", str(port)],
+            cwd=cwd,
+            env={**os.environ, "OPENAI_API_KEY": "sk-benchmark"},
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+        )
+        try:
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1):
+                        break
+                except OSError:
+                    if server.poll() is not None or time.perf_counter() - start > 60:
+                        raise RuntimeError("The SalesGPT server did not start")
+                    time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+        stderr.seek(0)
+        return {"ready": elapsed * 1e3}, stderr.read()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per entry point; the fastest counts")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 if an entry point is over budget")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {}
+    over_budget = []
+    with tempfile.TemporaryDirectory() as cwd:
+        probes = {
+            "documentgpt": lambda: probe_streamlit("DocumentGPT", "main.py", ["utils"], cwd),
+            "emailgpt": lambda: probe_streamlit("EmailGPT", "app.py", ["conversion"], cwd),
+            "emailgpt-batch": lambda: probe_command([os.path.join(ROOT, "EmailGPT", "batch.py"), "--help"], cwd),
+            "salesgpt": lambda: probe_salesgpt(cwd),
+            "salesgpt-server": lambda: probe_server(cwd),
+        }
+        for name, probe in probes.items():
+            runs = [probe() for _ in range(args.repeat)]
+            marks, stderr = min(runs, key=lambda run: run[0]["ready"])
+            measured = marks.get("first_input", marks["ready"])
+            report[name] = {
+                **marks,
+                "budget_ms": BUDGETS_MS[name],
+                "within_budget": measured <= BUDGETS_MS[name] and not marks.get("created_output_log"),
+                "slowest_imports_ms": dict(slowest_imports(stderr)),
+            }
+            if not report[name]["within_budget"]:
+                over_budget.append(name)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.check and over_budget:
+        print(f"Over budget: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
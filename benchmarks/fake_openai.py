@@ -0,0 +1,333 @@
+"""A local stand-in for the OpenAI HTTP API, used by the benchmarks.
+
+Point the ``openai`` package at it with ``openai.api_base = server.url``.
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """Deterministic pseudo-embedding derived from the text's hash."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(seed[i % len(seed)] - 128) / 128.0 for i in range(dim)]
+
+
+def default_reply(prompt: str) -> str:
+    """A plausible completion for the prompts of the apps in this repo."""
+    if "conversation stage" in prompt and "one number only" in prompt:
+        # SalesGPT's stage analyzer.
+        return "2"
+    if "SOURCES" in prompt:
+        # DocumentGPT: cite the first two excerpts of the last question, not
+        # those of the worked example.
+        excerpts = prompt.rsplit("QUESTION:", 1)[-1]
+        sources = re.findall(r"^Source: (\S+)", excerpts, re.M)
+        answer = "The document explains this in the cited passages. " * 4
+        return f"{answer.strip()}\nSOURCES: {', '.join(sources[:2])}"
+    if "<END_OF_TURN>" in prompt:
+        # SalesGPT's utterance.
+        return "Thanks for taking my call, do you have a minute to talk? <END_OF_TURN>"
+    return (
+        "Dear team,\n\nThank you for the update. I have reviewed the points you "
+        "raised and will follow up with the details later this week.\n\n"
+        "Best regards"
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.num_connections += 1
+        time.sleep(self.server.fake.connection_latency)
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str, error_type: str) -> None:
+        self._send_json(status, {"error": {"message": message, "type": error_type}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.num_requests += 1
+            limited = self.server.over_rate_limit()
+        if limited:
+            self._send_error(429, "Rate limit reached for requests", "requests")
+            return
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            prompt = "\n".join(m.get("content", "") for m in request["messages"])
+            self._completion(request, prompt, chat=True)
+        elif self.path.endswith("/completions"):
+            prompt = request["prompt"]
+            if isinstance(prompt, list):
+                prompt = prompt[0]
+            self._completion(request, prompt, chat=False)
+        else:
+            self._send_error(404, f"Unknown endpoint {self.path}", "invalid_request_error")
+
+    def _embeddings(self, request: Dict[str, Any]) -> None:
+        fake = self.server.fake
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(fake.latency)
+        if len(inputs) > fake.max_batch_inputs:
+            self._send_error(
+                400,
+                f"Too many inputs: {len(inputs)} > {fake.max_batch_inputs}",
+                "invalid_request_error",
+            )
+            return
+
+        data = []
+        for i, text in enumerate(inputs):
+            embedding: Any = fake_embedding(text, fake.dim)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(array("f", embedding).tobytes()).decode()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        with self.server.lock:
+            self.server.num_inputs += len(inputs)
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "text-embedding-ada-002"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+
+    def _completion(self, request: Dict[str, Any], prompt: str, chat: bool) -> None:
+        fake = self.server.fake
+        text = fake.reply(prompt)
+        # Roughly one token per word and the whitespace before it.
+        tokens = re.findall(r"\s*\S+", text)
+        with self.server.lock:
+            self.server.num_completion_tokens += len(tokens)
+        kind = "chat.completion" if chat else "text_completion"
+        model = request.get("model", "gpt-3.5-turbo")
+        time.sleep(fake.completion_latency)
+
+        def choice(piece: Optional[str], finish_reason: Optional[str]) -> Dict[str, Any]:
+            if chat:
+                key = "delta" if request.get("stream") else "message"
+                content = {"content": piece} if piece is not None else {}
+                if key == "message":
+                    content["role"] = "assistant"
+                return {"index": 0, key: content, "finish_reason": finish_reason}
+            return {
+                "index": 0,
+                "text": piece or "",
+                "logprobs": None,
+                "finish_reason": finish_reason,
+            }
+
+        if not request.get("stream"):
+            time.sleep(len(tokens) / fake.tokens_per_second)
+            self._send_json(
+                200,
+                {
+                    "id": "cmpl-fake",
+                    "object": kind,
+                    "model": model,
+                    "choices": [choice(text, "stop")],
+                    "usage": {
+                        "prompt_tokens": len(prompt) // 4,
+                        "completion_tokens": len(tokens),
+                        "total_tokens": len(prompt) // 4 + len(tokens),
+                    },
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        # Over HTTP/1.1 the stream is chunked and the connection kept open;
+        # over HTTP/1.0 the stream ends with the connection.
+        chunked = self.protocol_version == "HTTP/1.1"
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+            self.wfile.flush()
+
+        chunks = [choice(token, None) for token in tokens] + [choice(None, "stop")]
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(1 / fake.tokens_per_second)
+            event = {"id": "cmpl-fake", "object": f"{kind}.chunk", "model": model}
+            event["choices"] = [chunk]
+            write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        write(b"data: [DONE]\n\n")
+        if chunked:
+            write(b"")
+
+
+class _KeepAliveHandler(_Handler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent in separate writes; with Nagle's algorithm
+    # the body would wait for the client's delayed ACK of the headers.
+    disable_nagle_algorithm = True
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections opened at once by many
+    # clients, which then retry a second later.
+    request_queue_size = 128
+
+    def __init__(self, fake: "FakeOpenAIServer") -> None:
+        super().__init__((fake.host, fake.port), _KeepAliveHandler if fake.keep_alive else _Handler)
+        self.fake = fake
+        self.lock = threading.Lock()
+        self.num_connections = 0
+        self.num_requests = 0
+        self.num_inputs = 0
+        self.num_rate_limited = 0
+        self.num_completion_tokens = 0
+        self._recent: Deque[float] = deque()
+        self._random = random.Random(fake.seed)
+
+    def over_rate_limit(self) -> bool:
+        """Sliding one-minute window check, plus randomly injected 429s;
+        call with `lock` held."""
+        if self.fake.error_rate and self._random.random() < self.fake.error_rate:
+            self.num_rate_limited += 1
+            return True
+        rpm = self.fake.requests_per_minute
+        if rpm is None:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+        if len(self._recent) >= rpm:
+            self.num_rate_limited += 1
+            return True
+        self._recent.append(now)
+        return False
+
+
+class FakeOpenAIServer:
+    """Serves fake ``/embeddings``, ``/completions`` and
+    ``/chat/completions`` responses on a local port. Completions can be
+    streamed.
+
+    Args:
+        latency: Seconds to wait before answering each embeddings request.
+        dim: Dimension of the returned embeddings.
+        max_batch_inputs: Requests with more inputs than this are rejected
+            with a 400 ``invalid_request_error``.
+        requests_per_minute: Requests over this limit within a sliding
+            minute are answered with a 429, like the real API.
+        completion_latency: Seconds before the first completion token.
+        tokens_per_second: Rate at which completion tokens are generated.
+        error_rate: Fraction of requests answered with an injected 429.
+        reply: Maps a prompt (or the joined chat messages) to the completion.
+        seed: Seed for the injected errors.
+        keep_alive: Keep connections open between requests, as HTTP/1.1
+            servers do. Otherwise every request gets a new connection.
+        connection_latency: Seconds before a new connection is served,
+            standing in for the TCP and TLS handshakes.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        dim: int = 1536,
+        max_batch_inputs: int = 2048,
+        requests_per_minute: Optional[int] = None,
+        completion_latency: float = 0.2,
+        tokens_per_second: float = 100.0,
+        error_rate: float = 0.0,
+        reply: Callable[[str], str] = default_reply,
+        seed: int = 0,
+        keep_alive: bool = False,
+        connection_latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.dim = dim
+        self.max_batch_inputs = max_batch_inputs
+        self.requests_per_minute = requests_per_minute
+        self.completion_latency = completion_latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.reply = reply
+        self.seed = seed
+        self.keep_alive = keep_alive
+        self.connection_latency = connection_latency
+        self.host = host
+        self.port = port
+        self._server: _Server | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "Server is not running"
+        return f"http://{self.host}:{self._server.server_address[1]}/v1"
+
+    @property
+    def num_connections(self) -> int:
+        return self._server.num_connections if self._server else 0
+
+    @property
+    def num_requests(self) -> int:
+        return self._server.num_requests if self._server else 0
+
+    @property
+    def num_inputs(self) -> int:
+        return self._server.num_inputs if self._server else 0
+
+    @property
+    def num_rate_limited(self) -> int:
+        return self._server.num_rate_limited if self._server else 0
+
+    @property
+    def num_completion_tokens(self) -> int:
+        return self._server.num_completion_tokens if self._server else 0
+
+    def start(self) -> "FakeOpenAIServer":
+        self._server = _Server(self)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
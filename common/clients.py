@@ -0,0 +1,203 @@
+"""Process-wide OpenAI clients, sharing connections and identical requests.
+
+    from common.clients import get_client
+
+    llm = get_client(OpenAI, temperature=0, openai_api_key=api_key)
+
+returns the same LLM for the same class and parameters in every session
+and thread. Its requests go through one pool of keep-alive connections:
+the openai package otherwise opens a session per thread, and Streamlit
+runs every rerun on a new thread, so every question paid for a new
+connection. Identical deterministic requests in flight at the same time,
+from any session, are sent once and their callers share the response.
+
+Streamed requests are never shared. DocumentGPT streams every answer, so
+only its embedding requests are coalesced, not its answers.
+"""
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type, TypeVar
+
+import openai
+import requests
+from openai.api_requestor import MAX_CONNECTION_RETRIES
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs at most one call at a time per key. Callers with the key of a
+    call in flight wait for it, and get its result or exception, instead of
+    calling again. Results are not kept once the call is done."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.coalesced = 0
+        self._futures: Dict[Hashable, Future] = {}
+        self._tasks: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._futures[key] = Future()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._futures[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._futures[key]
+        future.set_result(result)
+        return result
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """Like do(), for coroutine functions. The call runs as a task of its
+        own, so a caller cancelled by a timeout does not cancel it for the
+        others."""
+        task_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is None:
+                task = self._tasks[task_key] = asyncio.ensure_future(fn(*args, **kwargs))
+                task.add_done_callback(lambda _: self._forget_task(task_key))
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget_task(self, task_key: Tuple[asyncio.AbstractEventLoop, Hashable]) -> None:
+        with self._lock:
+            self._tasks.pop(task_key, None)
+
+
+class CoalescingClient:
+    """Wraps an openai API resource, such as openai.Completion, so that
+    identical `create` requests in flight share one call. Only requests whose
+    response is deterministic are shared: not streamed, and at temperature 0
+    (or without one, as embeddings). Sampled replies stay independent.
+    Requests with different API keys are never shared. Callers share the
+    response object, and must not modify it.
+
+    Requests without an API key get `api_key`, as older langchain versions
+    do not send the client's own key.
+    """
+
+    def __init__(self, resource: Any, single_flight: SingleFlight, api_key: Optional[str] = None) -> None:
+        self.resource = resource
+        self.single_flight = single_flight
+        self.api_key = api_key
+
+    def _prepare(self, kwargs: Dict[str, Any]) -> Optional[Hashable]:
+        """Add the API key to the request, and return its coalescing key, or
+        None if it must be sent on its own."""
+        if self.api_key and not kwargs.get("api_key"):
+            kwargs["api_key"] = self.api_key
+        if kwargs.get("stream") or kwargs.get("temperature", 0) != 0:
+            return None
+        return (self.resource.__name__, json.dumps(kwargs, sort_keys=True, default=repr))
+
+    def create(self, **kwargs: Any) -> Any:
+        key = self._prepare(kwargs)
+        if key is None:
+            return self.resource.create(**kwargs)
+        return self.single_flight.do(key, self.resource.create, **kwargs)
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        key = self._prepare(kwargs)
+        if key is None:
+            return await self.resource.acreate(**kwargs)
+        return await self.single_flight.ado(key, self.resource.acreate, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.resource, name)
+
+
+class _SharedAdapter(HTTPAdapter):
+    """An adapter whose connection pool outlives the sessions it is mounted
+    on: openai closes and replaces its sessions every few minutes."""
+
+    def close(self) -> None:
+        pass
+
+
+_adapter: Optional[_SharedAdapter] = None
+_adapter_lock = threading.Lock()
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", _adapter)  # type: ignore
+    session.mount("http://", _adapter)  # type: ignore
+    return session
+
+
+def use_shared_connection_pool(max_connections: int = 32) -> None:
+    """Send the openai package's synchronous requests, on every thread,
+    through one pool of keep-alive connections per host. Does nothing if
+    openai.requestssession is set already."""
+    global _adapter
+    with _adapter_lock:
+        if openai.requestssession is not None:
+            return
+        _adapter = _SharedAdapter(
+            pool_connections=4, pool_maxsize=max_connections, max_retries=MAX_CONNECTION_RETRIES
+        )
+        openai.requestssession = _make_session
+
+
+_single_flight = SingleFlight()
+_clients: "OrderedDict[Hashable, Any]" = OrderedDict()
+_clients_lock = threading.Lock()
+# One client per API key and parameters; keys of past sessions are dropped.
+_MAX_CLIENTS = 256
+
+
+def get_client(cls: Type[T], **params: Any) -> T:
+    """The process-wide instance of `cls`, a langchain LLM or embeddings
+    class, built with `params`, which must be hashable.
+
+    The client uses the shared connection pool and coalesces identical
+    deterministic requests. It also sends its own API key with every request:
+    langchain sets the key globally on the openai module, so otherwise every
+    client would use the key of whichever client was built last.
+    """
+    key = (cls, tuple(sorted(params.items())))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+    use_shared_connection_pool()
+    client = cls(**params)
+    client.client = CoalescingClient(  # type: ignore
+        client.client, _single_flight, params.get("openai_api_key")
+    )
+    with _clients_lock:
+        # Another thread may have built it meanwhile; either will do.
+        client = _clients.setdefault(key, client)
+        while len(_clients) > _MAX_CLIENTS:
+            _clients.popitem(last=False)
+    return client
+
+
+def client_stats() -> Dict[str, int]:
+    return {
+        "clients": len(_clients),
+        "calls": _single_flight.calls,
+        "coalesced": _single_flight.coalesced,
+    }
@@ -0,0 +1,59 @@
+"""Background imports of heavy modules, so entry points start fast.
+
+langchain alone takes about two seconds to import, and importing any of its
+submodules imports all of it. An entry point that needs it only after some
+user input starts importing it in the background instead:
+
+    from common.lazy import import_preloaded, preload
+
+    preload("utils")          # returns at once
+    ...                       # render the page, parse arguments
+    utils = import_preloaded("utils")
+
+Preloads are started once per process, so Streamlit reruns do not start
+them again.
+"""
+import importlib
+import logging
+import sys
+import threading
+from types import ModuleType
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+_preloads: Dict[str, threading.Thread] = {}
+_lock = threading.Lock()
+
+
+def _import(module_name: str) -> None:
+    try:
+        importlib.import_module(module_name)
+    except Exception:
+        # import_preloaded imports it again, and raises the error there.
+        logger.debug("Could not preload %s", module_name, exc_info=True)
+
+
+def preload(*module_names: str) -> None:
+    """Start importing modules on a background thread each, unless they are
+    imported or being imported already."""
+    with _lock:
+        for module_name in module_names:
+            if module_name in sys.modules or module_name in _preloads:
+                continue
+            thread = threading.Thread(
+                target=_import, args=(module_name,), name=f"preload-{module_name}", daemon=True
+            )
+            _preloads[module_name] = thread
+            thread.start()
+
+
+def import_preloaded(module_name: str) -> ModuleType:
+    """The module, once its preload is done. Waiting for the preload, rather
+    than importing it alongside, avoids two threads initializing the same
+    modules at once. Imports it here if it was not preloaded."""
+    with _lock:
+        thread = _preloads.get(module_name)
+    if thread is not None:
+        thread.join()
+    return importlib.import_module(module_name)
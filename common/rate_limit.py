@@ -0,0 +1,102 @@
+"""Client-side rate limiting for OpenAI requests."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills continuously.
+
+    Callers may take more tokens than are available; the bucket then goes
+    into debt and the caller sleeps until the debt is paid off. This keeps
+    waiting callers in arrival order without polling.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` tokens and return how many seconds to wait before
+        they may be used."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._last_refill) * self.refill_per_second,
+            )
+            self._last_refill = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    def acquire(self, amount: float = 1) -> None:
+        """Block until `amount` tokens are available."""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Paces requests under a requests/min and a tokens/min limit.
+
+    Bursts are capped at one second's worth of budget, so that a client that
+    has been idle cannot overshoot the provider's sliding one-minute window.
+    A limit of ``None`` disables that bucket.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> None:
+        self.request_bucket = (
+            TokenBucket(max(requests_per_minute / 60, 1), requests_per_minute / 60)
+            if requests_per_minute
+            else None
+        )
+        self.token_bucket = (
+            TokenBucket(max(tokens_per_minute / 60, 1), tokens_per_minute / 60)
+            if tokens_per_minute
+            else None
+        )
+
+    def acquire(self, num_tokens: int) -> None:
+        """Block until one request carrying `num_tokens` tokens may be sent."""
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.reserve(num_tokens))
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiters: "OrderedDict[Tuple[Optional[str], Optional[int], Optional[int]], RateLimiter]" = OrderedDict()
+_limiters_lock = threading.Lock()
+# One limiter per API key and limits; keys of past sessions are dropped.
+_MAX_LIMITERS = 256
+
+
+def get_rate_limiter(
+    api_key: Optional[str],
+    requests_per_minute: Optional[int],
+    tokens_per_minute: Optional[int],
+) -> RateLimiter:
+    """Get the process-wide rate limiter for an API key, so that every
+    client using the same key shares one budget."""
+    key = (api_key, requests_per_minute, tokens_per_minute)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+            while len(_limiters) > _MAX_LIMITERS:
+                _limiters.popitem(last=False)
+        else:
+            _limiters.move_to_end(key)
+        return limiter
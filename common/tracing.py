@@ -0,0 +1,333 @@
+"""Lightweight tracing and latency histograms shared by the apps.
+
+Code is timed with nested spans:
+
+    from common.tracing import span, traced
+
+    with span("documentgpt.vector_search", k=5):
+        ...
+
+    @traced("salesgpt.step")
+    def step(self):
+        ...
+
+Finishing a span only reads the clock and puts a record on a queue. A
+background exporter thread drains the queue into per-operation latency
+histograms and passes the records to listeners, so aggregation, logging and
+dumps stay off the request path. Percentiles are available from
+`get_tracer().summary()`, from a periodic JSON dump (TRACE_DUMP_PATH,
+TRACE_DUMP_INTERVAL_SECONDS) or from a local HTTP endpoint
+(TRACE_METRICS_PORT).
+"""
+import asyncio
+import atexit
+import functools
+import itertools
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Histogram buckets grow by 2 ** (1 / 8), about 9%, from 1 ns to ~18 minutes.
+_SUB_BUCKETS = 8
+_NUM_BUCKETS = 40 * _SUB_BUCKETS
+
+
+class Histogram:
+    """Log-bucketed latency histogram with ~9% relative precision.
+
+    Not thread-safe: only the exporter thread records into it.
+    """
+
+    __slots__ = ("counts", "count", "total_ns", "min_ns", "max_ns")
+
+    def __init__(self) -> None:
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    def record(self, duration_ns: int) -> None:
+        bucket = int(math.log2(max(duration_ns, 1)) * _SUB_BUCKETS)
+        self.counts[min(bucket, _NUM_BUCKETS - 1)] += 1
+        if not self.count or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        self.count += 1
+        self.total_ns += duration_ns
+
+    def percentile(self, q: float) -> int:
+        """Upper bound, in nanoseconds, of the bucket holding the q-th
+        percentile, clamped to the observed range."""
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                upper = int(2 ** ((bucket + 1) / _SUB_BUCKETS))
+                return max(self.min_ns, min(upper, self.max_ns))
+        return self.max_ns
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ns / self.count / 1e6 if self.count else 0.0,
+            "p50_ms": self.percentile(50) / 1e6,
+            "p95_ms": self.percentile(95) / 1e6,
+            "p99_ms": self.percentile(99) / 1e6,
+            "max_ms": self.max_ns / 1e6,
+        }
+
+
+class SpanRecord(NamedTuple):
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    start_ns: int
+    duration_ns: int
+    attributes: Dict[str, Any]
+    error: Optional[str]
+
+
+_span_ids = itertools.count(1)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation. Spans opened while another is active become its
+    children; use as a (sync) context manager."""
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "attributes",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "_token",
+    )
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = 0
+        self.parent_id: Optional[int] = None
+        self.start_ns = 0
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = next(_span_ids)
+        self._token = _current_span.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        _current_span.reset(self._token)
+        self.tracer.exporter.export(
+            SpanRecord(
+                self.name,
+                self.span_id,
+                self.parent_id,
+                self.start_ns,
+                duration_ns,
+                self.attributes,
+                exc_type.__name__ if exc_type is not None else None,
+            )
+        )
+
+
+class QueueExporter:
+    """Aggregates finished spans on a background thread.
+
+    `export` is a non-blocking queue put. The exporter thread records each
+    span's duration in the histogram of its name and calls the listeners,
+    whose errors are logged and ignored.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, Histogram] = {}
+        self.listeners: List[Callable[[SpanRecord], None]] = []
+        self._queue: "queue.SimpleQueue[SpanRecord]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="trace-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, record: SpanRecord) -> None:
+        self._queue.put(record)
+
+    def add_listener(self, listener: Callable[[SpanRecord], None]) -> None:
+        self.listeners.append(listener)
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if isinstance(record, threading.Event):
+                # Flush marker: everything queued before it is processed.
+                record.set()
+                continue
+            with self._lock:
+                histogram = self.histograms.get(record.name)
+                if histogram is None:
+                    histogram = self.histograms[record.name] = Histogram()
+                histogram.record(record.duration_ns)
+            for listener in tuple(self.listeners):
+                try:
+                    listener(record)
+                except Exception:
+                    logger.exception("Trace listener %r failed", listener)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the spans exported so far have been processed."""
+        done = threading.Event()
+        self._queue.put(done)  # type: ignore
+        return done.wait(timeout)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+
+class Tracer:
+    """Creates spans and exposes the latency percentiles of each operation."""
+
+    def __init__(self, exporter: Optional[QueueExporter] = None) -> None:
+        self.exporter = exporter or QueueExporter()
+
+    def span(self, name: str, **attributes: Any) -> Span:
+        return Span(self, name, attributes)
+
+    def traced(self, name: Optional[str] = None) -> Callable[[F], F]:
+        """Decorator that runs each call of a function, or coroutine
+        function, in a span named `name` (default: its qualified name)."""
+
+        def decorator(func: F) -> F:
+            span_name = name or func.__qualname__
+            if asyncio.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper  # type: ignore
+
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+
+            return wrapper  # type: ignore
+
+        return decorator
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 and counts per operation, in milliseconds."""
+        return self.exporter.summary()
+
+    def dump(self, path: str) -> None:
+        """Atomically write the summary to `path` as JSON."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"time": time.time(), "operations": self.summary()}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_periodic_dump(self, path: str, interval: float = 60.0) -> threading.Thread:
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError:
+                    logger.exception("Could not write trace summary to %s", path)
+
+        thread = threading.Thread(target=run, name="trace-dump", daemon=True)
+        thread.start()
+        return thread
+
+    def serve_metrics(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the summary as JSON at http://host:port/metrics."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(tracer.summary()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(
+            target=server.serve_forever, name="trace-metrics", daemon=True
+        ).start()
+        return server
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Returns the process-wide tracer, starting the dump and metrics
+    endpoint configured by environment variables on first use."""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                tracer = Tracer()
+                dump_path = os.environ.get("TRACE_DUMP_PATH")
+                if dump_path:
+                    tracer.start_periodic_dump(
+                        dump_path,
+                        float(os.environ.get("TRACE_DUMP_INTERVAL_SECONDS", 60)),
+                    )
+                port = os.environ.get("TRACE_METRICS_PORT")
+                if port:
+                    try:
+                        tracer.serve_metrics(int(port))
+                    except OSError:
+                        # Another process of the app already serves it.
+                        logger.warning("Trace metrics port %s is in use", port)
+                # Let the exporter drain, so listeners see the last spans.
+                atexit.register(tracer.exporter.flush, 1.0)
+                _tracer = tracer
+    return _tracer
+
+
+def span(name: str, **attributes: Any) -> Span:
+    """Open a span on the process-wide tracer."""
+    return get_tracer().span(name, **attributes)
+
+
+def traced(name: Optional[str] = None) -> Callable[[F], F]:
+    """Decorator that traces a function on the process-wide tracer."""
+    return get_tracer().traced(name)